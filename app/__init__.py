@@ -1,15 +1,37 @@
 # app/__init__.py
-from flask import Flask
-from flask_cors import CORS
-from app.routes.audit_routes import audit_bp
-from app.config import Config
+import threading
+
+_app_lock = threading.Lock()
+
+def create_app(config=None):
+    """
+    Build the application: config overrides Config, and the app gets its own
+    storage, job queue, analysis cache and analyzer backend. What the whole
+    process shares, the OpenAI client with its rate limits and retries and
+    the analyzer thread pool, is configured by Config alone. Flask and the
+    routes are imported here so that importing app.utils or app.db for the
+    command line tools stays cheap.
+    """
+    from flask import Flask
+    from flask_cors import CORS
+    from app.config import Config
+    from app.routes import audit_routes
+    from app.utils.jsonprovider import create_json_provider
 
-def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config:
+        app.config.update(config)
+    app.json = create_json_provider(app)
     CORS(app)
-    app.register_blueprint(audit_bp)
+    audit_routes.init_app(app)
     return app
 
-app = create_app()
-
+def __getattr__(name):
+    # `from app import app` builds the default application on first access
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if 'app' not in globals():
+            globals()['app'] = create_app()
+    return globals()['app']
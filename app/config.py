@@ -1,4 +1,134 @@
 # app/config.py
+import os
+import sys
+
 class Config:
     DEBUG = True
     PORT = 5000
+
+    # SQLite database file, app/audit.db when unset
+    DATABASE_PATH = os.getenv('AUDIT_DB_PATH')
+
+    # SQLite connection settings (one long-lived connection per thread)
+    DB_JOURNAL_MODE = 'WAL'  # readers don't block the writer
+    DB_SYNCHRONOUS = 'NORMAL'  # safe with WAL, fsyncs only at checkpoints
+    DB_BUSY_TIMEOUT = 5.0  # seconds to wait for a lock before failing
+    DB_STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+    DB_FETCH_SIZE = 50  # rows fetched at a time when streaming results
+
+    # Revision texts: a full snapshot at least every N revisions, deltas in between
+    REVISION_SNAPSHOT_INTERVAL = 16
+    REVISION_CACHE_ENTRIES = 32  # materialized texts kept in memory
+
+    # Line diff algorithm for diffs and revision deltas: patience, myers or difflib
+    DIFF_ENGINE = 'patience'
+
+    # Uploads. Flask refuses request bodies over MAX_CONTENT_LENGTH with a
+    # 413 before reading them; each document is also limited on its own
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024
+    MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # bytes read and validated at a time
+
+    # Where analyses come from: 'openai', 'local' (offline rules) or 'tiered'
+    # (rules first, OpenAI only for chunks the rules can't settle)
+    ANALYZER_BACKEND = os.getenv('ANALYZER_BACKEND', 'openai')
+
+    # What the analysis prompt asks of the model: 'full' (findings quoted as
+    # sentences) or 'compact' (the sentences are numbered and the model
+    # answers with their numbers, which are turned back into sentences here)
+    ANALYSIS_SCHEMA = os.getenv('ANALYSIS_SCHEMA', 'full')
+
+    # Worker threads shared by all requests for outbound OpenAI calls
+    ANALYZER_MAX_WORKERS = 32
+    # Long documents are analyzed in chunks of at most this many (estimated) tokens
+    ANALYSIS_CHUNK_TOKENS = 1500
+    # Upper bound on concurrent OpenAI calls for a single document
+    ANALYSIS_MAX_CALLS_IN_FLIGHT = 16
+
+    # Account rate limits shared by all OpenAI calls; None disables a budget
+    OPENAI_REQUESTS_PER_MINUTE = None
+    OPENAI_TOKENS_PER_MINUTE = None
+    # Per-attempt timeout, retries of 429s, 5xx responses and timeouts with
+    # jittered exponential backoff, and a deadline for each call that covers
+    # waiting for the rate limits and every retry
+    OPENAI_TIMEOUT = 60.0
+    OPENAI_MAX_RETRIES = 4
+    OPENAI_RETRY_BASE_DELAY = 0.5
+    OPENAI_RETRY_MAX_DELAY = 30.0
+    OPENAI_CALL_DEADLINE = 180.0
+
+    # Cache of OpenAI results for identical submissions
+    CACHE_ENABLED = True
+    CACHE_MEMORY_ENTRIES = 256  # in-process LRU in front of the llm_cache table
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    CACHE_TTL_SECONDS = 30 * 24 * 3600
+    # A disk hit only rewrites the entry's last access time, which orders
+    # evictions, once the stored one is older than this
+    CACHE_ACCESS_RESOLUTION = 300
+
+    # Async mode for /analyze and /re_audit (per request with ?async=true)
+    ASYNC_JOBS = False  # make async the default for every request
+    JOB_WORKERS = 4
+    JOB_QUEUE_MAX_DEPTH = 100  # queued jobs beyond this get a 429
+    JOB_POLL_INTERVAL = 2.0
+    # A running job is leased to its process, which renews the lease every
+    # third of this; jobs whose lease runs out are requeued
+    JOB_LEASE_SECONDS = 60.0
+    # Finished jobs, with their payload and result, are deleted this long
+    # after they finish; 0 keeps them
+    JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+    # POST /analyze/batch
+    BATCH_MAX_WORKERS = 8  # documents analyzed at the same time
+    BATCH_MAX_DOCUMENTS = 1000
+    # Total size of a batch's documents once decompressed, 0 for no limit
+    BATCH_MAX_BYTES = 256 * 1024 * 1024
+
+    # GET /history pagination
+    HISTORY_MAX_PAGE_SIZE = 500
+
+    # Responses. RESPONSE_VIEW is the default of ?view: 'full', or 'lean' for
+    # revisions with the text once and findings as offsets into it.
+    # JSON_PROVIDER: 'auto' (orjson when installed), 'orjson' or 'stdlib'
+    RESPONSE_VIEW = 'full'
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
+    # gzip or brotli (when installed) for bodies of at least COMPRESS_MIN_BYTES,
+    # as the client's Accept-Encoding allows; streamed bodies are compressed
+    # on the fly, except Server-Sent Events
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_BYTES = 2048
+    COMPRESS_LEVEL = 6  # gzip, 1-9
+    COMPRESS_BR_QUALITY = 4  # brotli, 0-11
+
+    # GET /search
+    SEARCH_DEFAULT_PAGE_SIZE = 20
+    SEARCH_MAX_PAGE_SIZE = 100
+    # Results per page whose texts are rebuilt for snippets; the rest only get
+    # snippets of their findings
+    SEARCH_SNIPPET_TEXTS = 20
+
+    # GET /stats/<kind>
+    STATS_DEFAULT_LIMIT = 20
+    STATS_MAX_LIMIT = 500
+
+    # Timings, sizes and token counts exposed on GET /metrics
+    METRICS_ENABLED = True
+    # Requests sending this header get a Server-Timing header with their stages
+    METRICS_TRACE_HEADER = 'X-Trace'
+    # Seconds between stack samples while the profiler runs (POST /metrics/profiler)
+    PROFILER_INTERVAL = 0.1
+    # The /metrics/profiler and /metrics/profile endpoints answer only requests
+    # sending this value in an X-Profiler-Token header; unset, they are off
+    PROFILER_TOKEN = os.getenv('PROFILER_TOKEN')
+
+def setting(name):
+    """
+    The value of name in the config of the app handling the current request
+    or job (see create_app), or in Config outside any app. Flask is only
+    asked once something has imported it, so the command line tools, which
+    never run inside an app, don't load it.
+    """
+    flask = sys.modules.get('flask')
+    if flask is not None and flask.has_app_context():
+        return flask.current_app.config.get(name, getattr(Config, name))
+    return getattr(Config, name)
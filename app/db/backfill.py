@@ -0,0 +1,53 @@
+# app/db/backfill.py
+
+"""
+Bring an existing audit.db up to date and fill the tables derived from
+stored revisions: the revision_search index and the hazards,
+compliance_issues, incidents and regulatory_comments tables.
+
+Opening the database applies any pending migrations, which fill these for
+revisions stored before the tables existed. --rebuild empties and refills
+them from scratch, e.g. after restoring revisions by hand.
+
+    python -m app.db.backfill app/audit.db --rebuild
+"""
+
+import argparse
+import os
+import time
+from app.utils.storage import (
+    DEFAULT_DB_PATH, FINDINGS_TEXT_COLUMNS, DatabaseConnection, rebuild_findings, rebuild_search_index
+)
+
+def backfill(db_path, rebuild=False):
+    """Migrate db_path, optionally rebuild the derived tables, and return their row counts"""
+    db = DatabaseConnection(db_path)
+    try:
+        with db.connection() as conn:
+            if rebuild:
+                rebuild_findings(conn)
+                rebuild_search_index(conn)
+            counts = {'revisions': conn.execute('SELECT COUNT(*) FROM revisions').fetchone()[0]}
+            for table in FINDINGS_TEXT_COLUMNS:
+                counts[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return counts
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('db_path', nargs='?', default=DEFAULT_DB_PATH)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="empty and refill the derived tables instead of only migrating")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_path):
+        parser.error(f"Database file '{args.db_path}' not found.")
+    start = time.perf_counter()
+    counts = backfill(args.db_path, args.rebuild)
+    print(f"{args.db_path} is up to date ({time.perf_counter() - start:.1f} s)")
+    for table, count in counts.items():
+        print(f"  {table:<20} {count:>10} rows")
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,289 @@
 # app/db/db_query.py
 
-import sqlite3
+"""
+Inspect and export an audit database without disturbing the live service.
+
+The database is opened read-only (mode=ro), so the tool never takes a write
+lock or applies migrations; --immutable also skips locking altogether, for
+backups and snapshots that nothing writes to. Rows are streamed with
+fetchmany, so memory stays constant however large the database is.
+
+    python -m app.db.db_query tables
+    python -m app.db.db_query revisions --doc-id 1f0c... --fields timestamp,analysis
+    python -m app.db.db_query export --format ndjson -o revisions.ndjson --since 2024-01-01 --hazard wiring
+"""
+
+import argparse
+import csv
+import json
 import os
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+from rich import box
 from rich.console import Console
 from rich.table import Table
-from rich.panel import Panel
-from rich import box
+from app.config import Config
+from app.utils.blobs import TextCache
+from app.utils.storage import DEFAULT_DB_PATH, REVISION_FIELDS, revision_columns, revision_field
 
-def print_all_entries(db_path):
-    console = Console()
-    
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
-    # This makes rows accessible as dictionaries
+EXPORT_FORMATS = ('ndjson', 'csv', 'parquet')
+
+def open_readonly(db_path, immutable=False):
+    """
+    A read-only connection to db_path. With immutable, SQLite assumes the
+    file can't change while it is open and skips locking; only use it on a
+    copy, since it also ignores changes still in the live database's WAL.
+    """
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Get the names of all tables in the database
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row['name'] for row in cursor.fetchall()]
-
-    if not tables:
-        console.print("[bold red]No tables found in the database.[/bold red]")
-    else:
-        for table in tables:
-            # Fetch all rows from the table
-            cursor.execute(f"SELECT * FROM {table};")
-            rows = cursor.fetchall()
-
-            # Create a Rich Table for display
-            rich_table = Table(title=f"Table: {table}", box=box.SIMPLE_HEAVY)
-            
-            if rows:
-                # Get column headers from the first row
-                headers = list(rows[0].keys())
-                for header in headers:
-                    rich_table.add_column(header, style="cyan", no_wrap=True)
-                # Add each row of values
-                for row in rows:
-                    row_values = [str(row[col]) for col in headers]
-                    rich_table.add_row(*row_values)
-                console.print(rich_table)
-            else:
-                console.print(Panel(f"[yellow]No rows found in table '{table}'.[/yellow]", title=table))
-
-    # Close the connection when done
-    conn.close()
+    return conn
+
+def read_schema(conn):
+    """
+    What the database opened by conn has, since the tool never migrates it:
+    {'version': PRAGMA user_version, 'columns': the revisions columns,
+    'tables': every table name}
+    """
+    return {
+        'version': conn.execute("PRAGMA user_version").fetchone()[0],
+        'columns': {row['name'] for row in conn.execute("PRAGMA table_info(revisions)")},
+        'tables': {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")},
+    }
+
+def revisions_query(fields=None, doc_ids=None, since=None, until=None, hazard=None, limit=None, schema=None):
+    """
+    The SELECT for revisions matching the filters, in (doc_id,
+    revision_number) order so each document's delta chain is read in
+    order. since and until bound the timestamp (until is exclusive) and
+    compare as ISO 8601 strings, so dates work too; hazard matches a
+    substring of any detected hazard, ignoring case.
+
+    schema is read_schema() of the database queried, None for one at the
+    latest version. Columns added by later migrations that it lacks are
+    selected as NULL, so the text columns of version 1 are used, and hazard
+    is matched in the stored analysis JSON if there is no hazards table.
+    Returns (output fields, query, params).
+    """
+    fields, columns = revision_columns(fields)
+    if schema is not None:
+        columns = [column if column in schema['columns'] else f"NULL AS {column}" for column in columns]
+    conditions = []
+    params = []
+    if doc_ids:
+        conditions.append(f"doc_id IN ({', '.join('?' * len(doc_ids))})")
+        params.extend(doc_ids)
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if hazard:
+        escaped = hazard.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        if schema is None or 'hazards' in schema['tables']:
+            conditions.append("id IN (SELECT revision_id FROM hazards WHERE text LIKE ? ESCAPE '\\')")
+        else:
+            conditions.append("EXISTS (SELECT 1 FROM json_each(analysis, '$.detected_hazards') "
+                              "WHERE value LIKE ? ESCAPE '\\')")
+        params.append(f"%{escaped}%")
+    query = f"SELECT doc_id, {', '.join(columns)} FROM revisions"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY doc_id, revision_number"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return ['doc_id'] + fields, query, params
+
+def iter_revisions(conn, fields, query, params, batch_size=None):
+    """Yield the rows of a revisions_query() as dicts, with blob texts materialized"""
+    texts = TextCache(Config.REVISION_CACHE_ENTRIES)
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size or Config.DB_FETCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield {
+                field: row['doc_id'] if field == 'doc_id' else revision_field(conn, row, field, texts)
+                for field in fields
+            }
+
+def _flat(value):
+    # The analysis is a dict; CSV cells and Parquet string columns hold it as JSON
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+
+def write_ndjson(rows, out):
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def write_csv(rows, out, fields):
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([_flat(row[field]) for field in fields])
+        count += 1
+    return count
+
+def write_parquet(rows, path, fields, row_group_size):
+    """Write rows to a Parquet file one row group at a time. Needs pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (field, pa.int64() if field == 'revision_number' else pa.string()) for field in fields
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        group = {field: [] for field in fields}
+        for row in rows:
+            for field in fields:
+                group[field].append(_flat(row[field]))
+            count += 1
+            if count % row_group_size == 0:
+                writer.write_batch(pa.record_batch(group, schema=schema))
+                group = {field: [] for field in fields}
+        if group[fields[0]]:
+            writer.write_batch(pa.record_batch(group, schema=schema))
+    return count
+
+def export(conn, fmt, output, fields, query, params, batch_size=None):
+    """Export the rows of a revisions_query() to output ('-' for stdout). Returns the row count."""
+    batch_size = batch_size or Config.DB_FETCH_SIZE
+    rows = iter_revisions(conn, fields, query, params, batch_size)
+    if fmt == 'parquet':
+        return write_parquet(rows, output, fields, max(batch_size, 1024))
+    if output == '-':
+        return write_ndjson(rows, sys.stdout) if fmt == 'ndjson' else write_csv(rows, sys.stdout, fields)
+    with open(output, 'w', encoding='utf-8', newline='') as out:
+        return write_ndjson(rows, out) if fmt == 'ndjson' else write_csv(rows, out, fields)
+
+def print_tables(conn, console):
+    """Row counts of every table"""
+    table = Table(title="Tables", box=box.SIMPLE_HEAVY)
+    table.add_column("table", style="cyan")
+    table.add_column("rows", justify="right")
+    names = [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    for name in names:
+        try:
+            count = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+        except sqlite3.OperationalError:
+            # e.g. the shadow tables of the FTS5 index
+            continue
+        table.add_row(name, f"{count:,}")
+    console.print(table)
+
+def print_revisions(rows, fields, console, page_size, width, pager):
+    """
+    Print rows as Rich tables of page_size rows, long values cut to width
+    characters. With pager, wait for Enter between pages (q stops).
+    """
+    def cell(value):
+        text = str(_flat(value)) if value is not None else ''
+        text = text.replace("\n", " ")
+        return text if len(text) <= width else text[:width - 1] + "…"
+
+    page = None
+    shown = 0
+    for row in rows:
+        if page is None:
+            page = Table(box=box.SIMPLE_HEAVY)
+            for field in fields:
+                page.add_column(field, style="cyan" if field == 'doc_id' else None, overflow='fold')
+        page.add_row(*[cell(row[field]) for field in fields])
+        shown += 1
+        if shown % page_size == 0:
+            console.print(page)
+            page = None
+            if pager and console.input("[dim]-- Enter for more, q to quit --[/dim] ").strip().lower() == 'q':
+                return shown
+    if page is not None:
+        console.print(page)
+    if not shown:
+        console.print("[yellow]No matching revisions.[/yellow]")
+    return shown
+
+def _fields(value):
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in REVISION_FIELDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown field(s): {', '.join(unknown)}")
+    return fields
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="database file (default: app/audit.db)")
+    parser.add_argument('--immutable', action='store_true',
+                        help="skip locking; only for copies nothing writes to")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('tables', help="row counts of every table")
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('--doc-id', action='append', dest='doc_ids', help="repeat for several documents")
+    filters.add_argument('--since', help="earliest timestamp, e.g. 2024-01-01")
+    filters.add_argument('--until', help="timestamp to stop before (exclusive)")
+    filters.add_argument('--hazard', help="only revisions with a detected hazard containing this text")
+    filters.add_argument('--fields', type=_fields,
+                         help=f"comma-separated subset of {','.join(REVISION_FIELDS)}")
+    filters.add_argument('--limit', type=int)
+
+    show = commands.add_parser('revisions', parents=[filters], help="page through revisions")
+    show.add_argument('--page-size', type=int, default=20)
+    show.add_argument('--width', type=int, default=60, help="characters shown per value")
+    show.add_argument('--no-pager', action='store_true', help="print every page without waiting")
+
+    dump = commands.add_parser('export', parents=[filters], help="export revisions")
+    dump.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    dump.add_argument('-o', '--output', default='-', help="output file, - for stdout (not for parquet)")
+    dump.add_argument('--batch-size', type=int, default=500, help="rows fetched at a time")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"Database file '{args.db}' not found.")
+    conn = open_readonly(args.db, args.immutable)
+    try:
+        console = Console(stderr=args.command == 'export')
+        if args.command == 'tables':
+            print_tables(conn, console)
+            return
+        schema = read_schema(conn)
+        if 'revisions' not in schema['tables']:
+            parser.error(f"Database '{args.db}' has no revisions table (schema version {schema['version']}); "
+                         "it needs migrating, which starting the app does.")
+        fields, query, params = revisions_query(args.fields, args.doc_ids, args.since, args.until,
+                                                args.hazard, args.limit, schema)
+        if args.command == 'revisions':
+            rows = iter_revisions(conn, fields, query, params, args.page_size)
+            print_revisions(rows, fields, console, args.page_size, args.width,
+                            pager=not args.no_pager and console.is_terminal)
+            return
+        if args.format == 'parquet':
+            if args.output == '-':
+                parser.error("--format parquet needs an --output file")
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+        start = time.perf_counter()
+        count = export(conn, args.format, args.output, fields, query, params, args.batch_size)
+        elapsed = time.perf_counter() - start
+        console.print(f"{count:,} revisions exported in {elapsed:.1f} s ({count / elapsed if elapsed else 0:,.0f} rows/s)")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    # Adjust the path to your database file if necessary.
-    db_file = "audit.db"
-    if not os.path.exists(db_file):
-        print(f"Database file '{db_file}' not found.")
-    else:
-        print_all_entries(db_file)
\ No newline at end of file
+    main()
@@ -0,0 +1,21 @@
+-- app/migrations/002_revision_blobs.sql
+
+-- Revision texts stored as zlib snapshots or line deltas against an earlier blob
+CREATE TABLE IF NOT EXISTS blobs (
+    id INTEGER PRIMARY KEY,
+    codec TEXT NOT NULL,
+    base_id INTEGER,
+    depth INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    FOREIGN KEY (base_id) REFERENCES blobs(id)
+);
+
+-- New revisions point at blobs and leave original_text and revised_document
+-- NULL; rows written before this migration keep their text columns.
+-- diff and revision_sections.revised_text may now hold zlib-compressed bytes.
+ALTER TABLE revisions ADD COLUMN original_blob_id INTEGER REFERENCES blobs(id);
+ALTER TABLE revisions ADD COLUMN revised_blob_id INTEGER REFERENCES blobs(id);
+
+-- 1 when analysis.original_text was left out because it equals the revision's original text
+ALTER TABLE revisions ADD COLUMN analysis_omits_text INTEGER NOT NULL DEFAULT 0;
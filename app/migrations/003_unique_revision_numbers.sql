@@ -0,0 +1,25 @@
+-- app/migrations/003_unique_revision_numbers.sql
+
+-- Concurrent re-audits could store two revisions with the same number.
+-- Renumber the revisions of any document affected, in storage order, and
+-- drop its per-section results, which are keyed on the old numbers and are
+-- only used to skip unchanged sections.
+DELETE FROM revision_sections WHERE doc_id IN (
+    SELECT doc_id FROM revisions GROUP BY doc_id, revision_number HAVING COUNT(*) > 1
+);
+
+UPDATE revisions SET revision_number = (
+    SELECT numbered.position FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY doc_id ORDER BY revision_number, id) AS position
+        FROM revisions
+    ) AS numbered
+    WHERE numbered.id = revisions.id
+)
+WHERE doc_id IN (
+    SELECT doc_id FROM revisions GROUP BY doc_id, revision_number HAVING COUNT(*) > 1
+);
+
+-- One revision per number, and a direct index lookup for a document's latest
+-- revision. It covers every query the old doc_id index served.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_revisions_doc_revision ON revisions(doc_id, revision_number);
+DROP INDEX IF EXISTS idx_revisions_doc_id;
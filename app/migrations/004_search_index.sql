@@ -0,0 +1,14 @@
+-- app/migrations/004_search_index.sql
+
+-- Full-text index over each revision's texts and extracted findings.
+-- Contentless, since the texts are stored compressed in blobs: the index
+-- only holds tokens, and its rowid is revisions.id. Existing revisions are
+-- indexed by the backfill that runs with this migration.
+CREATE VIRTUAL TABLE IF NOT EXISTS revision_search USING fts5(
+    original_text,
+    revised_document,
+    detected_hazards,
+    compliance_issues,
+    content='',
+    tokenize='porter unicode61'
+);
@@ -0,0 +1,53 @@
+-- app/migrations/005_findings_tables.sql
+
+-- Findings of each revision's analysis, one row each, so aggregates can be
+-- answered in SQL instead of by decoding revisions.analysis row by row.
+-- finding_key is the text normalized for grouping (case, spacing and a
+-- trailing full stop ignored). Existing revisions are filled in by the
+-- backfill that runs with this migration.
+CREATE TABLE IF NOT EXISTS hazards (
+    revision_id INTEGER NOT NULL REFERENCES revisions(id),
+    doc_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    finding_key TEXT NOT NULL,
+    PRIMARY KEY (revision_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS compliance_issues (
+    revision_id INTEGER NOT NULL REFERENCES revisions(id),
+    doc_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    finding_key TEXT NOT NULL,
+    PRIMARY KEY (revision_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS incidents (
+    revision_id INTEGER NOT NULL REFERENCES revisions(id),
+    doc_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    finding_key TEXT NOT NULL,
+    PRIMARY KEY (revision_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS regulatory_comments (
+    revision_id INTEGER NOT NULL REFERENCES revisions(id),
+    doc_id TEXT NOT NULL,
+    standard TEXT NOT NULL,
+    guideline TEXT,
+    finding_key TEXT NOT NULL,
+    PRIMARY KEY (revision_id, standard)
+);
+
+-- Grouped counts and distinct documents per finding are covering index
+-- scans, across all documents or within one
+CREATE INDEX IF NOT EXISTS idx_hazards_key ON hazards(finding_key, doc_id);
+CREATE INDEX IF NOT EXISTS idx_hazards_doc ON hazards(doc_id, finding_key);
+CREATE INDEX IF NOT EXISTS idx_compliance_issues_key ON compliance_issues(finding_key, doc_id);
+CREATE INDEX IF NOT EXISTS idx_compliance_issues_doc ON compliance_issues(doc_id, finding_key);
+CREATE INDEX IF NOT EXISTS idx_incidents_key ON incidents(finding_key, doc_id);
+CREATE INDEX IF NOT EXISTS idx_incidents_doc ON incidents(doc_id, finding_key);
+CREATE INDEX IF NOT EXISTS idx_regulatory_comments_key ON regulatory_comments(finding_key, doc_id);
+CREATE INDEX IF NOT EXISTS idx_regulatory_comments_doc ON regulatory_comments(doc_id, finding_key);
@@ -0,0 +1,8 @@
+-- app/migrations/006_blob_content_hash.sql
+
+-- SHA-256 of each blob's materialized text. A text that is already stored,
+-- under any document, is referenced again instead of being stored twice.
+-- Existing blobs are hashed by the backfill that runs with this migration.
+ALTER TABLE blobs ADD COLUMN content_hash BLOB;
+
+CREATE INDEX IF NOT EXISTS idx_blobs_content_hash ON blobs(content_hash);
@@ -0,0 +1,7 @@
+-- app/migrations/007_job_leases.sql
+
+-- The job queue running a job, and until when its claim holds. Every queue
+-- renews the leases of the jobs it is running, so only jobs whose process
+-- died are requeued, never those still running in another process.
+ALTER TABLE jobs ADD COLUMN owner TEXT;
+ALTER TABLE jobs ADD COLUMN lease_expires_at REAL;
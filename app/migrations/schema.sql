@@ -21,3 +21,43 @@ CREATE TABLE IF NOT EXISTS revisions (
 
 -- Index for faster lookups
 CREATE INDEX IF NOT EXISTS idx_revisions_doc_id ON revisions(doc_id);
+
+-- Per-section results of each revision, reused by incremental re-audits
+CREATE TABLE IF NOT EXISTS revision_sections (
+    doc_id TEXT,
+    revision_number INTEGER,
+    section_index INTEGER,
+    heading TEXT,
+    fingerprint TEXT,
+    analysis JSON,
+    revised_text TEXT,
+    PRIMARY KEY (doc_id, revision_number, section_index),
+    FOREIGN KEY (doc_id) REFERENCES documents(doc_id)
+);
+
+-- Cache of OpenAI results, keyed on a hash of the normalized text, prompt and model settings
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key TEXT PRIMARY KEY,
+    value JSON,
+    size INTEGER,
+    created_at REAL,
+    last_access REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache(created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access);
+
+-- Background analysis jobs for the async mode of /analyze and /re_audit
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT,
+    status TEXT,
+    payload JSON,
+    result JSON,
+    status_code INTEGER,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
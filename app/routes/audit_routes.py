@@ -1,33 +1,51 @@
 # app/routes/audit_routes.py
 
+import contextvars
+import functools
+import hmac
+import io
+import json
+import queue
+import sqlite3
+import threading
+import time
 import uuid
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify
-from app.utils.analyzer import analyze_document, generate_revised_document, compute_diff
-from app.utils.storage import DatabaseConnection
+from flask import Blueprint, Response, g, request, jsonify, current_app, url_for, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.local import LocalProxy
+from app.utils import analyzer, metrics
+from app.utils.analyzer import run_analysis, compute_diff, call_scheduler
+from app.utils.backends import create_backend
+from app.utils.cache import AnalysisCache
+from app.utils.compression import compress_response
+from app.utils.diffing import structured_diff, unified_diff
+from app.utils.jobs import JobQueue, QueueFullError
+from app.utils.ratelimit import RetriesExhausted
+from app.utils.search import build_match, revision_snippets, search_terms
+from app.utils.sections import lean_revision
+from app.utils.storage import DatabaseConnection, REVISION_FIELDS
+from app.utils.uploads import UNREADABLE, UploadError, check_size, read_text, read_upload
+from app.utils.streaming import format_sse
 
 audit_bp = Blueprint('audit_bp', __name__)
-db_connection = DatabaseConnection()  # instantiate the database connection
 
-@audit_bp.route('/analyze', methods=['POST'])
-def analyze():
-    if 'document' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
+# The storage, job queue and analysis cache of the application handling the
+# request. They are created by init_app() along with the app, not when this
+# module is imported, so importing it opens no database and runs no migrations.
+db_connection = LocalProxy(lambda: current_app.extensions['audit']['db'])
+job_queue = LocalProxy(lambda: current_app.extensions['audit']['job_queue'])
+analysis_cache = LocalProxy(lambda: current_app.extensions['audit']['cache'])
 
-    file = request.files['document']
-    if file.filename == '':
-        return jsonify({'error': 'Empty filename'}), 400
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-lines')
+SSE_MIMETYPE = 'text/event-stream'
 
-    try:
-        content = file.read().decode('utf-8')
-    except Exception:
-        return jsonify({'error': 'Could not read file content'}), 400
-    
-    if not content or "\x00" in content:
-        return jsonify({'error': 'Could not read file content'}), 400
-
-    analysis_result = analyze_document(content)
-    revised_document = generate_revised_document(content)
+def build_initial_revision(content, on_event=None):
+    """Analyze a new document. Returns (doc_id, revision_data, sections) without storing anything."""
+    analysis_result, revised_document, sections = run_analysis(content, on_event=on_event)
     doc_id = str(uuid.uuid4())
     revision_data = {
         'revision_number': 1,
@@ -37,15 +55,697 @@ def analyze():
         'revised_document': revised_document,
         'diff': None
     }
-    db_connection.store_revision(doc_id, revision_data)
-    return jsonify({'doc_id': doc_id, 'revision': revision_data})
+    return doc_id, revision_data, sections
+
+def _unavailable(error):
+    # OpenAI kept failing transiently: store nothing so the request can be retried
+    return {'error': f'Analysis service unavailable, please retry later ({error})'}, 503
+
+def process_analysis(content, on_event=None):
+    """Analyze a new document and store it as revision 1. Returns (payload, status_code)."""
+    try:
+        doc_id, revision_data, sections = build_initial_revision(content, on_event)
+    except RetriesExhausted as e:
+        return _unavailable(e)
+    db_connection.store_revision(doc_id, revision_data, sections)
+    return {'doc_id': doc_id, 'revision': revision_data}, 200
+
+# How many times a re-audit re-reads the latest revision after losing a race
+RE_AUDIT_STORE_ATTEMPTS = 5
+
+def process_re_audit(doc_id, new_content, on_event=None):
+    """Analyze a new version of an existing document. Returns (payload, status_code)."""
+    # Only the last revision's text is needed, not the whole history
+    last_revision = db_connection.get_latest_revision(doc_id, fields=('original_text',))
+    if last_revision is None:
+        return {'error': 'Document ID not found'}, 404
+
+    # Sections that haven't changed since the last revision reuse its results
+    previous_sections = db_connection.get_revision_sections(doc_id, last_revision['revision_number'])
+    try:
+        analysis_result, revised_document, sections = run_analysis(new_content, previous_sections, on_event=on_event)
+    except RetriesExhausted as e:
+        return _unavailable(e)
+
+    for _ in range(RE_AUDIT_STORE_ATTEMPTS):
+        new_revision = {
+            'revision_number': last_revision['revision_number'] + 1,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'original_text': new_content,
+            'analysis': analysis_result,
+            'revised_document': revised_document,
+            'diff': compute_diff(last_revision['original_text'], new_content)
+        }
+        try:
+            db_connection.store_revision(doc_id, new_revision, sections)
+            return {'doc_id': doc_id, 'revision': new_revision}, 200
+        except sqlite3.IntegrityError:
+            # A concurrent re-audit took this revision number. The analysis
+            # doesn't depend on the previous revision, only the diff does.
+            last_revision = db_connection.get_latest_revision(doc_id, fields=('original_text',))
+    return {'error': 'Too many concurrent re-audits of this document, please retry'}, 409
+
+def init_app(app):
+    """Create app's storage, job queue, analysis cache and backend and register the blueprint"""
+    db = DatabaseConnection(app.config.get('DATABASE_PATH'))
+
+    def in_app_context(handler):
+        # Job workers run outside any request, where db_connection has no app to resolve to
+        def run(**payload):
+            with app.app_context():
+                return handler(**payload)
+        return run
+
+    handlers = {
+        'analyze': in_app_context(process_analysis),
+        're_audit': in_app_context(process_re_audit)
+    }
+    app.extensions['audit'] = {
+        'db': db,
+        'job_queue': JobQueue(
+            db, handlers,
+            workers=app.config['JOB_WORKERS'],
+            max_depth=app.config['JOB_QUEUE_MAX_DEPTH'],
+            poll_interval=app.config['JOB_POLL_INTERVAL'],
+            lease_seconds=app.config['JOB_LEASE_SECONDS'],
+            retention_seconds=app.config['JOB_RETENTION_SECONDS']
+        ),
+        # OpenAI results are cached in the app's own database
+        'cache': AnalysisCache(
+            db,
+            memory_entries=app.config['CACHE_MEMORY_ENTRIES'],
+            max_bytes=app.config['CACHE_MAX_BYTES'],
+            ttl_seconds=app.config['CACHE_TTL_SECONDS'],
+            enabled=app.config['CACHE_ENABLED'],
+            access_resolution=app.config['CACHE_ACCESS_RESOLUTION']
+        ),
+        'backend': create_backend(app.config['ANALYZER_BACKEND'])
+    }
+    app.register_blueprint(audit_bp)
+    # Resume jobs left over from a restart right away, not once the next
+    # async request comes in
+    app.extensions['audit']['job_queue'].start()
+
+# Figures other components keep, read at scrape time
+metrics.registry.register_collector(metrics.dict_collector(
+    'audit_openai', lambda: call_scheduler.metrics(),
+    counters=('calls', 'succeeded', 'failed', 'gave_up', 'attempts', 'retries', 'tokens_reserved',
+              'tokens_used', 'queue_wait_seconds', 'backoff_seconds'),
+    help='OpenAI calls made through the call scheduler'))
+metrics.registry.register_collector(metrics.dict_collector(
+    'audit_analysis_cache', lambda: analysis_cache.stats(),
+    counters=('memory_hits', 'disk_hits', 'misses', 'stores', 'evictions'),
+    help='Cache of OpenAI results'))
+metrics.registry.register_collector(metrics.dict_collector(
+    'audit_jobs', lambda: job_queue.metrics(),
+    counters=('submitted', 'rejected', 'completed', 'failed'),
+    help='Asynchronous job queue'))
+metrics.registry.register_collector(metrics.dict_collector(
+    'audit_profiler', lambda: metrics.profiler.status(), counters=('samples', 'busy_seconds'),
+    help='Sampling profiler'))
+
+@audit_bp.before_request
+def _start_request_metrics():
+    # The request's metrics state is kept in one g attribute and proxies are
+    # resolved once per hook: each proxy access costs about as much as
+    # recording an observation
+    config = current_app.config
+    enabled = config['METRICS_ENABLED']
+    token = metrics.current_enabled.set(enabled)
+    started = trace = None
+    if enabled:
+        started = time.perf_counter()
+        trace_header = config['METRICS_TRACE_HEADER']
+        if trace_header and request.headers.get(trace_header):
+            trace = metrics.start_trace()
+    g.metrics = (token, started, trace)
+
+@audit_bp.after_request
+def _record_request_metrics(response):
+    _, started, trace = g.get('metrics', (None, None, None))
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    req = request._get_current_object()
+    # The route pattern rather than the path, so document ids don't each get a series
+    endpoint = req.url_rule.rule if req.url_rule is not None else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, req.method, endpoint, str(response.status_code))
+    request_bytes = req.content_length
+    if request_bytes:
+        metrics.REQUEST_BYTES.observe(request_bytes, endpoint)
+    if not response.is_streamed:
+        response_bytes = response.content_length
+        if response_bytes is not None:
+            metrics.RESPONSE_BYTES.observe(response_bytes, endpoint)
+    if trace is not None:
+        # Streamed bodies are still being generated; their spans end up missing
+        response.headers['Server-Timing'] = metrics.server_timing(metrics.current_trace.get(), elapsed)
+    return response
+
+@audit_bp.after_request
+def _compress_response(response):
+    # Registered after _record_request_metrics so it runs first: the recorded
+    # response size is what is actually sent
+    if current_app.config['COMPRESS_ENABLED']:
+        compress_response(response, request.accept_encodings)
+    return response
+
+@audit_bp.teardown_request
+def _end_request_metrics(error=None):
+    # Also runs for a request that raised, which skipped after_request
+    state = g.pop('metrics', None)
+    if state is not None:
+        token, _, trace = state
+        if trace is not None:
+            metrics.end_trace(trace)
+        metrics.current_enabled.reset(token)
+
+@audit_bp.errorhandler(RequestEntityTooLarge)
+def _request_too_large(error):
+    # Raised while parsing a body over MAX_CONTENT_LENGTH, before it is read
+    limit = current_app.config.get('MAX_CONTENT_LENGTH')
+    return jsonify({'error': f'Request too large (limit {limit} bytes)'}), 413
+
+def _wants_async():
+    value = request.args.get('async', request.form.get('async'))
+    if value is None:
+        return current_app.config.get('ASYNC_JOBS', False)
+    return value.lower() in ('1', 'true', 'yes')
+
+def _lean_view():
+    """Whether revisions go out in the lean view (?view=lean, default RESPONSE_VIEW)"""
+    return request.args.get('view', current_app.config.get('RESPONSE_VIEW', 'full')) == 'lean'
+
+def _with_view(payload):
+    # The revision of an analysis, re-audit or revision lookup, in the requested view
+    if isinstance(payload.get('revision'), dict) and _lean_view():
+        return dict(payload, revision=lean_revision(payload['revision']))
+    return payload
+
+def _enqueue(kind, **payload):
+    try:
+        job_id = job_queue.submit(kind, payload)
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    status_url = url_for('audit_bp.job_status', job_id=job_id)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@audit_bp.route('/analyze', methods=['POST'])
+def analyze():
+    if 'document' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'Empty filename'}), 400
+
+    content, error = _read_document(file)
+    if error:
+        return error
+
+    if _wants_async():
+        return _enqueue('analyze', content=content)
+    payload, status = process_analysis(content)
+    return jsonify(_with_view(payload)), status
+
+def _event_stream(handler, *args):
+    """
+    Run handler(*args, on_event=...) on its own thread and relay its partial
+    results as Server-Sent Events, ending with a 'result' event carrying the
+    payload the non-streaming endpoint returns, or an 'error' event. The
+    handler finishes and stores its revision even if the client goes away.
+    """
+    events = queue.Queue()
+    app = current_app._get_current_object()
+
+    def on_event(event, data):
+        events.put(format_sse(event, data))
+
+    def run():
+        try:
+            with app.app_context():
+                payload, status_code = handler(*args, on_event=on_event)
+        except Exception as e:
+            payload, status_code = {'error': f"An error occurred: {str(e)}"}, 500
+        if status_code == 200:
+            events.put(format_sse('result', payload))
+        else:
+            events.put(format_sse('error', dict(payload, status_code=status_code)))
+        events.put(None)
+
+    threading.Thread(target=run, name='sse-analysis', daemon=True).start()
+
+    def generate():
+        while True:
+            message = events.get()
+            if message is None:
+                return
+            yield message
+
+    # Ask proxies not to buffer, or the events arrive all at once at the end
+    return Response(generate(), mimetype=SSE_MIMETYPE,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@audit_bp.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    if 'document' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'Empty filename'}), 400
+
+    content, error = _read_document(file)
+    if error:
+        return error
+    return _event_stream(process_analysis, content)
+
+def _read_document(file):
+    """
+    The text of an uploaded document, read in chunks and validated as it
+    goes. Returns (content, error_response).
+    """
+    try:
+        with metrics.timed(metrics.STAGE_SECONDS, 'decode'):
+            return read_upload(file), None
+    except UploadError as e:
+        return None, (jsonify({'error': str(e)}), e.status_code)
+
+def _unreadable(max_bytes=None):
+    raise UploadError(UNREADABLE)
+
+def _read_zip_entry(archive, info, max_bytes=None):
+    # Entries whose header declares too much are skipped unread, and the
+    # others are decompressed in chunks, so an entry that lies about its size
+    # is rejected as soon as it crosses the limit
+    check_size(info.file_size, max_bytes)
+    try:
+        with archive.open(info) as entry:
+            return read_text(entry, max_bytes)
+    except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError):
+        # Corrupt, encrypted or compressed with an unsupported method
+        raise UploadError(UNREADABLE) from None
+
+def _ndjson_documents(body):
+    for number, line in enumerate(io.BytesIO(body), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            filename, content = record.get('filename') or f'line {number}', record.get('content')
+        except (ValueError, AttributeError):
+            yield f'line {number}', _unreadable
+            continue
+        if not isinstance(content, str):
+            yield filename, _unreadable
+            continue
+        # surrogatepass keeps lone surrogates, which then fail validation
+        data = content.encode('utf-8', 'surrogatepass')
+        yield filename, lambda max_bytes=None, data=data: read_text(io.BytesIO(data), max_bytes)
+
+def _batch_documents(max_documents):
+    """
+    Find the documents of a batch request without decompressing or decoding
+    any of them: either an NDJSON body of {"filename": ..., "content": ...}
+    records, or multipart files where any .zip upload is expanded into its
+    entries. Returns (count, size, documents), or None as soon as more than
+    max_documents are found; size is the total the documents declare (zip
+    entry headers, file sizes, the NDJSON body). documents yields (filename,
+    read) pairs in order; read(max_bytes=None) returns the document's text,
+    validated like a single upload (MAX_DOCUMENT_BYTES included), or raises
+    UploadError. zipfile never returns more than an entry's declared size (a
+    longer entry fails its CRC check), so size bounds what reading the
+    documents can produce.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        # The body itself is bounded by MAX_CONTENT_LENGTH; records are only
+        # parsed as they are reached
+        body = request.get_data()
+        count = 0
+        for line in io.BytesIO(body):
+            if line.strip():
+                count += 1
+                if count > max_documents:
+                    return None
+        return count, len(body), _ndjson_documents(body)
+
+    documents = []
+    size = 0
+    for file in request.files.getlist('documents') + request.files.getlist('document'):
+        if not file.filename.lower().endswith('.zip'):
+            documents.append((file.filename, functools.partial(read_text, file.stream)))
+            position = file.stream.tell()
+            size += file.stream.seek(0, io.SEEK_END) - position
+            file.stream.seek(position)
+        else:
+            try:
+                # Only reads the archive's central directory
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile:
+                documents.append((file.filename, _unreadable))
+                continue
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith('__MACOSX/') or name.endswith('.DS_Store'):
+                    continue
+                documents.append((name, functools.partial(_read_zip_entry, archive, info)))
+                size += info.file_size
+        if len(documents) > max_documents:
+            return None
+    return len(documents), size, iter(documents)
+
+@audit_bp.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    max_documents = current_app.config.get('BATCH_MAX_DOCUMENTS', 1000)
+    batch = _batch_documents(max_documents)
+    if batch is None:
+        return jsonify({'error': f'Too many documents in batch (limit {max_documents})'}), 413
+    count, size, documents = batch
+    if not count:
+        return jsonify({'error': 'No file uploaded'}), 400
+    # What the documents declare, checked before any of them is read
+    max_bytes = current_app.config.get('BATCH_MAX_BYTES', 0)
+    if max_bytes and size > max_bytes:
+        return jsonify({'error': f'Batch too large (limit {max_bytes} bytes)'}), 413
+    max_workers = current_app.config.get('BATCH_MAX_WORKERS', 8)
+    # The request closes its uploads when the view returns, before the
+    # response below is generated; the documents are read from them then,
+    # so they are detached from the request and closed by generate()
+    uploads = []
+    for _, file in request.files.items(multi=True):
+        uploads.append(file.stream)
+        file.stream = io.BytesIO()
+
+    def generate():
+        try:
+            yield from analyze()
+        finally:
+            for stream in uploads:
+                stream.close()
+
+    def analyze():
+        # One line per document, then a summary line. A document is only
+        # read once a worker is free for it, so at most max_workers of them
+        # are in memory, and results are stored in groups of up to
+        # max_workers, each committed before its doc_ids are sent: every
+        # doc_id the client receives exists.
+        summary = {'documents': count, 'analyzed': 0, 'failed': 0, 'stored': 0}
+        pending = {}
+        done = []
+
+        def failure(index, filename, error):
+            summary['failed'] += 1
+            return json.dumps({'index': index, 'filename': filename, 'error': error}) + "\n"
+
+        def commit():
+            try:
+                db_connection.store_revisions([result for _, _, result in done])
+            except sqlite3.Error as e:
+                lines = [failure(index, filename, f'Could not store document: {str(e)}')
+                         for index, filename, _ in done]
+            else:
+                summary['stored'] += len(done)
+                lines = [json.dumps({'index': index, 'filename': filename,
+                                     'doc_id': doc_id, 'revision': revision_data}) + "\n"
+                         for index, filename, (doc_id, revision_data, _) in done]
+            done.clear()
+            return lines
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch') as pool:
+            queued = enumerate(documents)
+            while True:
+                for index, (filename, read) in queued:
+                    try:
+                        with metrics.timed(metrics.STAGE_SECONDS, 'decode'):
+                            content = read()
+                    except UploadError as e:
+                        yield failure(index, filename, str(e))
+                        continue
+                    # In a copy of this context so the analysis runs for this app
+                    future = pool.submit(contextvars.copy_context().run, build_initial_revision, content)
+                    pending[future] = (index, filename)
+                    if len(pending) == max_workers:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, filename = pending.pop(future)
+                    try:
+                        done.append((index, filename, future.result()))
+                    except Exception as e:
+                        yield failure(index, filename, f'Analysis failed: {str(e)}')
+                        continue
+                    summary['analyzed'] += 1
+                if len(done) >= max_workers:
+                    yield from commit()
+        if done:
+            yield from commit()
+        yield json.dumps({'batch': summary}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _requested_fields():
+    """Parse ?fields=a,b into a tuple of revision columns. Returns (fields, error)."""
+    value = request.args.get('fields')
+    if not value:
+        return None, None
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in REVISION_FIELDS]
+    if unknown:
+        return None, f"Unknown field(s): {', '.join(unknown)}"
+    return fields, None
+
+def _int_arg(name, minimum):
+    """Read an optional integer query parameter. Raises ValueError if it is invalid."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) < minimum:
+        raise ValueError(f"{name} must be an integer >= {minimum}")
+    return int(value)
 
 @audit_bp.route('/history/<doc_id>', methods=['GET'])
 def history(doc_id):
-    history = db_connection.get_revision_history(doc_id)
-    if history is None:
+    fields, error = _requested_fields()
+    if error:
+        return jsonify({'error': error}), 400
+    # ?limit and ?cursor are optional; without them the full history is returned
+    try:
+        limit = _int_arg('limit', 1)
+        cursor = _int_arg('cursor', 0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if limit is not None:
+        limit = min(limit, current_app.config.get('HISTORY_MAX_PAGE_SIZE', 500))
+
+    if not db_connection.document_exists(doc_id):
+        return jsonify({'error': 'Document ID not found'}), 404
+    view = lean_revision if _lean_view() else (lambda revision: revision)
+
+    def generate():
+        # Stream the JSON body revision by revision so a long history never
+        # has to sit in memory as one big list.
+        dumps = current_app.json.dumps
+        yield '{"doc_id": ' + dumps(doc_id) + ', "revisions": ['
+        last = None
+        count = 0
+        # Read one extra row to find out whether there is another page
+        rows = db_connection.iter_revisions(doc_id, fields, after=cursor,
+                                            limit=limit + 1 if limit is not None else None)
+        try:
+            for revision in rows:
+                if limit is not None and count == limit:
+                    yield '], "next_cursor": ' + dumps(str(last)) + '}'
+                    return
+                yield (', ' if count else '') + dumps(view(revision))
+                last = revision['revision_number']
+                count += 1
+            yield '], "next_cursor": null}'
+        finally:
+            rows.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@audit_bp.route('/history/<doc_id>/<int:revision_number>', methods=['GET'])
+def revision_detail(doc_id, revision_number):
+    fields, error = _requested_fields()
+    if error:
+        return jsonify({'error': error}), 400
+    revision = db_connection.get_revision(doc_id, revision_number, fields)
+    if revision is None:
+        return jsonify({'error': 'Revision not found'}), 404
+    return jsonify(_with_view({'doc_id': doc_id, 'revision': revision}))
+
+@audit_bp.route('/history/<doc_id>/<int:revision_number>/diff', methods=['GET'])
+def revision_diff(doc_id, revision_number):
+    diff_format = request.args.get('format', 'unified')
+    if diff_format not in ('unified', 'structured'):
+        return jsonify({'error': "format must be 'unified' or 'structured'"}), 400
+    revision = db_connection.get_revision(doc_id, revision_number, ('original_text',))
+    if revision is None:
+        return jsonify({'error': 'Revision not found'}), 404
+    # Revision 1 is compared with an empty document
+    previous = db_connection.get_revision(doc_id, revision_number - 1, ('original_text',))
+    old_lines = previous['original_text'].splitlines() if previous else []
+    new_lines = revision['original_text'].splitlines()
+
+    if diff_format == 'structured':
+        return jsonify({
+            'doc_id': doc_id,
+            'revision_number': revision_number,
+            'changes': structured_diff(old_lines, new_lines)
+        })
+    lines = unified_diff(old_lines, new_lines, fromfile=f'Revision {revision_number - 1}',
+                         tofile=f'Revision {revision_number}')
+    return Response((line + "\n" for line in lines), mimetype='text/x-diff')
+
+# sqlite3 reports a malformed MATCH expression as an OperationalError with one
+# of these messages; anything else (like a locked database) is a real error
+FTS5_QUERY_ERRORS = ('fts5', 'no such column', 'unterminated string', 'unknown special query')
+
+@audit_bp.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = _int_arg('limit', 1) or current_app.config.get('SEARCH_DEFAULT_PAGE_SIZE', 20)
+        offset = _int_arg('cursor', 0) or 0
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(limit, current_app.config.get('SEARCH_MAX_PAGE_SIZE', 100))
+    latest_only = request.args.get('latest', 'false').lower() == 'true'
+    # ?syntax=fts5 passes q through as a raw FTS5 query (OR, NEAR, column filters)
+    match = query if request.args.get('syntax') == 'fts5' else build_match(query)
+    if not match:
+        return jsonify({'error': 'q has nothing to search for'}), 400
+
+    try:
+        # Read one extra row to find out whether there is another page
+        rows = db_connection.search_revisions(
+            match, limit + 1, offset, latest_only, with_texts=current_app.config.get('SEARCH_SNIPPET_TEXTS', 20)
+        )
+    except sqlite3.OperationalError as e:
+        if not any(message in str(e) for message in FTS5_QUERY_ERRORS):
+            raise
+        return jsonify({'error': f'Invalid search query: {e}'}), 400
+
+    terms = search_terms(query)
+    results = []
+    for row in rows[:limit]:
+        results.append({
+            'doc_id': row['doc_id'],
+            'revision_number': row['revision_number'],
+            'score': row['score'],
+            'snippets': revision_snippets(row, terms)
+        })
+    return jsonify({
+        'query': query,
+        'results': results,
+        'next_cursor': str(offset + limit) if len(rows) > limit else None
+    })
+
+# GET /stats/<kind>: the findings table behind each kind and the name of
+# each result's text field
+STATS_KINDS = {
+    'hazards': ('hazards', 'hazard'),
+    'compliance_issues': ('compliance_issues', 'compliance_issue'),
+    'incidents': ('incidents', 'incident'),
+    'standards': ('regulatory_comments', 'standard')
+}
+
+@audit_bp.route('/stats/<kind>', methods=['GET'])
+def finding_stats(kind):
+    if kind not in STATS_KINDS:
+        return jsonify({'error': f"Unknown statistic: {kind}"}), 404
+    try:
+        limit = _int_arg('limit', 1) or current_app.config.get('STATS_DEFAULT_LIMIT', 20)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(limit, current_app.config.get('STATS_MAX_LIMIT', 500))
+    doc_id = request.args.get('doc_id')
+    if doc_id is not None and not db_connection.document_exists(doc_id):
         return jsonify({'error': 'Document ID not found'}), 404
-    return jsonify({'doc_id': doc_id, 'revisions': history})
+
+    table, field = STATS_KINDS[kind]
+    rows = db_connection.top_findings(table, limit, doc_id)
+    return jsonify({
+        kind: [
+            {field: row['text'], 'revisions': row['revisions'], 'documents': row['documents']}
+            for row in rows
+        ]
+    })
+
+@audit_bp.route('/stats/storage', methods=['GET'])
+def storage_stats():
+    # Identical uploads share both their stored text and, through the
+    # analysis cache, their OpenAI results
+    return jsonify({'storage': db_connection.storage_stats(), 'analysis_cache': analysis_cache.stats()})
+
+@audit_bp.route('/stats/openai', methods=['GET'])
+def openai_stats():
+    return jsonify(call_scheduler.metrics())
+
+@audit_bp.route('/stats/analyzer', methods=['GET'])
+def analyzer_stats():
+    backend = analyzer.get_backend()
+    return jsonify({'backend': backend.name, **backend.stats()})
+
+@audit_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+def _profiler_refused():
+    """The error response when the request may not use the profiler, else None"""
+    token = current_app.config.get('PROFILER_TOKEN')
+    if not token:
+        return jsonify({'error': 'The profiler is disabled (set PROFILER_TOKEN)'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Profiler-Token', '').encode(), token.encode()):
+        return jsonify({'error': 'Missing or wrong X-Profiler-Token'}), 403
+    return None
+
+@audit_bp.route('/metrics/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    """Profiler status; POST enabled=true|false to start or stop it, reset=true to clear its samples"""
+    refused = _profiler_refused()
+    if refused:
+        return refused
+    if request.method == 'POST':
+        values = request.get_json(silent=True) or request.values
+        enabled = str(values.get('enabled', '')).lower()
+        interval = values.get('interval')
+        try:
+            interval = float(interval) if interval is not None else None
+        except ValueError:
+            return jsonify({'error': 'interval must be a number of seconds'}), 400
+        if interval is not None and not 0.001 <= interval <= 10:
+            return jsonify({'error': 'interval must be between 0.001 and 10 seconds'}), 400
+        if str(values.get('reset', '')).lower() in ('1', 'true', 'yes'):
+            metrics.profiler.reset()
+        if enabled in ('1', 'true', 'yes'):
+            metrics.profiler.start(interval)
+        elif enabled in ('0', 'false', 'no'):
+            metrics.profiler.stop()
+    return jsonify(metrics.profiler.status())
+
+@audit_bp.route('/metrics/profile', methods=['GET'])
+def profile():
+    """The profiler's samples as collapsed stacks, for flamegraph.pl or speedscope"""
+    refused = _profiler_refused()
+    if refused:
+        return refused
+    return Response(metrics.profiler.collapsed(), mimetype='text/plain')
+
+@audit_bp.route('/stats/documents/<doc_id>', methods=['GET'])
+def document_stats(doc_id):
+    if not db_connection.document_exists(doc_id):
+        return jsonify({'error': 'Document ID not found'}), 404
+    return jsonify({'doc_id': doc_id, 'revisions': db_connection.findings_timeline(doc_id)})
 
 @audit_bp.route('/re_audit', methods=['POST'])
 def re_audit():
@@ -60,28 +760,47 @@ def re_audit():
     if file.filename == '':
         return jsonify({'error': 'Empty filename'}), 400
 
-    try:
-        new_content = file.read().decode('utf-8')
-    except Exception:
-        return jsonify({'error': 'Could not read file content'}), 400
+    new_content, error = _read_document(file)
+    if error:
+        return error
+
+    if _wants_async():
+        # Reject unknown documents now rather than in a failed job
+        if not db_connection.document_exists(doc_id):
+            return jsonify({'error': 'Document ID not found'}), 404
+        return _enqueue('re_audit', doc_id=doc_id, new_content=new_content)
+    payload, status = process_re_audit(doc_id, new_content)
+    return jsonify(_with_view(payload)), status
+
+@audit_bp.route('/re_audit/stream', methods=['POST'])
+def re_audit_stream():
+    doc_id = request.form.get('doc_id')
+    if not doc_id:
+        return jsonify({'error': 'Missing document ID'}), 400
+
+    if 'document' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
 
-    history_data = db_connection.get_revision_history(doc_id)
-    if not history_data:
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'Empty filename'}), 400
+
+    new_content, error = _read_document(file)
+    if error:
+        return error
+
+    # Fail before the stream starts rather than with an error event
+    if not db_connection.document_exists(doc_id):
         return jsonify({'error': 'Document ID not found'}), 404
+    return _event_stream(process_re_audit, doc_id, new_content)
 
-    last_revision = history_data[-1]
-    old_text = last_revision['original_text']
-    diff = compute_diff(old_text, new_content)
+@audit_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job ID not found'}), 404
+    return jsonify(job)
 
-    analysis_result = analyze_document(new_content)
-    revised_document = generate_revised_document(new_content)
-    new_revision = {
-        'revision_number': last_revision['revision_number'] + 1,
-        'timestamp': datetime.now(timezone.utc).isoformat(),
-        'original_text': new_content,
-        'analysis': analysis_result,
-        'revised_document': revised_document,
-        'diff': diff
-    }
-    db_connection.store_revision(doc_id, new_revision)
-    return jsonify({'doc_id': doc_id, 'revision': new_revision})
\ No newline at end of file
+@audit_bp.route('/jobs', methods=['GET'])
+def job_metrics():
+    return jsonify(job_queue.metrics())
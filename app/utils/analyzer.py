@@ -2,53 +2,317 @@
 
 import os
 import json
-from openai import OpenAI
-import difflib
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from app.config import Config, setting
+from app.utils.backends import create_backend
+from app.utils import metrics
+from app.utils.cache import AnalysisCache
+from app.utils.diffing import unified_diff
+from app.utils.ratelimit import CallScheduler, RateLimiter, RetriesExhausted
+from app.utils.sections import LIST_KEYS, split_chunks, merge_analyses, estimate_tokens, iter_findings, sentence_spans
+from app.utils.streaming import ListItemParser
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Created by get_client() on the first OpenAI call: importing openai takes
+# longer than the rest of the app together, and the local backend never needs it
+client = None
+_client_lock = threading.Lock()
 
-def analyze_document(text):
-    """
-    Uses OpenAI GPT to analyze the provided safety document.
-    Returns a structured analysis of hazards, compliance issues, and recommendations.
-    """
-    prompt = """
+def get_client():
+    """The OpenAI client, created on first use"""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                # Retries are left to call_scheduler, which shares the rate limits
+                # and deadlines across threads; the client only applies the timeout
+                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=Config.OPENAI_TIMEOUT, max_retries=0)
+    return client
+
+# Shared pool for the outbound OpenAI calls. Bounded so a burst of uploads
+# can't open an unlimited number of concurrent requests against the API.
+executor = ThreadPoolExecutor(
+    max_workers=Config.ANALYZER_MAX_WORKERS,
+    thread_name_prefix='analyzer'
+)
+
+# Keeps every thread, including batch workers, inside the account's OpenAI limits
+rate_limiter = RateLimiter(Config.OPENAI_REQUESTS_PER_MINUTE, Config.OPENAI_TOKENS_PER_MINUTE)
+
+def _is_transient(error):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    import openai  # already loaded by the time an OpenAI call has failed
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if not isinstance(error, openai.APIStatusError):
+        return False
+    if error.status_code == 429:
+        # An exhausted quota won't come back by waiting
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    return error.status_code in (408, 409) or error.status_code >= 500
+
+def _retry_after(error):
+    """The delay a 429 or 503 response asks for, in seconds, or None"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+call_scheduler = CallScheduler(
+    rate_limiter, _is_transient, _retry_after,
+    max_retries=Config.OPENAI_MAX_RETRIES,
+    base_delay=Config.OPENAI_RETRY_BASE_DELAY,
+    max_delay=Config.OPENAI_RETRY_MAX_DELAY,
+    deadline=Config.OPENAI_CALL_DEADLINE
+)
+
+# Results are replayed from the cache for identical submissions. temperature=0
+# makes a cached answer as good as a fresh one. Each app has its own, kept in
+# its database (see audit_routes.init_app); this one, in memory only, serves
+# callers outside any app.
+cache = AnalysisCache()
+
+def _app_component(name, default):
+    # Analyses run in a request, a job or a worker thread copying their
+    # context, so the app they are for is the current one
+    if has_app_context():
+        return current_app.extensions.get('audit', {}).get(name, default)
+    return default
+
+def get_cache():
+    """The analysis cache of the current app, or the module's outside any app"""
+    return _app_component('cache', cache)
+
+MODEL = "gpt-4o-mini-2024-07-18"  # Using the latest model which is better at JSON
+TEMPERATURE = 0
+MAX_TOKENS = 2000
+
+ANALYSIS_SYSTEM_PROMPT = "You are a safety procedure auditor that outputs only valid JSON."
+ANALYSIS_PROMPT = """
 You are a safety procedure auditor. Analyze the following safety document and extract the requested information.
 Format your response as a JSON object with exactly these keys:
 {
     "detected_hazards": ["list of hazard sentences (give an ordered list)"],
     "compliance_issues": ["list of compliance issue sentences (give an ordered list)"],
     "regulatory_comments": {"standard": "guideline"},
-    "accident_incidents": ["list of historical incidents (give an ordered list)"],
-    "original_text": "the complete document"
+    "accident_incidents": ["list of historical incidents (give an ordered list)"]
 }
 Ensure that each sentence is complete and properly quoted.
 
 Document:
 """
-    # Add the document text
-    prompt += text
-
-    # Add explicit formatting instructions
-    prompt += """
+# Explicit formatting instructions appended after the document
+ANALYSIS_PROMPT_SUFFIX = """
 
 Return ONLY valid JSON that matches the exact format shown above. Do not include any additional explanation or text outside the JSON structure."""
 
+# ANALYSIS_SCHEMA = 'compact': findings come back as sentence numbers instead
+# of quoted sentences, which are most of the output tokens of a full answer
+COMPACT_ANALYSIS_PROMPT = """
+You are a safety procedure auditor. Analyze the following safety document, in which every sentence is numbered.
+Format your response as a JSON object with exactly these keys:
+{
+    "h": [numbers of the sentences that describe hazards, in order],
+    "c": [numbers of the sentences that describe compliance issues, in order],
+    "r": {"standard": "guideline"},
+    "i": [numbers of the sentences that describe historical incidents, in order]
+}
+Give sentence numbers only, never the sentences themselves.
+
+Document:
+"""
+COMPACT_KEYS = {
+    "h": "detected_hazards",
+    "c": "compliance_issues",
+    "r": "regulatory_comments",
+    "i": "accident_incidents"
+}
+
+REVISION_ERROR_PREFIX = "Error generating revision: "
+REVISION_SYSTEM_PROMPT = "You are a safety procedure auditor focusing on clear, actionable recommendations."
+REVISION_PROMPT = """
+As a safety procedure auditor, revise the following document:
+1. Identify each sentence that mentions a hazard
+2. Add a specific recommendation after each hazard
+3. Keep all other content unchanged
+4. Format recommendations as "Recommendation: [specific action]"
+
+Document:
+"""
+
+def _complete(on_delta=None, **kwargs):
+    """
+    Run a chat completion through call_scheduler and return the message
+    content. With on_delta the response is streamed and on_delta is called
+    with each piece of content as it arrives.
+
+    Raises RetriesExhausted when the call keeps failing transiently, and
+    also when a stream breaks off after content was already passed on, since
+    retrying it would repeat that content.
+    """
+    prompt_tokens = sum(estimate_tokens(message['content']) for message in kwargs['messages'])
+    # OpenAI counts max_tokens against the per-minute token budget
+    reserved = prompt_tokens + kwargs.get('max_tokens', 0)
+
+    def attempt(timeout):
+        timeout = min(timeout, Config.OPENAI_TIMEOUT)
+        if on_delta is None:
+            response = get_client().chat.completions.create(timeout=timeout, **kwargs)
+            content = response.choices[0].message.content
+            usage = getattr(response, 'usage', None)
+        else:
+            pieces = []
+            usage = None
+            try:
+                for chunk in get_client().chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, timeout=timeout, **kwargs):
+                    usage = getattr(chunk, 'usage', None) or usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        pieces.append(chunk.choices[0].delta.content)
+                        on_delta(pieces[-1])
+            except Exception as e:
+                if pieces and _is_transient(e):
+                    raise RetriesExhausted(f"Stream interrupted: {e}") from e
+                raise
+            content = "".join(pieces)
+        used = getattr(usage, 'total_tokens', None)
+        if used is None:
+            used = prompt_tokens + estimate_tokens(content or "")
+        call_scheduler.record_tokens(used)
+        if metrics.enabled():
+            metrics.OPENAI_TOKENS.observe(used)
+        return content
+
+    return call_scheduler.call(attempt, reserved)
+
+# Produces each chunk's analysis and revision: OpenAI, the offline rules in
+# backends.LocalBackend, or the rules with OpenAI for what they can't settle.
+# Each app has its own, for its ANALYZER_BACKEND (see audit_routes.init_app);
+# this one serves callers outside any app.
+backend = create_backend(Config.ANALYZER_BACKEND)
+
+def get_backend():
+    """The analyzer backend of the current app, or the module's outside any app"""
+    return _app_component('backend', backend)
+
+def analyze_document(text, on_item=None):
+    """
+    Analyzes the provided safety document with the configured backend.
+    Returns a structured analysis of hazards, compliance issues, and recommendations.
+
+    If on_item is given, on_item(key, item) is called for each hazard,
+    compliance issue and incident as soon as it is available.
+    """
+    with metrics.timed(metrics.STAGE_SECONDS, 'analysis'):
+        return get_backend().analyze(text, on_item)
+
+def generate_revised_document(text, on_token=None):
+    """
+    Generates a revised version of the safety document with recommendations,
+    using the configured backend.
+
+    If on_token is given, it is called with each piece of the revised text
+    as it becomes available.
+    """
+    with metrics.timed(metrics.STAGE_SECONDS, 'revision'):
+        return get_backend().revise(text, on_token)
+
+def number_sentences(text):
+    """The text one numbered sentence per line, for COMPACT_ANALYSIS_PROMPT, and the sentence spans"""
+    spans = sentence_spans(text)
+    return "\n".join(f"[{number}] {text[start:end]}" for number, (start, end) in enumerate(spans)), spans
+
+def _sentence(text, spans, number):
+    if isinstance(number, int) and not isinstance(number, bool) and 0 <= number < len(spans):
+        start, end = spans[number]
+        return text[start:end]
+    return None
+
+def expand_compact(result, text, spans):
+    """The analysis a compact answer stands for, with the numbered sentences quoted from text"""
+    analysis = {
+        "detected_hazards": [],
+        "compliance_issues": [],
+        "regulatory_comments": {},
+        "accident_incidents": []
+    }
+    for short, key in COMPACT_KEYS.items():
+        value = result.get(short)
+        if key not in LIST_KEYS:
+            if isinstance(value, dict):
+                analysis[key] = value
+            continue
+        for number in value if isinstance(value, list) else []:
+            sentence = _sentence(text, spans, number)
+            # Numbers out of range are dropped rather than guessed at
+            if sentence is not None:
+                analysis[key].append(sentence)
+    return analysis
+
+def openai_analysis(text, on_item=None):
+    """
+    Uses OpenAI GPT to analyze the provided safety document.
+
+    If on_item is given, the response is streamed and on_item(key, item) is
+    called for each hazard, compliance issue and incident as soon as it is
+    complete.
+    """
+    compact = setting('ANALYSIS_SCHEMA') == 'compact'
+    cache = get_cache()
+    cache_key = cache.make_key(
+        'analysis', text,
+        ANALYSIS_SYSTEM_PROMPT, COMPACT_ANALYSIS_PROMPT if compact else ANALYSIS_PROMPT, ANALYSIS_PROMPT_SUFFIX,
+        MODEL, TEMPERATURE, MAX_TOKENS
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if on_item is not None:
+            for key, item in iter_findings(cached):
+                on_item(key, item)
+        return cached
+
+    if compact:
+        numbered, spans = number_sentences(text)
+        prompt = COMPACT_ANALYSIS_PROMPT + numbered + ANALYSIS_PROMPT_SUFFIX
+        if on_item is not None:
+            report = on_item
+
+            def on_item(short, number):
+                sentence = _sentence(text, spans, number)
+                if COMPACT_KEYS.get(short) in LIST_KEYS and sentence is not None:
+                    report(COMPACT_KEYS[short], sentence)
+    else:
+        prompt = ANALYSIS_PROMPT + text + ANALYSIS_PROMPT_SUFFIX
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",  # Using the latest model which is better at JSON
+        content = _complete(
+            on_delta=ListItemParser(on_item).feed if on_item is not None else None,
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "You are a safety procedure auditor that outputs only valid JSON."},
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             response_format={"type": "json_object"},  # Enforce JSON response
-            temperature=0,
-            max_tokens=2000
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS
         )
-        
-        content = response.choices[0].message.content
-        return json.loads(content)
-        
+        result = json.loads(content)
+        if compact:
+            result = expand_compact(result, text, spans)
+        cache.set(cache_key, result)
+        return result
+
+    except RetriesExhausted:
+        # Not worth storing as the analysis: the caller should try again later
+        raise
     except json.JSONDecodeError as e:
         return {
             "error": f"Failed to parse JSON: {str(e)}",
@@ -60,49 +324,155 @@ Return ONLY valid JSON that matches the exact format shown above. Do not include
             "raw_response": None
         }
 
-def generate_revised_document(text):
+def openai_revision(text, on_token=None):
     """
     Uses OpenAI GPT to generate a revised version of the safety document with recommendations.
+
+    If on_token is given, the response is streamed and on_token is called
+    with each piece of the revised text as it arrives.
     """
-    prompt = """
-As a safety procedure auditor, revise the following document:
-1. Identify each sentence that mentions a hazard
-2. Add a specific recommendation after each hazard
-3. Keep all other content unchanged
-4. Format recommendations as "Recommendation: [specific action]"
+    cache = get_cache()
+    cache_key = cache.make_key(
+        'revision', text,
+        REVISION_SYSTEM_PROMPT, REVISION_PROMPT,
+        MODEL, TEMPERATURE, MAX_TOKENS
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if on_token is not None:
+            on_token(cached)
+        return cached
+
+    prompt = REVISION_PROMPT + text
 
-Document:
-"""
-    prompt += text
-    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
+        revised = _complete(
+            on_delta=on_token,
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "You are a safety procedure auditor focusing on clear, actionable recommendations."},
+                {"role": "system", "content": REVISION_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0,
-            max_tokens=2000
-        )
-        
-        return response.choices[0].message.content
-        
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS
+        ) or ""
+        cache.set(cache_key, revised)
+        return revised
+
+    except RetriesExhausted:
+        raise
     except Exception as e:
-        return f"Error generating revision: {str(e)}"
+        return f"{REVISION_ERROR_PREFIX}{str(e)}"
+
+def run_analysis(text, previous_sections=None, on_event=None):
+    """
+    Analyzes a document chunk by chunk and merges the results.
+
+    The document is split on section and paragraph boundaries into chunks of
+    at most ANALYSIS_CHUNK_TOKENS, so a long manual is never squeezed into a
+    single prompt. Chunks whose fingerprint appears in previous_sections (as
+    returned by DatabaseConnection.get_revision_sections) reuse the stored
+    results; only changed or new chunks go to OpenAI. For those,
+    analyze_document and generate_revised_document run concurrently on the
+    shared pool with at most ANALYSIS_MAX_CALLS_IN_FLIGHT calls per request,
+    so wall-clock time tracks the slowest chunk rather than the sum.
+
+    Returns (analysis_result, revised_document, sections) where the first two
+    keep the error dict / error string semantics of the individual calls and
+    sections holds the successful per-chunk results to store with the revision.
+
+    on_event(event, data), if given, is called from the worker threads with
+    partial results while the analysis runs: 'chunks' once with the chunk
+    list, then 'item' for each finding ({chunk, key, item}) and 'revision'
+    for each piece of revised text ({chunk, text}). Items are reported per
+    chunk, before findings repeated across chunks are merged.
+    """
+    previous_sections = previous_sections or {}
+    sections = split_chunks(text, setting('ANALYSIS_CHUNK_TOKENS'))
+    in_flight = threading.BoundedSemaphore(setting('ANALYSIS_MAX_CALLS_IN_FLIGHT'))
+
+    def submit(fn, chunk_text, **kwargs):
+        in_flight.acquire()
+        # Run in a copy of this thread's context so the calls join the request's trace
+        future = executor.submit(contextvars.copy_context().run, fn, chunk_text, **kwargs)
+        future.add_done_callback(lambda _: in_flight.release())
+        return future
+
+    def item_callback(index):
+        return lambda key, item: on_event('item', {'chunk': index, 'key': key, 'item': item})
+
+    def token_callback(index):
+        return lambda piece: on_event('revision', {'chunk': index, 'text': piece})
+
+    if on_event is not None:
+        on_event('chunks', [
+            {'chunk': section['index'], 'heading': section['heading'],
+             'reused': section['fingerprint'] in previous_sections}
+            for section in sections
+        ])
+
+    pending = []
+    for section in sections:
+        stored = previous_sections.get(section['fingerprint'])
+        if stored is not None:
+            section['analysis'] = stored['analysis']
+            section['revised_text'] = stored['revised_text']
+            if on_event is not None:
+                for key, item in iter_findings(stored['analysis']):
+                    item_callback(section['index'])(key, item)
+                token_callback(section['index'])(stored['revised_text'])
+        elif on_event is None:
+            pending.append((
+                section,
+                submit(analyze_document, section['text']),
+                submit(generate_revised_document, section['text'])
+            ))
+        else:
+            pending.append((
+                section,
+                submit(analyze_document, section['text'], on_item=item_callback(section['index'])),
+                submit(generate_revised_document, section['text'], on_token=token_callback(section['index']))
+            ))
+
+    for section, analysis_future, revision_future in pending:
+        section['analysis'] = analysis_future.result()
+        section['revised_text'] = revision_future.result()
+
+    analysis_result = merge_analyses([section['analysis'] for section in sections], text)
+    revision_errors = [
+        section['revised_text'] for section in sections
+        if section['revised_text'].startswith(REVISION_ERROR_PREFIX)
+    ]
+    if revision_errors:
+        revised_document = revision_errors[0]
+    else:
+        revised_document = "\n\n".join(section['revised_text'].strip() for section in sections)
+
+    # Failed chunks are left out so the next re-audit retries them
+    reusable = [
+        section for section in sections
+        if 'error' not in section['analysis']
+        and not section['revised_text'].startswith(REVISION_ERROR_PREFIX)
+    ]
+    return analysis_result, revised_document, reusable
 
+@metrics.timed_function(metrics.STAGE_SECONDS, 'diff')
 def compute_diff(old_text, new_text):
     """
-    Computes a unified diff between the old and new document versions.
+    Computes a unified diff between the old and new document versions,
+    using the DIFF_ENGINE algorithm. The diff is built as one string rather
+    than yielded line by line because all of it is needed at once: it is
+    compressed into the revision's row and sent in the revision's JSON.
+    GET /history/<doc_id>/<revision_number>/diff, which only sends it,
+    streams unified_diff's lines instead.
     """
     try:
-        diff = difflib.unified_diff(
+        diff = unified_diff(
             old_text.splitlines(),
             new_text.splitlines(),
             fromfile='Previous Version',
-            tofile='New Version',
-            lineterm=''
+            tofile='New Version'
         )
-        return "\n".join(list(diff))
+        return "\n".join(diff)
     except Exception as e:
-        return f"Error computing diff: {str(e)}"
\ No newline at end of file
+        return f"Error computing diff: {str(e)}"
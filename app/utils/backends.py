@@ -0,0 +1,300 @@
+# app/utils/backends.py
+
+import re
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from app.utils.sections import sentence_spans
+
+BACKENDS = ('openai', 'local', 'tiered')
+
+# Hazard categories of the local backend: the phrases that detect them, the
+# standard and guideline reported in regulatory_comments, and the
+# recommendation added to the revised document after each hazard sentence
+HAZARD_LEXICON = {
+    'fire': (
+        [r'fire (?:risk|hazard)s?', r'risk of fire', r'flammable', r'combustible', r'ignition sources?',
+         r'open flames?', r'hot work'],
+        'NFPA 101', "Ignition sources must be controlled and fire protection kept in service.",
+        "Remove ignition sources, segregate flammable materials and check fire extinguishers and exits."
+    ),
+    'electrical': (
+        [r'exposed (?:electrical )?wir(?:es|ing)', r'(?:outdated|faulty|damaged|frayed) (?:electrical )?(?:wir(?:es|ing)|cords?|systems?)',
+         r'electric(?:al)? shocks?', r'electrocution', r'live (?:wires|circuits|parts)', r'overloaded (?:circuits?|outlets?)'],
+        'OSHA 1910.303', "Electrical equipment must be free from recognized hazards.",
+        "Have a qualified electrician inspect and repair the installation and isolate affected circuits until then."
+    ),
+    'ppe': (
+        [r'no (?:ppe|personal protective equipment)',
+         r'without (?:ppe|personal protective equipment|(?:safety )?(?:gloves|goggles|glasses|helmets?|hard hats?|respirators?))',
+         r'(?:ppe|personal protective equipment) (?:is|was|are|were) not (?:worn|used|provided)'],
+        'OSHA 1910.132', "Appropriate personal protective equipment must be provided and used.",
+        "Provide the required PPE and confirm it is worn before work starts."
+    ),
+    'falls': (
+        # Not the bare word: "responsibility falls on the contractor" is no hazard
+        [r'(?:risk|possibility|danger|likelihood|chance) of (?:(?:slips?|trips?),? (?:and |or )?)*falls?',
+         r'(?:slips?|trips?),? (?:and|or) falls?', r'fall (?:hazards?|risks?)', r'prone to falls?',
+         r'falls? from (?:heights?|ladders?|scaffold(?:s|ing)?|roofs?|platforms?)', r'falling objects?',
+         r'slippery', r'wet floors?', r'unguarded (?:edges?|openings?)', r'no guardrails?',
+         r'poor lighting', r'trip(?:ping)? hazards?'],
+        'OSHA 1910.22', "Walking-working surfaces must be kept clean, dry and free of hazards.",
+        "Improve lighting, keep floors dry and install guardrails where people can fall."
+    ),
+    'chemical': (
+        [r'chemical (?:exposure|spills?|burns?)', r'toxic (?:fumes|gas|gases|vapou?rs)',
+         r'hazardous (?:chemicals|substances)', r'unlabell?ed (?:containers?|chemicals?)', r'asbestos', r'corrosive'],
+        'OSHA 1910.1200', "Hazardous chemicals must be labelled and communicated to workers.",
+        "Label and store chemicals correctly and keep safety data sheets available."
+    ),
+    'machinery': (
+        [r'unguarded (?:machines?|machinery|conveyors?|blades?)', r'missing (?:machine )?guards?',
+         r'moving parts', r'pinch points?', r'entanglement'],
+        'OSHA 1910.212', "Machine guarding must protect operators from moving parts.",
+        "Fit and maintain machine guards before the equipment is used again."
+    ),
+    'lockout': (
+        [r'lock-?out/tag-?out', r'lockout', r'tagout', r'stored energy'],
+        'OSHA 1910.147', "Hazardous energy must be controlled during servicing and maintenance.",
+        "Apply lockout/tagout and verify zero energy before servicing equipment."
+    ),
+    'confined_space': (
+        [r'confined spaces?', r'oxygen[- ]deficien(?:t|cy)'],
+        'OSHA 1910.146', "Permit-required confined spaces need an entry permit program.",
+        "Test the atmosphere and issue an entry permit before anyone enters."
+    ),
+    'vehicles': (
+        [r'forklifts?', r'powered industrial trucks?'],
+        'OSHA 1910.178', "Powered industrial trucks must be operated by trained drivers.",
+        "Separate vehicle and pedestrian routes and confirm operators are certified."
+    ),
+    'noise': (
+        [r'excessive noise', r'noise (?:levels?|exposure)', r'hearing (?:loss|damage)'],
+        'OSHA 1910.95', "Noise exposure above the action level requires a hearing conservation program.",
+        "Measure noise levels and provide hearing protection where limits are exceeded."
+    ),
+    'housekeeping': (
+        [r'clutter(?:ed)?', r'blocked (?:exits?|aisles?|walkways?)', r'(?:exits?|aisles?|walkways?) (?:is|are) blocked', r'improperly (?:secured|stored|stacked)',
+         r'unsecured (?:equipment|loads?)'],
+        'OSHA 1910.22', "Walking-working surfaces must be kept clean, dry and free of hazards.",
+        "Clear walkways and exits and secure loose equipment."
+    ),
+}
+
+# Other cues the local backend reads, in the order they are tried after the
+# hazard categories at each position of the text
+CUES = {
+    'compliance': [r'non-?complian(?:t|ce)', r'violat(?:ions?|es|ed|ing)', r'not (?:compliant|in compliance)',
+                   r'(?:expired|missing|lapsed) (?:training|certifications?|permits?|inspections?|records?)',
+                   r'not (?:properly )?(?:inspected|certified|labell?ed|segregated|documented|trained)',
+                   r'without (?:a )?permits?', r'fail(?:s|ed)? to (?:comply|meet)'],
+    'incident': [r'incidents?', r'accidents?', r'injur(?:y|ies|ed)', r'near[- ]miss(?:es)?',
+                 r'fatalit(?:y|ies)', r'hospitali[sz]ed'],
+    'citation': [r'OSHA\s+\d{4}\.\d+', r'NFPA\s*\d+[A-Z]?', r'IEC\s*\d+(?:-\d+)*', r'ISO\s*\d+(?::\d{4})?',
+                 r'ANSI\s*[A-Z]?\d+(?:\.\d+)*'],
+    'past': [r'was', r'were', r'had', r'occurred', r'happened', r'historically', r'previously', r'past',
+             r'last (?:year|month|week)'],
+    'prevention': [r'prevent\w*', r'mitigat\w*', r'recommend\w*', r'ensure', r'avoid', r'address\w*'],
+    'negation': [r'no', r'not', r'never', r'without'],
+    # Generic risk language the lexicon can't classify on its own
+    'vague': [r'risks?', r'hazard(?:s|ous)?', r'danger(?:s|ous)?', r'unsafe', r'concerns?', r'caution',
+              r'warnings?', r'exposures?', r'injur\w*'],
+}
+
+def _compile_matcher():
+    """
+    Every lexicon phrase and cue in one alternation with a named group per
+    category, so a single pass over the text finds all of them
+    """
+    groups = [(f'h_{name}', phrases) for name, (phrases, _, _, _) in HAZARD_LEXICON.items()]
+    groups += [(f'c_{name}', phrases) for name, phrases in CUES.items()]
+    # The word boundaries are outside the alternation so positions inside a
+    # word are rejected before any phrase is tried
+    pattern = "|".join(rf"(?P<{group}>{'|'.join(phrases)})" for group, phrases in groups)
+    return re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)
+
+class AnalyzerBackend(ABC):
+    """
+    Produces the analysis and the revised text of one chunk of a document.
+
+    analyze() returns the analysis JSON schema of ANALYSIS_PROMPT, or an
+    error dict; revise() returns the revised text, or an error string
+    starting with REVISION_ERROR_PREFIX. on_item(key, item) and
+    on_token(piece) receive partial results as they become available.
+    """
+    name = None
+
+    @abstractmethod
+    def analyze(self, text, on_item=None):
+        ...
+
+    @abstractmethod
+    def revise(self, text, on_token=None):
+        ...
+
+    def stats(self):
+        return {}
+
+class OpenAIBackend(AnalyzerBackend):
+    """Sends every chunk to the OpenAI chat completions API, through the analysis cache"""
+    name = 'openai'
+
+    def analyze(self, text, on_item=None):
+        # Imported here: the analyzer module creates the backend at import time
+        from app.utils.analyzer import openai_analysis
+        return openai_analysis(text, on_item)
+
+    def revise(self, text, on_token=None):
+        from app.utils.analyzer import openai_revision
+        return openai_revision(text, on_token)
+
+class LocalBackend(AnalyzerBackend):
+    """
+    Rule-based analysis over HAZARD_LEXICON, with no network calls.
+
+    The whole text is scanned once with a single compiled pattern and every
+    match is attributed to the sentence it falls in. Sentences matching a
+    hazard category are reported as hazards, and get that category's
+    recommendation in the revised text; compliance and incident cues are
+    reported the same way. Standards come from the hazard categories found
+    and from citations in the text.
+    """
+    name = 'local'
+
+    def __init__(self):
+        self.matcher = _compile_matcher()
+
+    def scan(self, text):
+        """
+        Classify each sentence of text. Returns (sentences, ambiguous) where
+        sentences is a list of dicts with the sentence's span, text and the
+        set of categories and cues matched in it, and ambiguous is True when
+        the rules can't be trusted with this text: a sentence uses risk
+        language no category explains, or negates a hazard it mentions.
+        """
+        sentences = []
+        for start, end in sentence_spans(text):
+            sentence = text[start:end]
+            # Lines ending in ':' are headings
+            if not sentence.endswith(':'):
+                sentences.append({'start': start, 'end': end, 'text': sentence,
+                                  'hazards': [], 'cues': set(), 'citations': []})
+        starts = [sentence['start'] for sentence in sentences]
+
+        for match in self.matcher.finditer(text):
+            index = bisect_right(starts, match.start()) - 1
+            if index < 0 or match.start() >= sentences[index]['end']:
+                continue
+            sentence = sentences[index]
+            kind, _, name = match.lastgroup.partition('_')
+            if kind == 'h':
+                if name not in sentence['hazards']:
+                    sentence['hazards'].append(name)
+            else:
+                sentence['cues'].add(name)
+                if name == 'citation':
+                    sentence['citations'].append(re.sub(r'\s+', ' ', match.group()))
+
+        ambiguous = False
+        for sentence in sentences:
+            cues = sentence['cues']
+            if sentence['hazards'] and 'negation' in cues:
+                ambiguous = True
+            elif 'vague' in cues and not (sentence['hazards'] or cues & {'compliance', 'incident', 'prevention'}):
+                ambiguous = True
+        return sentences, ambiguous
+
+    def analysis_from(self, sentences):
+        analysis = {
+            "detected_hazards": [],
+            "compliance_issues": [],
+            "regulatory_comments": {},
+            "accident_incidents": []
+        }
+        categories = []
+        for sentence in sentences:
+            cues = sentence['cues']
+            is_incident = 'incident' in cues and 'past' in cues
+            if sentence['hazards'] and not is_incident and 'prevention' not in cues:
+                analysis["detected_hazards"].append(sentence['text'])
+                categories.extend(name for name in sentence['hazards'] if name not in categories)
+            if 'compliance' in cues:
+                analysis["compliance_issues"].append(sentence['text'])
+            if is_incident:
+                analysis["accident_incidents"].append(sentence['text'])
+            for citation in sentence['citations']:
+                analysis["regulatory_comments"].setdefault(citation, sentence['text'])
+        for name in categories:
+            _, standard, guideline, _ = HAZARD_LEXICON[name]
+            analysis["regulatory_comments"].setdefault(standard, guideline)
+        return analysis
+
+    def analyze(self, text, on_item=None):
+        sentences, _ = self.scan(text)
+        analysis = self.analysis_from(sentences)
+        if on_item is not None:
+            for key in ("detected_hazards", "compliance_issues", "accident_incidents"):
+                for item in analysis[key]:
+                    on_item(key, item)
+        return analysis
+
+    def revise(self, text, on_token=None):
+        sentences, _ = self.scan(text)
+        hazards = set(self.analysis_from(sentences)["detected_hazards"])
+        parts = []
+        position = 0
+        for sentence in sentences:
+            if sentence['text'] in hazards:
+                # Insert right after the sentence, keeping everything else as is
+                recommendation = HAZARD_LEXICON[sentence['hazards'][0]][3]
+                parts.append(text[position:sentence['end']])
+                parts.append(f" Recommendation: {recommendation}")
+                position = sentence['end']
+        parts.append(text[position:])
+        revised = "".join(parts)
+        if on_token is not None:
+            on_token(revised)
+        return revised
+
+class TieredBackend(AnalyzerBackend):
+    """
+    Runs the local backend first and escalates to the remote one (OpenAI)
+    only for chunks the rules flag as ambiguous. Both halves of a chunk,
+    analysis and revision, go the same way.
+    """
+    name = 'tiered'
+
+    def __init__(self, local=None, remote=None):
+        self.local = local or LocalBackend()
+        self.remote = remote or OpenAIBackend()
+        self._lock = threading.Lock()
+        self.counters = {'local': 0, 'escalated': 0}
+
+    def analyze(self, text, on_item=None):
+        _, ambiguous = self.local.scan(text)
+        with self._lock:
+            self.counters['escalated' if ambiguous else 'local'] += 1
+        if ambiguous:
+            return self.remote.analyze(text, on_item)
+        return self.local.analyze(text, on_item)
+
+    def revise(self, text, on_token=None):
+        _, ambiguous = self.local.scan(text)
+        if ambiguous:
+            return self.remote.revise(text, on_token)
+        return self.local.revise(text, on_token)
+
+    def stats(self):
+        """How many chunks were analyzed locally and how many went to the remote backend"""
+        with self._lock:
+            return dict(self.counters)
+
+def create_backend(name):
+    """The backend called name, one of BACKENDS"""
+    if name == 'openai':
+        return OpenAIBackend()
+    if name == 'local':
+        return LocalBackend()
+    if name == 'tiered':
+        return TieredBackend()
+    raise ValueError(f"Unknown analyzer backend: {name}")
@@ -0,0 +1,143 @@
+# app/utils/blobs.py
+
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from app.utils.diffing import opcodes
+
+# Codecs of rows in the blobs table
+SNAPSHOT = 'zlib'  # the whole text, zlib-compressed
+DELTA = 'delta'    # zlib-compressed line edits against the blob in base_id
+
+def compress_text(text):
+    """Compress a standalone text for storage in a BLOB column"""
+    if text is None:
+        return None
+    return zlib.compress(text.encode('utf-8'))
+
+def decompress_text(value):
+    """
+    Inverse of compress_text. Rows written before compression was introduced
+    hold plain TEXT, which is returned unchanged.
+    """
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+def content_hash(text):
+    """The digest identifying a text in blobs.content_hash"""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+def encode_delta(base, text):
+    """
+    Describe text as edits to base: a list whose items are either [start, end],
+    copying lines start..end of base, or a string of new lines to insert.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in opcodes(base_lines, lines):
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(lines[j1:j2]))
+    return ops
+
+def apply_delta(base, ops):
+    base_lines = base.splitlines(keepends=True)
+    return "".join(
+        op if isinstance(op, str) else "".join(base_lines[op[0]:op[1]])
+        for op in ops
+    )
+
+class TextCache:
+    """Thread-safe LRU of materialized blob texts, keyed by blob id"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_id):
+        with self._lock:
+            text = self._entries.get(blob_id)
+            if text is not None:
+                self._entries.move_to_end(blob_id)
+            return text
+
+    def put(self, blob_id, text):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[blob_id] = text
+            self._entries.move_to_end(blob_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def store_text(conn, text, base_id=None, max_depth=16, cache=None):
+    """
+    Store text in the blobs table and return its blob id.
+
+    A text that is already stored, for this document or any other, is not
+    stored again: the existing blob's id is returned. Otherwise, with a base_id the text is stored as a delta against that blob, unless the
+    chain of deltas behind it has reached max_depth or a full snapshot would be
+    smaller. Bounding the chain bounds the work needed to read any blob back.
+    Returns None, storing nothing, when text is None.
+    """
+    if text is None:
+        return None
+    digest = content_hash(text)
+    existing = conn.execute('SELECT id FROM blobs WHERE content_hash = ? LIMIT 1', (digest,)).fetchone()
+    if existing is not None:
+        return existing[0]
+    snapshot = compress_text(text)
+    codec, data, depth = SNAPSHOT, snapshot, 0
+    if base_id is not None:
+        base_depth = conn.execute('SELECT depth FROM blobs WHERE id = ?', (base_id,)).fetchone()
+        if base_depth is not None and base_depth[0] + 1 < max_depth:
+            base = load_text(conn, base_id, cache)
+            delta = zlib.compress(json.dumps(encode_delta(base, text), separators=(',', ':')).encode('utf-8'))
+            if len(delta) < len(snapshot):
+                codec, data, depth = DELTA, delta, base_depth[0] + 1
+    cursor = conn.execute(
+        'INSERT INTO blobs (codec, base_id, depth, raw_size, data, content_hash) VALUES (?, ?, ?, ?, ?, ?)',
+        (codec, base_id if codec == DELTA else None, depth, len(text), data, digest)
+    )
+    if cache is not None:
+        cache.put(cursor.lastrowid, text)
+    return cursor.lastrowid
+
+def load_text(conn, blob_id, cache=None):
+    """
+    Materialize a blob by walking back to the nearest snapshot (or cached
+    text) and replaying the deltas from there. Works on any sqlite3
+    connection to the database, not just the app's own.
+    """
+    chain = []
+    text = None
+    current = blob_id
+    while current is not None:
+        text = cache.get(current) if cache is not None else None
+        if text is not None:
+            break
+        row = conn.execute('SELECT codec, base_id, data FROM blobs WHERE id = ?', (current,)).fetchone()
+        if row is None:
+            raise LookupError(f"Blob {current} does not exist")
+        codec, base_id, data = row
+        chain.append((current, codec, data))
+        current = base_id if codec == DELTA else None
+
+    for chain_id, codec, data in reversed(chain):
+        if codec == SNAPSHOT:
+            text = decompress_text(data)
+        else:
+            text = apply_delta(text, json.loads(zlib.decompress(data)))
+        if cache is not None:
+            cache.put(chain_id, text)
+    return text
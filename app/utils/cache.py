@@ -0,0 +1,121 @@
+# app/utils/cache.py
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text):
+    """
+    Normalizes a document before hashing so that line-ending and trailing
+    whitespace differences don't defeat the cache.
+    """
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+class AnalysisCache:
+    """
+    Content-addressed cache for OpenAI results.
+
+    An in-process LRU sits in front of the llm_cache table of db, the
+    DatabaseConnection of the app the cache belongs to; without a db only the
+    LRU is used. Values are kept JSON-encoded in both tiers so callers always
+    get a fresh copy.
+    """
+
+    def __init__(self, db=None, memory_entries=None, max_bytes=None, ttl_seconds=None, enabled=None,
+                 access_resolution=None):
+        self.db = db
+        self.enabled = enabled if enabled is not None else Config.CACHE_ENABLED
+        self.memory_entries = memory_entries if memory_entries is not None else Config.CACHE_MEMORY_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else Config.CACHE_MAX_BYTES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.CACHE_TTL_SECONDS
+        self.access_resolution = (
+            access_resolution if access_resolution is not None else Config.CACHE_ACCESS_RESOLUTION
+        )
+        self._memory = OrderedDict()  # key -> (created_at, encoded value)
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(kind, text, *params):
+        """Hash of the normalized text, the prompt template(s) and the model settings"""
+        payload = json.dumps([kind, normalize_text(text), *params])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, encoded = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return json.loads(encoded)
+                del self._memory[key]
+
+        row = None
+        if self.db is not None:
+            try:
+                row = self.db.get_cached_result(key, now - self.ttl_seconds, self.access_resolution)
+            except sqlite3.Error as e:
+                # The cache is best-effort; a broken cache must never fail an analysis
+                logger.warning("Cache lookup failed: %s", e)
+        if row is None:
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+
+        created_at, encoded = row
+        with self._lock:
+            self.counters['disk_hits'] += 1
+            self._remember(key, created_at, encoded)
+        return json.loads(encoded)
+
+    def set(self, key, value):
+        """Store value (anything JSON serializable) under key"""
+        if not self.enabled:
+            return
+        now = time.time()
+        encoded = json.dumps(value)
+        with self._lock:
+            self.counters['stores'] += 1
+            self._remember(key, now, encoded)
+        if self.db is None:
+            return
+        try:
+            evicted = self.db.store_cached_result(key, encoded, now, now - self.ttl_seconds, self.max_bytes)
+        except sqlite3.Error as e:
+            logger.warning("Cache store failed: %s", e)
+            return
+        with self._lock:
+            self.counters['evictions'] += evicted
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, created_at, encoded):
+        # Caller holds self._lock
+        self._memory[key] = (created_at, encoded)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,75 @@
+# app/utils/compression.py
+
+import zlib
+from app.config import setting
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+# Server-Sent Events are left alone: each event has to reach the client as it happens
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/csv', 'text/html')
+
+def available_encodings():
+    """Content codings this server can produce, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def compressor(encoding):
+    """(compress, flush, finish) functions of a new compressor for encoding"""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=setting('COMPRESS_BR_QUALITY'))
+        return c.process, c.flush, c.finish
+    # wbits=31 writes the gzip header and trailer
+    c = zlib.compressobj(setting('COMPRESS_LEVEL'), zlib.DEFLATED, 31)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+def compress(data, encoding):
+    process, _, finish = compressor(encoding)
+    return process(data) + finish()
+
+def compress_stream(chunks, encoding):
+    """
+    Compress an iterable of str or bytes chunks as it is consumed. Each
+    chunk is flushed, so a client still gets every chunk as soon as it is
+    produced, just smaller.
+    """
+    process, flush, finish = compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(response, accept_encodings):
+    """
+    Compress a response in place with the best coding the request's parsed
+    Accept-Encoding allows, if the body is compressible and large enough;
+    streamed bodies are compressed as they are sent. Returns the coding
+    used, or None.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return None
+    streamed = response.is_streamed
+    if not streamed and (response.content_length or 0) < setting('COMPRESS_MIN_BYTES'):
+        return None
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return None
+    if streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return encoding
@@ -0,0 +1,287 @@
+# app/utils/diffing.py
+
+import difflib
+from bisect import bisect_left, bisect_right
+from app.config import setting
+from app.utils.sections import SECTION_HEADING
+
+ENGINES = ('patience', 'myers', 'difflib')
+
+# Myers stops looking for a shorter script after this many edits in one
+# region and reports the rest of the region as replaced, like GNU diff's
+# --speed-large-files. This bounds the worst case at O((N + M) * cost).
+MYERS_MAX_COST = 1000
+
+def opcodes(a_lines, b_lines, engine=None):
+    """
+    Line-level edit script from a_lines to b_lines as (tag, i1, i2, j1, j2)
+    tuples, with the same tags and meaning as difflib.SequenceMatcher.get_opcodes().
+
+    engine is one of ENGINES and defaults to the DIFF_ENGINE setting. 'patience'
+    anchors on lines that occur exactly once on both sides and falls back to
+    Myers between anchors; 'myers' uses Myers alone; 'difflib' is the
+    standard library's SequenceMatcher.
+    """
+    engine = engine or setting('DIFF_ENGINE')
+    if engine == 'difflib':
+        return difflib.SequenceMatcher(None, a_lines, b_lines).get_opcodes()
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown diff engine: {engine}")
+
+    # Compare small integers instead of strings
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a_lines]
+    b = [ids.setdefault(line, len(ids)) for line in b_lines]
+    # Matching runs of lines as (i, j, length); recording runs rather than
+    # single lines keeps memory proportional to the number of changes
+    matches = []
+    if engine == 'patience':
+        _patience(a, b, matches)
+    else:
+        _trimmed(a, b, 0, len(a), 0, len(b), matches, _myers)
+    matches.sort()
+    return _to_opcodes(matches, len(a), len(b))
+
+def _trimmed(a, b, a_lo, a_hi, b_lo, b_hi, matches, diff_middle):
+    """Match the common prefix and suffix of a region, then diff what's left"""
+    start = a_lo
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        a_lo += 1
+        b_lo += 1
+    if a_lo > start:
+        matches.append((start, b_lo - (a_lo - start), a_lo - start))
+    end = a_hi
+    while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    if end > a_hi:
+        matches.append((a_hi, b_hi, end - a_hi))
+    if a_lo < a_hi and b_lo < b_hi:
+        diff_middle(a, b, a_lo, a_hi, b_lo, b_hi, matches)
+
+def _patience(a, b, matches):
+    # An explicit stack of regions instead of recursion, so deeply nested
+    # documents can't hit the recursion limit
+    regions = [(0, len(a), 0, len(b))]
+
+    def split(a, b, a_lo, a_hi, b_lo, b_hi, matches):
+        anchors = _unique_common(a, b, a_lo, a_hi, b_lo, b_hi)
+        if not anchors:
+            _myers(a, b, a_lo, a_hi, b_lo, b_hi, matches)
+            return
+        previous_i, previous_j = a_lo, b_lo
+        for i, j in anchors:
+            matches.append((i, j, 1))
+            regions.append((previous_i, i, previous_j, j))
+            previous_i, previous_j = i + 1, j + 1
+        regions.append((previous_i, a_hi, previous_j, b_hi))
+
+    while regions:
+        a_lo, a_hi, b_lo, b_hi = regions.pop()
+        _trimmed(a, b, a_lo, a_hi, b_lo, b_hi, matches, split)
+
+def _unique_common(a, b, a_lo, a_hi, b_lo, b_hi):
+    """
+    Lines that occur exactly once in both regions, as (i, j) pairs forming
+    the longest sequence that is in order on both sides.
+    """
+    counts = {}
+    for i in range(a_lo, a_hi):
+        count, _ = counts.get(a[i], (0, None))
+        counts[a[i]] = (count + 1, i)
+    b_positions = {}
+    for j in range(b_lo, b_hi):
+        if counts.get(b[j], (0,))[0] == 1:
+            b_positions[b[j]] = None if b[j] in b_positions else j
+    pairs = sorted(
+        (counts[line][1], j) for line, j in b_positions.items() if j is not None
+    )
+
+    # Longest increasing subsequence of the b positions, by patience sorting
+    tops = []         # b position at the top of each pile
+    top_indices = []  # index into pairs of each pile's top
+    back = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pile = bisect_left(tops, j)
+        back[index] = top_indices[pile - 1] if pile else None
+        if pile == len(tops):
+            tops.append(j)
+            top_indices.append(index)
+        else:
+            tops[pile] = j
+            top_indices[pile] = index
+    anchors = []
+    index = top_indices[-1] if top_indices else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = back[index]
+    anchors.reverse()
+    return anchors
+
+def _myers(a, b, a_lo, a_hi, b_lo, b_hi, matches):
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = min(n + m, MYERS_MAX_COST)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        # Keep only the diagonals reachable at this cost
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                _myers_backtrack(trace, n, m, a_lo, b_lo, matches)
+                return
+    # Too many edits: leave the whole region unmatched
+
+def _myers_backtrack(trace, x, y, a_lo, b_lo, matches):
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        # v covers diagonals -d-1 .. d+1
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[previous_k + d + 1]
+        previous_y = previous_x - previous_k
+        # The diagonal run that ended at (x, y)
+        length = min(x - previous_x, y - previous_y)
+        if length > 0:
+            matches.append((a_lo + x - length, b_lo + y - length, length))
+        x, y = previous_x, previous_y
+
+def _to_opcodes(matches, n, m):
+    """Turn sorted (i, j, length) runs of matching lines into opcodes"""
+    codes = []
+    i = j = 0       # just past the last match
+    start = None    # where the current stretch of adjacent runs began
+    for match_i, match_j, length in matches:
+        if start is not None and (match_i, match_j) == (i, j):
+            i += length
+            j += length
+            continue
+        if start is not None:
+            codes.append(('equal', start[0], i, start[1], j))
+        codes.extend(_gap(i, match_i, j, match_j))
+        start = (match_i, match_j)
+        i, j = match_i + length, match_j + length
+    if start is not None:
+        codes.append(('equal', start[0], i, start[1], j))
+    codes.extend(_gap(i, n, j, m))
+    return codes
+
+def _gap(i1, i2, j1, j2):
+    if i1 < i2 and j1 < j2:
+        return [('replace', i1, i2, j1, j2)]
+    if i1 < i2:
+        return [('delete', i1, i2, j1, j2)]
+    if j1 < j2:
+        return [('insert', i1, i2, j1, j2)]
+    return []
+
+def group_opcodes(codes, n=3):
+    """Hunks of changes with up to n lines of context, as difflib.SequenceMatcher.get_grouped_opcodes()"""
+    codes = list(codes)
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # End the hunk at a long run of unchanged lines
+        if tag == 'equal' and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def _format_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+def unified_diff(a_lines, b_lines, fromfile='', tofile='', n=3, engine=None):
+    """
+    Yield the lines of a unified diff, without line terminators, in the same
+    format as difflib.unified_diff(..., lineterm=''). Lines are produced one
+    hunk at a time, so callers can stream the diff instead of building it
+    as one string.
+    """
+    started = False
+    for group in group_opcodes(opcodes(a_lines, b_lines, engine), n):
+        if not started:
+            started = True
+            yield f'--- {fromfile}'
+            yield f'+++ {tofile}'
+        first, last = group[0], group[-1]
+        yield f'@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@'
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a_lines[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a_lines[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b_lines[j1:j2]:
+                    yield '+' + line
+
+def structured_diff(a_lines, b_lines, engine=None):
+    """
+    The changes from a_lines to b_lines as a list of dicts with the change
+    type ('insert', 'delete' or 'replace'), 1-based start lines and line
+    counts on both sides, and the heading of the numbered section the change
+    falls in (None before the first heading). Deletions take their section
+    from the old text, everything else from the new text.
+    """
+    def headings(lines):
+        positions = [index for index, line in enumerate(lines) if SECTION_HEADING.match(line)]
+        return positions, [lines[index].strip() for index in positions]
+
+    old_positions, old_headings = headings(a_lines)
+    new_positions, new_headings = headings(b_lines)
+
+    def section(positions, names, index):
+        found = bisect_right(positions, index) - 1
+        return names[found] if found >= 0 else None
+
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes(a_lines, b_lines, engine):
+        if tag == 'equal':
+            continue
+        if tag == 'delete':
+            heading = section(old_positions, old_headings, i1)
+        else:
+            heading = section(new_positions, new_headings, j1)
+        changes.append({
+            'type': tag,
+            'section': heading,
+            'old_start': i1 + 1,
+            'old_lines': i2 - i1,
+            'new_start': j1 + 1,
+            'new_lines': j2 - j1
+        })
+    return changes
@@ -0,0 +1,171 @@
+# app/utils/jobs.py
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit"""
+
+class JobQueue:
+    """
+    Background job queue persisted in the jobs table.
+
+    Jobs survive restarts: anything still queued, or running when its process
+    died, is picked up again. Several processes can share the table. Each
+    queue holds a lease on the jobs it is running and renews it every third
+    of lease_seconds. Only jobs whose lease has run out are requeued, so a
+    job running in a live process is never started a second time. Finished
+    jobs are deleted retention_seconds after they finish. Each job kind maps
+    to a handler that takes the job payload and returns (result, status_code);
+    a status code outside 2xx marks the job failed.
+    """
+
+    def __init__(self, db, handlers, workers=None, max_depth=None, poll_interval=None, lease_seconds=None,
+                 retention_seconds=None):
+        self.db = db
+        self.handlers = handlers
+        self.workers = workers if workers is not None else Config.JOB_WORKERS
+        self.max_depth = max_depth if max_depth is not None else Config.JOB_QUEUE_MAX_DEPTH
+        # Workers also poll so they notice jobs submitted by other processes
+        self.poll_interval = poll_interval if poll_interval is not None else Config.JOB_POLL_INTERVAL
+        self.lease_seconds = lease_seconds if lease_seconds is not None else Config.JOB_LEASE_SECONDS
+        self.retention_seconds = (
+            retention_seconds if retention_seconds is not None else Config.JOB_RETENTION_SECONDS
+        )
+        # This queue's name on the jobs it claims
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._stopped = threading.Event()
+        self._wakeup = threading.Condition()
+        self._signals = 0  # submissions not yet noticed by a worker
+        self._threads = []
+        self._lock = threading.Lock()
+        self.counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    def start(self):
+        """Start the worker threads, requeue jobs whose process died and delete expired ones"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopped.clear()
+            self._requeue_expired()
+            self._purge_finished()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._keep_leases, name='job-leases', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, kind, payload):
+        """Persist a job and wake a worker. Returns the new job id."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = str(uuid.uuid4())
+        if not self.db.create_job(job_id, kind, json.dumps(payload), time.time(), self.max_depth):
+            with self._lock:
+                self.counters['rejected'] += 1
+            raise QueueFullError(f"Job queue is full ({self.max_depth} jobs waiting)")
+        with self._lock:
+            self.counters['submitted'] += 1
+        with self._wakeup:
+            self._signals += 1
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        return self.db.get_job(job_id)
+
+    def metrics(self):
+        """Queue depth and throughput figures for monitoring backpressure"""
+        by_status = self.db.count_jobs_by_status()
+        with self._lock:
+            metrics = dict(self.counters)
+            finished = metrics['completed'] + metrics['failed']
+            metrics['avg_wait_seconds'] = self._wait_seconds / finished if finished else 0.0
+            metrics['avg_run_seconds'] = self._run_seconds / finished if finished else 0.0
+        metrics.update({
+            'queued': by_status.get('queued', 0),
+            'running': by_status.get('running', 0),
+            'max_depth': self.max_depth,
+            'workers': self.workers
+        })
+        return metrics
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                now = time.time()
+                job = self.db.claim_next_job(now, self.owner, now + self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.warning("Could not claim a job: %s", e)
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not self._signals:
+                        self._wakeup.wait(self.poll_interval)
+                    self._signals = max(0, self._signals - 1)
+                continue
+            try:
+                self._run(job)
+            except sqlite3.Error as e:
+                logger.warning("Could not record the result of job %s: %s", job['job_id'], e)
+
+    def _requeue_expired(self):
+        requeued = self.db.requeue_expired_jobs(time.time())
+        if requeued:
+            logger.info("Requeued %d jobs whose process stopped renewing their lease", requeued)
+
+    def _purge_finished(self):
+        if self.retention_seconds:
+            purged = self.db.delete_finished_jobs(time.time() - self.retention_seconds)
+            if purged:
+                logger.info("Deleted %d jobs finished more than %s seconds ago", purged, self.retention_seconds)
+
+    def _keep_leases(self):
+        # Renew this queue's leases well before they run out, take back the
+        # jobs of queues that stopped renewing theirs and drop expired jobs
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.db.renew_job_leases(self.owner, time.time() + self.lease_seconds)
+                self._requeue_expired()
+                self._purge_finished()
+            except sqlite3.Error as e:
+                logger.warning("Could not renew job leases: %s", e)
+
+    def _run(self, job):
+        started_at = job['started_at']
+        try:
+            result, status_code = self.handlers[job['kind']](**job['payload'])
+            # Handlers report errors like a conflicting re-audit as a status code
+            status = 'completed' if 200 <= status_code < 300 else 'failed'
+        except Exception as e:
+            logger.exception("Job %s failed", job['job_id'])
+            result, status_code = {'error': f"Job failed: {str(e)}"}, 500
+            status = 'failed'
+        finished_at = time.time()
+        self.db.finish_job(job['job_id'], status, json.dumps(result), status_code, finished_at)
+        with self._lock:
+            self.counters[status] += 1
+            self._wait_seconds += started_at - job['created_at']
+            self._run_seconds += finished_at - started_at
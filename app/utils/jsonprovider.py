@@ -0,0 +1,49 @@
+# app/utils/jsonprovider.py
+
+from flask.json.provider import DefaultJSONProvider
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider on orjson, which encodes the long text fields of
+    revisions several times faster. The output matches the default
+    provider's (sorted keys, dates as HTTP dates, indented in debug mode)
+    except that non-ASCII characters are written as UTF-8, not escaped.
+    """
+
+    def __init__(self, app):
+        import orjson
+        super().__init__(app)
+        self._orjson = orjson
+        # Dates are passed to default() so they come out as the default provider writes them
+        self._options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # json.dumps() options such as indent; nothing in the app passes any
+            return super().dumps(obj, **kwargs)
+        return self._orjson.dumps(obj, default=self.default, option=self._options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        options = self._options
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= self._orjson.OPT_INDENT_2
+        data = self._orjson.dumps(obj, default=self.default, option=options) + b"\n"
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+def create_json_provider(app):
+    """The JSON provider app.config['JSON_PROVIDER'] asks for: 'auto' takes orjson if it is installed"""
+    choice = app.config.get('JSON_PROVIDER', 'auto')
+    if choice == 'stdlib':
+        return DefaultJSONProvider(app)
+    try:
+        return OrjsonProvider(app)
+    except ImportError:
+        if choice == 'orjson':
+            raise RuntimeError("JSON_PROVIDER = 'orjson' needs orjson (pip install orjson)") from None
+        return DefaultJSONProvider(app)
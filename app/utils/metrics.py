@@ -0,0 +1,348 @@
+# app/utils/metrics.py
+
+import collections
+import contextvars
+import math
+import sys
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from app.config import Config, setting
+
+# Latency buckets in seconds, from a cached SQLite read to a long OpenAI call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Payload sizes in bytes, 256 B to 16 MiB
+SIZE_BUCKETS = tuple(256 * 4 ** power for power in range(9))
+# Tokens per OpenAI call
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Counter:
+    """A monotonically increasing count per combination of label values"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets per combination of label
+    values, as Prometheus histograms are exposed
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self, *labels):
+        """(count, sum) observed for these label values"""
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                return 0, 0.0
+            return sum(counts[:-1]), counts[-1]
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        names = self.labelnames + ('le',)
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(names, labels + (_format_value(bound),)), cumulative
+            label_text = _format_labels(self.labelnames, labels)
+            yield self.name + '_count', label_text, cumulative
+            yield self.name + '_sum', label_text, counts[-1]
+
+class Registry:
+    """
+    The metrics exposed on /metrics: counters and histograms updated as
+    requests run, plus collectors called at scrape time for figures other
+    components already keep (cache, job queue and OpenAI call counters).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """
+        collect() returns an iterable of (name, kind, help, value) for
+        unlabelled counters and gauges; counter names get a _total suffix
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in metric.samples())
+        for collect in self._collectors:
+            for name, kind, help, value in collect():
+                if kind == 'counter':
+                    name += '_total'
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def dict_collector(prefix, read, counters=(), help=''):
+    """
+    A collector exposing the numeric values of the dict returned by read()
+    as {prefix}_{key}; keys in counters are exposed as counters, the rest as
+    gauges
+    """
+    def collect():
+        for key, value in read().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{prefix}_{key}', 'counter' if key in counters else 'gauge', f'{help} ({key})', value
+    return collect
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'audit_http_request_duration_seconds', 'Time to handle an HTTP request, up to the response headers',
+    ('method', 'endpoint', 'status'))
+REQUEST_BYTES = registry.histogram(
+    'audit_http_request_size_bytes', 'Size of HTTP request bodies', ('endpoint',), SIZE_BUCKETS)
+RESPONSE_BYTES = registry.histogram(
+    'audit_http_response_size_bytes', 'Size of HTTP response bodies that are not streamed', ('endpoint',), SIZE_BUCKETS)
+STAGE_SECONDS = registry.histogram(
+    'audit_stage_duration_seconds', 'Time spent in each stage of the analysis pipeline', ('stage',))
+DB_SECONDS = registry.histogram(
+    'audit_db_query_duration_seconds', 'Time spent in each database operation', ('operation',))
+OPENAI_TOKENS = registry.histogram(
+    'audit_openai_tokens', 'Tokens used per OpenAI call', (), TOKEN_BUCKETS)
+
+# Whether the current request records metrics, set once by the request hooks
+# so timed blocks don't each look up METRICS_ENABLED in the app config;
+# None outside requests, where the setting is read instead
+current_enabled = contextvars.ContextVar('current_enabled', default=None)
+
+def enabled():
+    """Whether metrics are recorded here: for the current request, or per METRICS_ENABLED"""
+    value = current_enabled.get()
+    return setting('METRICS_ENABLED') if value is None else value
+
+# Spans of the current request when it asked for a trace, as (name, seconds)
+# pairs; None otherwise. Worker threads see the request's list when their
+# task is submitted with contextvars.copy_context().run.
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class timed:
+    """
+    Context manager observing the duration of its block in histogram under
+    label, and adding it to the request's trace. A class rather than a
+    generator-based context manager, which costs several times as much per block.
+    """
+    __slots__ = ('histogram', 'label', 'trace_name', 'start')
+
+    def __init__(self, histogram, label, trace_name=None):
+        self.histogram = histogram
+        self.label = label
+        self.trace_name = trace_name
+        self.start = None
+
+    def __enter__(self):
+        if enabled():
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, self.label)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.append((self.trace_name or self.label, elapsed))
+        return False
+
+def timed_function(histogram, label, trace_name=None):
+    """Decorator form of timed() for functions that return (not generators)"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            with timed(histogram, label, trace_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def db_timed(operation):
+    """Time a DatabaseConnection method as a database operation"""
+    return timed_function(DB_SECONDS, operation, f'db.{operation}')
+
+def start_trace():
+    """Start collecting spans for the current request; returns the token to pass to end_trace()"""
+    return current_trace.set([])
+
+def end_trace(token):
+    """Stop collecting spans and return them"""
+    trace = current_trace.get()
+    current_trace.reset(token)
+    return trace or []
+
+def server_timing(spans, total=None):
+    """
+    A Server-Timing header value from (name, seconds) spans. Spans with the
+    same name are summed, with the number of occurrences in desc.
+    """
+    totals = {}
+    counts = collections.Counter()
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+        counts[name] += 1
+    entries = [
+        f'{name};dur={seconds * 1000:.2f}' + (f';desc="{counts[name]}x"' if counts[name] > 1 else '')
+        for name, seconds in totals.items()
+    ]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every interval seconds while running
+    and counts them, for a flame graph of where the time goes in production.
+    Stacks are kept in collapsed form ("outer;inner;leaf"), as expected by
+    flamegraph.pl and speedscope. Starting and stopping is safe at any time.
+    """
+
+    def __init__(self, interval=None, max_depth=64):
+        self.interval = interval or Config.PROFILER_INTERVAL
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        # Time spent taking samples, i.e. the profiler's own cost
+        self.busy_seconds = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if interval:
+                self.interval = interval
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self.stacks = collections.Counter()
+            self.samples = 0
+            self.busy_seconds = 0.0
+
+    def _run(self):
+        own = threading.get_ident()
+        # Frame names by code object, so each sample only walks the stacks
+        names_by_code = {}
+        while not self._stopping.wait(self.interval):
+            start = time.perf_counter()
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    name = names_by_code.get(code)
+                    if name is None:
+                        name = names_by_code[code] = f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]})'
+                    names.append(name)
+                    frame = frame.f_back
+                names.reverse()
+                sampled.append(';'.join(names))
+            with self._lock:
+                self.stacks.update(sampled)
+                self.samples += 1
+                self.busy_seconds += time.perf_counter() - start
+
+    def collapsed(self):
+        """The sampled stacks, one "stack count" line each, most frequent first"""
+        with self._lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def status(self):
+        with self._lock:
+            return {'running': self._thread is not None, 'interval': self.interval,
+                    'samples': self.samples, 'stacks': len(self.stacks), 'busy_seconds': self.busy_seconds}
+
+profiler = SamplingProfiler()
@@ -0,0 +1,178 @@
+# app/utils/ratelimit.py
+
+import random
+import threading
+import time
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets shared by every thread
+    that talks to OpenAI.
+
+    Both budgets are token buckets that refill continuously and hold at most
+    one minute's worth. acquire() blocks until the request fits in both.
+    A limit of None disables that budget.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, clock=time.monotonic, sleep=time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = clock()
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Wait until one request of the given token cost fits. Returns seconds
+        waited. Raises TimeoutError, without using any budget, if that would
+        take longer than timeout seconds.
+        """
+        if not self.enabled:
+            return 0.0
+        # A single request larger than the whole budget can still go through once the bucket is full
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                request_deficit = 1 - self._requests if self.requests_per_minute else 0
+                token_deficit = tokens - self._tokens if self.tokens_per_minute else 0
+                if request_deficit <= 0 and token_deficit <= 0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return waited
+                delay = max(
+                    request_deficit * 60 / self.requests_per_minute if request_deficit > 0 else 0,
+                    token_deficit * 60 / self.tokens_per_minute if token_deficit > 0 else 0
+                )
+            if timeout is not None and waited + delay > timeout:
+                raise TimeoutError(f"Rate limit capacity not available within {timeout:.1f}s")
+            self._sleep(delay)
+            waited += delay
+
+    def _refill(self):
+        # Caller holds self._lock
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+class RetriesExhausted(Exception):
+    """A call kept failing transiently until it ran out of retries or time"""
+
+class CallScheduler:
+    """
+    Runs outbound API calls inside a RateLimiter's budgets, retrying
+    transient failures with jittered exponential backoff.
+
+    is_transient(error) decides which exceptions are worth retrying and
+    retry_after(error), if given, returns the server's requested delay in
+    seconds (or None). Each call has a deadline covering the rate limit wait,
+    every attempt and the backoff between them; a call that can't finish in
+    time raises RetriesExhausted instead of waiting longer. Other errors are
+    raised as-is on the first attempt.
+    """
+
+    def __init__(self, rate_limiter, is_transient, retry_after=None, max_retries=4, base_delay=0.5,
+                 max_delay=30.0, deadline=180.0, clock=time.monotonic, sleep=time.sleep, rng=None):
+        self.rate_limiter = rate_limiter
+        self.is_transient = is_transient
+        self.retry_after = retry_after
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0, 'succeeded': 0, 'failed': 0, 'gave_up': 0, 'attempts': 0, 'retries': 0,
+            'tokens_reserved': 0, 'tokens_used': 0
+        }
+        self._queue_wait_seconds = 0.0
+        self._backoff_seconds = 0.0
+
+    def backoff(self, attempt):
+        """Delay before retry number attempt + 1: uniform between 0 and a capped exponential ("full jitter")"""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, tokens=1):
+        """
+        Return fn(timeout) once the request fits the rate limits, retrying it
+        while it fails transiently. timeout is the number of seconds left
+        before the call's deadline, for fn to pass on as its own timeout.
+
+        tokens is the estimated cost reserved against the token budget for
+        every attempt.
+        """
+        deadline = self._clock() + self.deadline
+        self._count(calls=1)
+        attempt = 0
+        while True:
+            try:
+                waited = self.rate_limiter.acquire(tokens, timeout=deadline - self._clock())
+            except TimeoutError as e:
+                self._count(gave_up=1)
+                raise RetriesExhausted(f"Deadline of {self.deadline:g}s passed waiting for rate limit capacity") from e
+            with self._lock:
+                self.counters['attempts'] += 1
+                self.counters['tokens_reserved'] += tokens
+                self._queue_wait_seconds += waited
+            try:
+                result = fn(max(deadline - self._clock(), 0.001))
+            except Exception as e:
+                if not self.is_transient(e):
+                    self._count(failed=1)
+                    raise
+                if attempt >= self.max_retries:
+                    self._count(gave_up=1)
+                    raise RetriesExhausted(f"Gave up after {attempt + 1} attempts: {e}") from e
+                delay = self.backoff(attempt)
+                requested = self.retry_after(e) if self.retry_after is not None else None
+                if requested is not None:
+                    delay = max(delay, requested)
+                if self._clock() + delay >= deadline:
+                    self._count(gave_up=1)
+                    raise RetriesExhausted(f"Deadline of {self.deadline:g}s passed after {attempt + 1} attempts: {e}") from e
+                with self._lock:
+                    self.counters['retries'] += 1
+                    self._backoff_seconds += delay
+                self._sleep(delay)
+                attempt += 1
+                continue
+            self._count(succeeded=1)
+            return result
+
+    def record_tokens(self, tokens):
+        """Count tokens actually used by a completed call"""
+        self._count(tokens_used=tokens)
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def metrics(self):
+        """Call outcomes, retries, token use and time spent waiting"""
+        with self._lock:
+            metrics = dict(self.counters)
+            metrics['queue_wait_seconds'] = self._queue_wait_seconds
+            metrics['backoff_seconds'] = self._backoff_seconds
+        metrics['avg_queue_wait_seconds'] = (
+            metrics['queue_wait_seconds'] / metrics['attempts'] if metrics['attempts'] else 0.0
+        )
+        return metrics
@@ -0,0 +1,101 @@
+# app/utils/search.py
+
+import html
+import json
+import re
+
+# Columns of the revision_search index, in order
+SEARCH_COLUMNS = ('original_text', 'revised_document', 'detected_hazards', 'compliance_issues')
+# bm25() weight of each column: a hit in the extracted findings says more
+# about a revision than a hit somewhere in its full text
+SEARCH_WEIGHTS = (1.0, 0.5, 4.0, 2.0)
+
+SNIPPET_WORDS = 16
+
+WORD = re.compile(r'\w+')
+QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)')
+# Rough stand-in for the index's porter stemmer, only used to highlight matches
+STEM_SUFFIXES = ('ing', 'ed', 'es', 's', 'ly')
+
+def findings_text(analysis, key):
+    """The findings under key as one newline-separated string, for indexing"""
+    items = analysis.get(key) or []
+    if not isinstance(items, list):
+        items = [items]
+    return "\n".join(item if isinstance(item, str) else json.dumps(item) for item in items)
+
+def build_match(query):
+    """
+    Turn a plain search string into an FTS5 MATCH expression. Every word or
+    "quoted phrase" must appear; a word ending in * matches as a prefix.
+    Punctuation is never treated as query syntax, so searches like
+    lockout/tagout just work.
+    """
+    parts = []
+    for phrase, word in QUERY_TERM.findall(query):
+        text = phrase if phrase else word
+        prefix = not phrase and text.endswith('*')
+        if not WORD.search(text):
+            continue
+        quoted = '"' + text.rstrip('*').replace('"', '""') + '"'
+        parts.append(quoted + '*' if prefix else quoted)
+    return " ".join(parts)
+
+def search_terms(query):
+    """Lower-cased (word, is_prefix) pairs from a query, for highlighting"""
+    terms = []
+    for match in re.finditer(r'(\w+)(\*?)', query):
+        terms.append((match.group(1).casefold(), bool(match.group(2))))
+    return terms
+
+def _stem(word):
+    for suffix in STEM_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def _is_match(word, terms):
+    word = word.casefold()
+    return any(
+        word.startswith(term) if prefix else _stem(word) == _stem(term)
+        for term, prefix in terms
+    )
+
+def snippet(text, terms, words=SNIPPET_WORDS):
+    """
+    A short HTML-escaped excerpt of text around its first matching word,
+    with matches wrapped in <mark>. None if nothing in text matches.
+    """
+    tokens = list(WORD.finditer(text or ''))
+    first = next((index for index, token in enumerate(tokens) if _is_match(token.group(), terms)), None)
+    if first is None:
+        return None
+    start = max(0, first - words // 4)
+    end = min(len(tokens), start + words)
+    parts = ['…' if start else '']
+    position = tokens[start].start()
+    for token in tokens[start:end]:
+        if _is_match(token.group(), terms):
+            parts.append(html.escape(text[position:token.start()]))
+            parts.append('<mark>' + html.escape(token.group()) + '</mark>')
+            position = token.end()
+    parts.append(html.escape(text[position:tokens[end - 1].end()]))
+    if end < len(tokens):
+        parts.append('…')
+    return "".join(parts)
+
+def revision_snippets(revision, terms):
+    """Snippets for each indexed column of a revision that contains a match"""
+    analysis = revision.get('analysis') or {}
+    texts = {
+        'original_text': revision.get('original_text'),
+        'revised_document': revision.get('revised_document'),
+        'detected_hazards': findings_text(analysis, 'detected_hazards'),
+        'compliance_issues': findings_text(analysis, 'compliance_issues')
+    }
+    snippets = {}
+    for column in SEARCH_COLUMNS:
+        excerpt = snippet(texts[column], terms)
+        if excerpt is not None:
+            snippets[column] = excerpt
+    return snippets
@@ -0,0 +1,215 @@
+# app/utils/sections.py
+
+import hashlib
+import json
+import re
+from app.utils.cache import normalize_text
+
+# Numbered top-level headings such as "2. Hazard Identification:"
+SECTION_HEADING = re.compile(r'^\d+\.\s+\S.*$', re.MULTILINE)
+
+# Boundaries used to break up an oversized section, coarsest first:
+# blank lines between paragraphs, line ends, then sentence ends.
+CHUNK_BOUNDARIES = (
+    re.compile(r'\n[ \t]*\n'),
+    re.compile(r'\n'),
+    re.compile(r'[.!?]\s+'),
+)
+
+# In documents over the budget, a packed chunk also ends after any piece whose
+# fingerprint is divisible by this, i.e. on average every N pieces
+CHUNK_BOUNDARY_MODULUS = 8
+
+# Rough average for English prose with the OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+LIST_KEYS = ("detected_hazards", "compliance_issues", "accident_incidents")
+
+# Sentences, list items and lines. A full stop inside a token, as in
+# "OSHA 1910.132", doesn't end the sentence.
+SENTENCE = re.compile(r'(?:[^.!?\n]|[.!?](?=[^\s.!?]))+(?:[.!?]+|$)', re.MULTILINE)
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def fingerprint(text):
+    """Stable hash of a section's normalized text"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def split_sections(text):
+    """
+    Splits a document into its numbered sections.
+
+    Any preamble before the first heading (usually the document title) is kept
+    with the first section so it doesn't cost a request of its own. Joining the
+    'text' of every section gives back the original document exactly.
+    Documents without numbered headings come back as a single section.
+    """
+    starts = [match.start() for match in SECTION_HEADING.finditer(text)] or [0]
+    starts[0] = 0
+    starts.append(len(text))
+
+    sections = []
+    for index, (start, end) in enumerate(zip(starts, starts[1:])):
+        section_text = text[start:end]
+        heading = SECTION_HEADING.search(section_text)
+        sections.append({
+            'index': index,
+            'heading': heading.group(0).strip() if heading else None,
+            'text': section_text,
+            'fingerprint': fingerprint(section_text)
+        })
+    return sections
+
+def split_chunks(text, max_tokens):
+    """
+    Splits a document into chunks of at most max_tokens (estimated).
+
+    Sections larger than the budget are broken on paragraph, then line, then
+    sentence boundaries, and only cut mid-sentence as a last resort.
+    Neighbouring sections and pieces are then packed together up to the budget,
+    so a document of many short sections doesn't cost a request (and a copy of
+    the prompt) per section; a document that fits the budget is one chunk. In
+    longer documents chunk boundaries are content-defined (they depend on the
+    pieces themselves, not on their offset), so editing or inserting a section
+    only changes the fingerprints of the chunks around it.
+
+    Each chunk carries the heading of the section it starts in, and joining
+    the 'text' of every chunk gives back the original document exactly.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    content_defined = estimate_tokens(text) > max_tokens
+    chunks = []
+    current = []
+
+    def flush():
+        if current:
+            chunk_text = "".join(piece for piece, _ in current)
+            chunks.append({
+                'index': len(chunks),
+                'heading': current[0][1],
+                'text': chunk_text,
+                'fingerprint': fingerprint(chunk_text)
+            })
+            current.clear()
+
+    for section in split_sections(text):
+        for piece in _split_to_fit(section['text'], max_chars):
+            if current and sum(len(p) for p, _ in current) + len(piece) > max_chars:
+                flush()
+            current.append((piece, section['heading']))
+            if content_defined and int(fingerprint(piece)[:8], 16) % CHUNK_BOUNDARY_MODULUS == 0:
+                flush()
+    flush()
+    return chunks
+
+def _split_at(text, boundary):
+    """Split text after every match of boundary, keeping every character"""
+    ends = [match.end() for match in boundary.finditer(text)]
+    return [text[start:end] for start, end in zip([0] + ends, ends + [len(text)]) if end > start]
+
+def _split_to_fit(text, max_chars, level=0):
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(CHUNK_BOUNDARIES):
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    chunks = []
+    current = ''
+    for piece in _split_at(text, CHUNK_BOUNDARIES[level]):
+        if len(piece) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.extend(_split_to_fit(piece, max_chars, level + 1))
+        elif len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def sentence_spans(text):
+    """(start, end) of each sentence of text, surrounding whitespace excluded"""
+    spans = []
+    for match in SENTENCE.finditer(text):
+        sentence = match.group().strip()
+        if sentence:
+            start = match.start() + match.group().index(sentence[0])
+            spans.append((start, start + len(sentence)))
+    return spans
+
+def iter_findings(analysis):
+    """Yield (key, item) for every hazard, compliance issue and incident in an analysis"""
+    for key in LIST_KEYS:
+        items = analysis.get(key) or []
+        for item in items if isinstance(items, list) else [items]:
+            yield key, item
+
+def finding_key(item):
+    """A finding normalized for comparison: case, spacing and a trailing full stop are ignored"""
+    text = item if isinstance(item, str) else json.dumps(item, sort_keys=True)
+    return re.sub(r'\s+', ' ', text).strip().rstrip('.').casefold()
+
+def merge_analyses(analyses, original_text):
+    """
+    Combines per-section analyses into the single analysis format stored in
+    revisions.analysis.
+
+    Analyses are merged in document order and findings repeated across chunks
+    are dropped, so the result is deterministic for a given set of inputs.
+    Regulatory comments for the same standard are joined. The first failed
+    section's error dict is returned as-is so the error semantics match a
+    whole-document analysis.
+    """
+    merged = {
+        "detected_hazards": [],
+        "compliance_issues": [],
+        "regulatory_comments": {},
+        "accident_incidents": []
+    }
+    seen = {key: set() for key in LIST_KEYS}
+    for analysis in analyses:
+        if 'error' in analysis:
+            return analysis
+        for key, item in iter_findings(analysis):
+            dedupe_key = finding_key(item)
+            if dedupe_key not in seen[key]:
+                seen[key].add(dedupe_key)
+                merged[key].append(item)
+        comments = analysis.get("regulatory_comments")
+        if isinstance(comments, dict):
+            for standard, guideline in comments.items():
+                existing = merged["regulatory_comments"].get(standard)
+                if existing is None:
+                    merged["regulatory_comments"][standard] = guideline
+                elif finding_key(guideline) not in finding_key(existing):
+                    merged["regulatory_comments"][standard] = f"{existing}; {guideline}"
+    merged["original_text"] = original_text
+    return merged
+
+def _span(text, item):
+    start = text.find(item) if isinstance(item, str) and item else -1
+    return [start, start + len(item)] if start >= 0 else item
+
+def lean_revision(revision):
+    """
+    A revision as returned with ?view=lean. The document text appears once,
+    as the revision's original_text, rather than again inside the analysis,
+    and hazards, compliance issues and incidents quoted from it are given as
+    [start, end] offsets into it. Findings that aren't verbatim quotes stay
+    as text.
+    """
+    analysis = revision.get('analysis')
+    if not isinstance(analysis, dict):
+        return revision
+    text = revision.get('original_text', analysis.get('original_text'))
+    lean = {key: value for key, value in analysis.items() if key != 'original_text'}
+    if text is None:
+        return dict(revision, analysis=lean)
+    for key in LIST_KEYS:
+        if isinstance(lean.get(key), list):
+            lean[key] = [_span(text, item) for item in lean[key]]
+    return dict(revision, original_text=text, analysis=lean)
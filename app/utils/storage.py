@@ -3,76 +3,714 @@
 import sqlite3
 import json
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from app.config import Config
+from app.utils import metrics
+from app.utils.blobs import TextCache, compress_text, content_hash, decompress_text, load_text, store_text
+from app.utils.search import SEARCH_WEIGHTS, findings_text
+from app.utils.sections import LIST_KEYS, finding_key
+
+# Store database in the app directory
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'audit.db')
+# Columns of a revision as returned by the API, in response order
+REVISION_FIELDS = ('revision_number', 'timestamp', 'original_text', 'analysis', 'revised_document', 'diff')
+# Columns read from the revisions table for each field
+REVISION_COLUMNS = {
+    'revision_number': ('revision_number',),
+    'timestamp': ('timestamp',),
+    'original_text': ('original_text', 'original_blob_id'),
+    'analysis': ('analysis', 'analysis_omits_text', 'original_text', 'original_blob_id'),
+    'revised_document': ('revised_document', 'revised_blob_id'),
+    'diff': ('diff',)
+}
+
+# Table holding each list of findings in an analysis, one row per finding
+FINDINGS_TABLES = {
+    'detected_hazards': 'hazards',
+    'compliance_issues': 'compliance_issues',
+    'accident_incidents': 'incidents'
+}
+# Every findings table with the column holding its finding's text
+FINDINGS_TEXT_COLUMNS = {
+    'hazards': 'text',
+    'compliance_issues': 'text',
+    'incidents': 'text',
+    'regulatory_comments': 'standard'
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+def load_migrations():
+    """
+    List the migrations as (version, path) pairs in order.
+    schema.sql is version 1; later changes go in NNN_description.sql files.
+    """
+    migrations = [(1, os.path.join(MIGRATIONS_DIR, 'schema.sql'))]
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d+)_.+\.sql$', name)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, name)))
+    return sorted(migrations)
+
+def index_revision(conn, revision_id, original_text, revised_document, analysis):
+    """Add a revision's texts and findings to the revision_search index"""
+    conn.execute('''
+        INSERT INTO revision_search
+        (rowid, original_text, revised_document, detected_hazards, compliance_issues)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (
+        revision_id,
+        original_text,
+        revised_document,
+        findings_text(analysis, 'detected_hazards'),
+        findings_text(analysis, 'compliance_issues')
+    ))
+
+def store_findings(conn, revision_id, doc_id, analysis):
+    """Write a revision's findings to the hazards, compliance_issues, incidents and regulatory_comments tables"""
+    for key in LIST_KEYS:
+        items = analysis.get(key) or []
+        conn.executemany(f'''
+            INSERT INTO {FINDINGS_TABLES[key]} (revision_id, doc_id, position, text, finding_key)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (revision_id, doc_id, position, item if isinstance(item, str) else json.dumps(item), finding_key(item))
+            for position, item in enumerate(items if isinstance(items, list) else [items])
+        ])
+    comments = analysis.get('regulatory_comments')
+    if isinstance(comments, dict):
+        conn.executemany('''
+            INSERT INTO regulatory_comments (revision_id, doc_id, standard, guideline, finding_key)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (revision_id, doc_id, standard,
+             guideline if isinstance(guideline, str) or guideline is None else json.dumps(guideline),
+             finding_key(standard))
+            for standard, guideline in comments.items()
+        ])
+
+def backfill_findings(conn):
+    """Fill the findings tables from the analysis of every stored revision"""
+    cursor = conn.execute('SELECT id, doc_id, analysis FROM revisions ORDER BY id')
+    while True:
+        rows = cursor.fetchmany(Config.DB_FETCH_SIZE)
+        if not rows:
+            return
+        for revision_id, doc_id, analysis in rows:
+            store_findings(conn, revision_id, doc_id, json.loads(analysis or '{}'))
+
+def rebuild_findings(conn):
+    """Empty the findings tables and fill them again from revisions.analysis"""
+    for table in FINDINGS_TEXT_COLUMNS:
+        conn.execute(f'DELETE FROM {table}')
+    backfill_findings(conn)
+
+def rebuild_search_index(conn):
+    """Empty revision_search and index every stored revision again"""
+    conn.execute("INSERT INTO revision_search (revision_search) VALUES ('delete-all')")
+    backfill_search_index(conn)
+
+def backfill_search_index(conn):
+    """Index the revisions stored before revision_search existed"""
+    texts = TextCache(Config.REVISION_CACHE_ENTRIES)
+    cursor = conn.execute('''
+        SELECT id, original_text, original_blob_id, revised_document, revised_blob_id, analysis
+        FROM revisions
+        ORDER BY doc_id, revision_number
+    ''')
+    while True:
+        rows = cursor.fetchmany(Config.DB_FETCH_SIZE)
+        if not rows:
+            return
+        for revision_id, original_text, original_blob_id, revised_document, revised_blob_id, analysis in rows:
+            if original_blob_id is not None:
+                original_text = load_text(conn, original_blob_id, texts)
+            if revised_blob_id is not None:
+                revised_document = load_text(conn, revised_blob_id, texts)
+            index_revision(conn, revision_id, original_text, revised_document, json.loads(analysis or '{}'))
+
+def backfill_content_hashes(conn):
+    """Hash the blobs stored before blobs.content_hash existed"""
+    texts = TextCache(Config.REVISION_CACHE_ENTRIES)
+    # Read the ids up front rather than updating rows under an open cursor
+    blob_ids = [row[0] for row in conn.execute('SELECT id FROM blobs WHERE content_hash IS NULL ORDER BY id')]
+    for blob_id in blob_ids:
+        conn.execute('UPDATE blobs SET content_hash = ? WHERE id = ?',
+                     (content_hash(load_text(conn, blob_id, texts)), blob_id))
+
+# Data changes SQL alone can't make, run in the same transaction right
+# after the migration with the same version
+MIGRATION_BACKFILLS = {
+    4: backfill_search_index,
+    5: backfill_findings,
+    6: backfill_content_hashes
+}
+
+def split_statements(script):
+    """Split a SQL script into complete statements"""
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    # Anything left over is either trailing comments or an unterminated statement
+    rest = "\n".join(line for line in buffer.splitlines() if not line.strip().startswith('--')).strip()
+    if rest:
+        statements.append(rest)
+    return statements
+
+def revision_columns(fields=None):
+    """
+    The requested fields in response order (all of REVISION_FIELDS if None;
+    revision_number is always included) and the revisions columns to SELECT
+    for them, as (fields, columns)
+    """
+    fields = [
+        field for field in REVISION_FIELDS
+        if fields is None or field in fields or field == 'revision_number'
+    ]
+    columns = list(dict.fromkeys(column for field in fields for column in REVISION_COLUMNS[field]))
+    return fields, columns
+
+def revision_field(conn, row, field, texts=None):
+    """
+    The API value of one field of a revisions row selected with the columns
+    from revision_columns(). Blob texts are materialized through conn, so
+    this works on any connection to the database, including read-only ones.
+    """
+    if field == 'original_text' and row['original_blob_id'] is not None:
+        return load_text(conn, row['original_blob_id'], texts)
+    if field == 'revised_document' and row['revised_blob_id'] is not None:
+        return load_text(conn, row['revised_blob_id'], texts)
+    if field == 'diff':
+        return decompress_text(row['diff'])
+    if field == 'analysis':
+        # Parse JSON string back to dict
+        analysis = json.loads(row['analysis'])
+        if row['analysis_omits_text']:
+            analysis['original_text'] = revision_field(conn, row, 'original_text', texts)
+        return analysis
+    return row[field]
 
 class DatabaseConnection:
-    def __init__(self):
-        # Store database in the app directory
-        self.db_path = os.path.join(os.path.dirname(__file__), '..', 'audit.db')
-        self.init_db()
+    """
+    SQLite storage for documents, revisions and everything derived from them.
 
-    def init_db(self):
-        """Initialize the database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Read schema from file
-            schema_path = os.path.join(os.path.dirname(__file__), '..', 'migrations', 'schema.sql')
-            with open(schema_path, 'r') as schema_file:
-                schema = schema_file.read()
-            # Execute schema
-            conn.executescript(schema)
-
-    def store_revision(self, doc_id, revision_data):
-        """Ensure the database is initialized (this will create tables if they don’t exist)"""
-        
+    Each thread gets its own long-lived connection, opened on first use in WAL
+    mode so readers don't block the writer. Keeping connections open also lets
+    sqlite3 reuse prepared statements across calls. The connections of
+    threads that have finished, as with a server that starts a thread per
+    request, are closed when the next one is opened.
+
+    Revision texts live in the blobs table as periodic snapshots plus deltas
+    against the document's previous revision, and recently materialized texts
+    are kept in memory so reading the latest revision stays cheap.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # thread -> its connection
+        self._generation = 0
+        self.texts = TextCache(Config.REVISION_CACHE_ENTRIES)
         self.init_db()
-        with sqlite3.connect(self.db_path) as conn:
+
+    def _open(self, **kwargs):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DB_BUSY_TIMEOUT,
+            cached_statements=Config.DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+            **kwargs
+        )
+        conn.execute(f'PRAGMA journal_mode = {Config.DB_JOURNAL_MODE}')
+        conn.execute(f'PRAGMA synchronous = {Config.DB_SYNCHRONOUS}')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        This thread's connection, wrapped in a transaction that commits when
+        the block exits normally and rolls back if it raises.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._open()
             conn.row_factory = sqlite3.Row
-            # First, ensure the document exists
-            conn.execute('INSERT OR IGNORE INTO documents (doc_id) VALUES (?)', (doc_id,))
-            # Then store the revision
-            conn.execute('''
-                INSERT INTO revisions
-                (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            with self._lock:
+                for thread in [thread for thread in self._connections if not thread.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = conn
+            self._local.conn = conn
+            self._local.generation = self._generation
+        with conn:
+            yield conn
+
+    def close(self):
+        """Close every connection opened by this instance; threads reconnect on next use"""
+        with self._lock:
+            connections, self._connections = list(self._connections.values()), {}
+            self._generation += 1
+        self.texts.clear()
+        for conn in connections:
+            conn.close()
+
+    def init_db(self):
+        """Bring the schema up to date by applying any pending migrations"""
+        conn = self._open(isolation_level=None)
+        try:
+            latest = load_migrations()[-1][0]
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= latest:
+                return
+            # Take the write lock before re-reading the version so that two
+            # processes starting at once don't both apply the same migration
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                for number, path in load_migrations():
+                    if number <= version:
+                        continue
+                    with open(path, 'r') as migration_file:
+                        for statement in split_statements(migration_file.read()):
+                            conn.execute(statement)
+                    if number in MIGRATION_BACKFILLS:
+                        MIGRATION_BACKFILLS[number](conn)
+                    conn.execute(f'PRAGMA user_version = {number}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def store_revision(self, doc_id, revision_data, sections=None):
+        """Store one revision along with its per-section results"""
+        self.store_revisions([(doc_id, revision_data, sections)])
+
+    @metrics.db_timed('store_revisions')
+    def store_revisions(self, items):
+        """
+        Store many (doc_id, revision_data, sections) tuples in a single transaction,
+        so a batch is either stored completely or not at all.
+        """
+        try:
+            with self.connection() as conn:
+                for doc_id, revision_data, sections in items:
+                    self._insert_revision(conn, doc_id, revision_data, sections)
+        except Exception:
+            # Blob ids of a rolled-back transaction get reused, so texts
+            # cached under them must not outlive it
+            self.texts.clear()
+            raise
+
+    def _insert_revision(self, conn, doc_id, revision_data, sections):
+        # First, ensure the document exists
+        conn.execute('INSERT OR IGNORE INTO documents (doc_id) VALUES (?)', (doc_id,))
+        # Texts are stored as deltas against the previous revision's, if it has blobs
+        previous = conn.execute('''
+            SELECT original_blob_id, revised_blob_id
+            FROM revisions
+            WHERE doc_id = ? AND revision_number < ?
+            ORDER BY revision_number DESC
+            LIMIT 1
+        ''', (doc_id, revision_data['revision_number'])).fetchone()
+        original_blob_id = store_text(
+            conn, revision_data['original_text'], previous[0] if previous else None,
+            Config.REVISION_SNAPSHOT_INTERVAL, self.texts
+        )
+        revised_blob_id = store_text(
+            conn, revision_data['revised_document'], previous[1] if previous else None,
+            Config.REVISION_SNAPSHOT_INTERVAL, self.texts
+        )
+        # A successful analysis repeats the whole original text; don't store it twice
+        analysis = revision_data['analysis']
+        omits_text = analysis.get('original_text') == revision_data['original_text']
+        if omits_text:
+            analysis = {key: value for key, value in analysis.items() if key != 'original_text'}
+        # Then store the revision
+        revision_id = conn.execute('''
+            INSERT INTO revisions
+            (doc_id, revision_number, timestamp, analysis, diff,
+             original_blob_id, revised_blob_id, analysis_omits_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            doc_id,
+            revision_data['revision_number'],
+            revision_data['timestamp'],
+            json.dumps(analysis),
+            compress_text(revision_data['diff']),
+            original_blob_id,
+            revised_blob_id,
+            int(omits_text)
+        )).lastrowid
+        # Index it for /search in the same transaction, so the index never
+        # lags behind the stored revisions
+        index_revision(conn, revision_id, revision_data['original_text'],
+                       revision_data['revised_document'], revision_data['analysis'])
+        store_findings(conn, revision_id, doc_id, revision_data['analysis'])
+        # Keep the per-section results so the next re-audit can reuse them
+        conn.executemany('''
+            INSERT OR REPLACE INTO revision_sections
+            (doc_id, revision_number, section_index, heading, fingerprint, analysis, revised_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
                 doc_id,
                 revision_data['revision_number'],
-                revision_data['timestamp'],
-                revision_data['original_text'],
-                json.dumps(revision_data['analysis']),
-                revision_data['revised_document'],
-                revision_data['diff']
-            ))
+                section['index'],
+                section['heading'],
+                section['fingerprint'],
+                json.dumps(section['analysis']),
+                compress_text(section['revised_text'])
+            )
+            for section in sections or []
+        ])
 
+    @metrics.db_timed('get_revision_history')
     def get_revision_history(self, doc_id):
         """Retrieve the revision history for a document"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            # Check if document exists
-            doc = conn.execute('SELECT doc_id FROM documents WHERE doc_id = ?', (doc_id,)).fetchone()
-            if not doc:
-                return None
-            # Get all revisions
+        if not self.document_exists(doc_id):
+            return None
+        return list(self.iter_revisions(doc_id))
+
+    def iter_revisions(self, doc_id, fields=None, after=None, limit=None):
+        """
+        Yield a document's revisions in order, fetching rows in small batches
+        instead of materializing the whole history.
+
+        fields limits the columns read (revision_number is always included),
+        after skips revisions up to and including that revision number, and
+        limit caps the number of revisions yielded.
+        """
+        fields, columns = revision_columns(fields)
+        query = f'''
+            SELECT {", ".join(columns)}
+            FROM revisions
+            WHERE doc_id = ? AND revision_number > ?
+            ORDER BY revision_number
+        '''
+        params = [doc_id, after if after is not None else -1]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self.connection() as conn:
+            with metrics.timed(metrics.DB_SECONDS, 'iter_revisions', 'db.iter_revisions'):
+                cursor = conn.execute(query, params)
+            while True:
+                with metrics.timed(metrics.DB_SECONDS, 'iter_revisions', 'db.iter_revisions'):
+                    rows = cursor.fetchmany(Config.DB_FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield {field: revision_field(conn, row, field, self.texts) for field in fields}
+
+    def get_revision(self, doc_id, revision_number, fields=None):
+        """Get a single revision, or None if it doesn't exist"""
+        revision = next(self.iter_revisions(doc_id, fields, after=revision_number - 1, limit=1), None)
+        if revision is None or revision['revision_number'] != revision_number:
+            return None
+        return revision
+
+    def get_latest_revision(self, doc_id, fields=None):
+        """
+        Get a document's latest revision, or None if the document has none.
+        Both lookups go through the (doc_id, revision_number) index, so the
+        cost doesn't grow with the length of the history.
+        """
+        latest = self.get_latest_revision_number(doc_id)
+        if not latest:
+            return None
+        return self.get_revision(doc_id, latest, fields)
+
+    @metrics.db_timed('search_revisions')
+    def search_revisions(self, match, limit, offset=0, latest_only=False, with_texts=0):
+        """
+        Revisions matching an FTS5 MATCH expression as dicts of doc_id,
+        revision_number, score and analysis, best match first. The first
+        with_texts of them also carry original_text and revised_document,
+        read in the same query; rebuilding texts from their delta chains is
+        the expensive part, so callers bound it. With latest_only, only each
+        document's latest revision is considered. An invalid expression
+        raises sqlite3.OperationalError.
+        """
+        weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+        # Qualified: revision_search has columns of the same names
+        _, columns = revision_columns(('original_text', 'revised_document'))
+        query = f'''
+            SELECT r.doc_id, r.revision_number, -bm25(revision_search, {weights}) AS score, r.analysis,
+                   {", ".join('r.' + column for column in columns)}
+            FROM revision_search
+            JOIN revisions r ON r.id = revision_search.rowid
+            WHERE revision_search MATCH ?
+        '''
+        if latest_only:
+            query += '''
+              AND r.revision_number = (
+                  SELECT MAX(revision_number) FROM revisions WHERE doc_id = r.doc_id
+              )
+            '''
+        query += ' ORDER BY score DESC LIMIT ? OFFSET ?'
+        results = []
+        with self.connection() as conn:
+            for index, row in enumerate(conn.execute(query, (match, limit, offset)).fetchall()):
+                result = {
+                    'doc_id': row['doc_id'],
+                    'revision_number': row['revision_number'],
+                    'score': row['score'],
+                    'analysis': json.loads(row['analysis'])
+                }
+                if index < with_texts:
+                    for field in ('original_text', 'revised_document'):
+                        result[field] = revision_field(conn, row, field, self.texts)
+                results.append(result)
+        return results
+
+    @metrics.db_timed('get_revision_sections')
+    def get_revision_sections(self, doc_id, revision_number):
+        """
+        Get the stored per-section results of a revision, keyed by section fingerprint.
+        Revisions stored before sections were tracked return an empty dict.
+        """
+        with self.connection() as conn:
             cursor = conn.execute('''
-                SELECT revision_number, timestamp, original_text, analysis, revised_document, diff
-                FROM revisions
-                WHERE doc_id = ?
-                ORDER BY revision_number
-            ''', (doc_id,))
-            revisions = []
-            for row in cursor:
-                revision = dict(row)
-                # Parse JSON string back to dict
-                revision['analysis'] = json.loads(revision['analysis'])
-                revisions.append(revision)
-            return revisions
+                SELECT fingerprint, analysis, revised_text
+                FROM revision_sections
+                WHERE doc_id = ? AND revision_number = ?
+            ''', (doc_id, revision_number))
+            return {
+                fingerprint: {'analysis': json.loads(analysis), 'revised_text': decompress_text(revised_text)}
+                for fingerprint, analysis, revised_text in cursor
+            }
 
+    @metrics.db_timed('get_latest_revision_number')
     def get_latest_revision_number(self, doc_id):
         """Get the latest revision number for a document"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.execute('''
                 SELECT MAX(revision_number) as last_rev
                 FROM revisions
                 WHERE doc_id = ?
             ''', (doc_id,))
             result = cursor.fetchone()
-            return result[0] if result[0] is not None else 0
\ No newline at end of file
+            return result[0] if result[0] is not None else 0
+
+    @metrics.db_timed('top_findings')
+    def top_findings(self, table, limit, doc_id=None):
+        """
+        The most frequent findings in one of FINDINGS_TEXT_COLUMNS' tables as
+        dicts of text, revisions (how many revisions list it) and documents,
+        most frequent first. Findings differing only in case, spacing or a
+        trailing full stop count as one, shown as first worded in the first
+        document. doc_id restricts it to one document.
+        """
+        column = FINDINGS_TEXT_COLUMNS[table]
+        where, params = ('WHERE doc_id = ?', (doc_id,)) if doc_id is not None else ('', ())
+        # Count over the (finding_key, doc_id) index alone and only read the
+        # wording of the findings that make the cut
+        query = f'''
+            WITH top AS (
+                SELECT finding_key, COUNT(*) AS revisions, COUNT(DISTINCT doc_id) AS documents
+                FROM {table}
+                {where}
+                GROUP BY finding_key
+                ORDER BY revisions DESC, finding_key
+                LIMIT ?
+            )
+            SELECT (
+                SELECT {column} FROM {table} t
+                WHERE t.finding_key = top.finding_key {where.replace('WHERE', 'AND')}
+                ORDER BY t.doc_id, t.rowid
+                LIMIT 1
+            ) AS text, revisions, documents
+            FROM top
+            ORDER BY revisions DESC, finding_key
+        '''
+        with self.connection() as conn:
+            return [dict(row) for row in conn.execute(query, params + (limit,) + params)]
+
+    @metrics.db_timed('findings_timeline')
+    def findings_timeline(self, doc_id):
+        """Number of findings of each kind in every revision of a document, oldest first"""
+        counts = ", ".join(
+            f'(SELECT COUNT(*) FROM {table} WHERE revision_id = r.id) AS {table}'
+            for table in FINDINGS_TEXT_COLUMNS
+        )
+        with self.connection() as conn:
+            return [dict(row) for row in conn.execute(f'''
+                SELECT r.revision_number, r.timestamp, {counts}
+                FROM revisions r
+                WHERE r.doc_id = ?
+                ORDER BY r.revision_number
+            ''', (doc_id,))]
+
+    @metrics.db_timed('storage_stats')
+    def storage_stats(self):
+        """
+        How much revision text is stored versus referenced: text_references
+        counts the original and revised texts of every blob-backed revision,
+        distinct_texts the blobs they point at, and logical_bytes their
+        combined uncompressed size. stored_bytes is the size of all blob data.
+        """
+        with self.connection() as conn:
+            references, distinct, logical = conn.execute('''
+                SELECT COUNT(*), COUNT(DISTINCT blob_id), COALESCE(SUM(b.raw_size), 0)
+                FROM (
+                    SELECT original_blob_id AS blob_id FROM revisions WHERE original_blob_id IS NOT NULL
+                    UNION ALL
+                    SELECT revised_blob_id FROM revisions WHERE revised_blob_id IS NOT NULL
+                )
+                JOIN blobs b ON b.id = blob_id
+            ''').fetchone()
+            blobs, stored = conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()
+        return {
+            'text_references': references,
+            'distinct_texts': distinct,
+            'dedup_ratio': references / distinct if distinct else 1.0,
+            'blobs': blobs,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'compression_ratio': logical / stored if stored else 1.0
+        }
+
+    @metrics.db_timed('get_cached_result')
+    def get_cached_result(self, cache_key, min_created_at, access_resolution=0):
+        """
+        Look up a cached OpenAI result, ignoring entries older than
+        min_created_at. The entry's last access time is only written when the
+        stored one is more than access_resolution seconds old, so a run of
+        hits on the same entry doesn't make every lookup a write.
+        """
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT created_at, value, last_access FROM llm_cache WHERE cache_key = ? AND created_at >= ?',
+                (cache_key, min_created_at)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[2] is None or now - row[2] > access_resolution:
+                conn.execute('UPDATE llm_cache SET last_access = ? WHERE cache_key = ?', (now, cache_key))
+            return row[0], row[1]
+
+    @metrics.db_timed('store_cached_result')
+    def store_cached_result(self, cache_key, value, created_at, min_created_at, max_bytes):
+        """
+        Store a cached OpenAI result, then evict expired entries and the least
+        recently used ones until the cache fits in max_bytes.
+        Returns the number of evicted entries.
+        """
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_cache (cache_key, value, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (cache_key, value, len(value), created_at, created_at))
+            evicted = conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (min_created_at,)).rowcount
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+            if total > max_bytes:
+                stale = []
+                for key, size in conn.execute('SELECT cache_key, size FROM llm_cache ORDER BY last_access'):
+                    if total <= max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                conn.executemany('DELETE FROM llm_cache WHERE cache_key = ?', stale)
+                evicted += len(stale)
+            return evicted
+
+    def create_job(self, job_id, kind, payload, created_at, max_depth):
+        """
+        Queue a job unless max_depth jobs are already waiting.
+        Returns False when the queue is full.
+        """
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO jobs (job_id, kind, status, payload, created_at)
+                SELECT ?, ?, 'queued', ?, ?
+                WHERE (SELECT COUNT(*) FROM jobs WHERE status = 'queued') < ?
+            ''', (job_id, kind, payload, created_at, max_depth))
+            return cursor.rowcount == 1
+
+    def claim_next_job(self, started_at, owner=None, lease_expires_at=None):
+        """
+        Atomically move the oldest queued job to running, leased to owner
+        until lease_expires_at, and return it, or None
+        """
+        with self.connection() as conn:
+            row = conn.execute('''
+                UPDATE jobs SET status = 'running', started_at = ?, owner = ?, lease_expires_at = ?
+                WHERE job_id = (
+                    SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1
+                ) AND status = 'queued'
+                RETURNING job_id, kind, payload, created_at, started_at
+            ''', (started_at, owner, lease_expires_at)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'])
+            return job
+
+    def finish_job(self, job_id, status, result, status_code, finished_at):
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = ?, result = ?, status_code = ?, finished_at = ?
+                WHERE job_id = ?
+            ''', (status, result, status_code, finished_at, job_id))
+
+    def renew_job_leases(self, owner, lease_expires_at):
+        """Extend the leases of owner's running jobs. Returns how many there are."""
+        with self.connection() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE status = 'running' AND owner = ?",
+                (lease_expires_at, owner)
+            ).rowcount
+
+    def requeue_expired_jobs(self, now):
+        """
+        Put running jobs whose lease expired before now, left behind by a
+        process that died, back in the queue; jobs claimed without a lease
+        count as expired. Returns how many were requeued.
+        """
+        with self.connection() as conn:
+            return conn.execute('''
+                UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, lease_expires_at = NULL
+                WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            ''', (now,)).rowcount
+
+    def delete_finished_jobs(self, before):
+        """Delete completed and failed jobs that finished before then. Returns how many there were."""
+        with self.connection() as conn:
+            return conn.execute('''
+                DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?
+            ''', (before,)).rowcount
+
+    def get_job(self, job_id):
+        """Get a job's status and, once finished, its result"""
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT job_id, kind, status, result, status_code, created_at, started_at, finished_at
+                FROM jobs WHERE job_id = ?
+            ''', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            job['result'] = json.loads(job['result']) if job['result'] is not None else None
+            return job
+
+    def count_jobs_by_status(self):
+        with self.connection() as conn:
+            return dict(conn.execute('''
+                SELECT status, COUNT(*) FROM jobs
+                WHERE status IN ('queued', 'running')
+                GROUP BY status
+            ''').fetchall())
+
+    @metrics.db_timed('document_exists')
+    def document_exists(self, doc_id):
+        with self.connection() as conn:
+            return conn.execute('SELECT 1 FROM documents WHERE doc_id = ?', (doc_id,)).fetchone() is not None
@@ -0,0 +1,72 @@
+# app/utils/streaming.py
+
+import json
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class ListItemParser:
+    """
+    Incremental scanner for a streamed JSON object such as the analysis
+    response. feed() takes the text as it arrives and calls on_item(key, item)
+    as soon as each element of a top-level list is complete, long before the
+    whole object can be parsed.
+    """
+
+    def __init__(self, on_item):
+        self.on_item = on_item
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string = []      # characters of the current top-level string (a key or a value)
+        self._list_key = None  # key of the top-level list being read, if any
+        self._item = []        # characters of the current list element
+
+    def feed(self, text):
+        for char in text:
+            # Everything inside a list except its own separators belongs to an element
+            if self._list_key is not None and not (
+                self._depth == 2 and not self._in_string and char in ',]'
+            ):
+                self._item.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                elif self._depth == 1:
+                    self._string.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._string = []
+            elif char in '{[':
+                if char == '[' and self._depth == 1:
+                    # The last top-level string before a list is its key
+                    self._list_key = "".join(self._string)
+                    self._item = []
+                self._depth += 1
+            elif char in '}]':
+                if char == ']' and self._depth == 2 and self._list_key is not None:
+                    self._emit()
+                    self._list_key = None
+                self._depth -= 1
+            elif char == ',' and self._depth == 2 and self._list_key is not None:
+                self._emit()
+
+    def _emit(self):
+        text = "".join(self._item).strip()
+        self._item = []
+        if not text:
+            return
+        try:
+            item = json.loads(text)
+        except ValueError:
+            return
+        self.on_item(self._list_key, item)
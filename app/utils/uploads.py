@@ -0,0 +1,111 @@
+# app/utils/uploads.py
+
+import codecs
+import io
+import mmap
+import tempfile
+from app.config import setting
+
+class UploadError(Exception):
+    """An uploaded document that can't be analyzed; status_code is the HTTP status to answer with"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+UNREADABLE = 'Could not read file content'
+
+def check_size(size, max_bytes=None):
+    """Raise UploadError if size bytes is over max_bytes (default MAX_DOCUMENT_BYTES, 0 for no limit)"""
+    max_bytes = max_bytes if max_bytes is not None else setting('MAX_DOCUMENT_BYTES')
+    if max_bytes and size > max_bytes:
+        raise UploadError(f'Document too large (limit {max_bytes} bytes)', 413)
+
+def validate_stream(stream, max_bytes=None, chunk_size=None):
+    """
+    Read stream to the end in chunks, checking that it is non-empty UTF-8
+    without NUL characters and at most max_bytes long (default the app's
+    MAX_DOCUMENT_BYTES, 0 for no limit). Only one chunk is in memory at a
+    time, and an oversized upload is rejected as soon as the limit is
+    crossed. Returns the number of bytes read; raises UploadError.
+    """
+    max_bytes = max_bytes if max_bytes is not None else setting('MAX_DOCUMENT_BYTES')
+    chunk_size = chunk_size or setting('UPLOAD_CHUNK_SIZE')
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        check_size(size, max_bytes)
+        # A NUL byte in UTF-8 can only be a NUL character
+        if b'\x00' in chunk:
+            raise UploadError(UNREADABLE)
+        try:
+            decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise UploadError(UNREADABLE) from None
+    try:
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise UploadError(UNREADABLE) from None
+    if not size:
+        raise UploadError(UNREADABLE)
+    return size
+
+def _underlying(stream):
+    # Werkzeug spools uploads in a SpooledTemporaryFile, which holds either
+    # a BytesIO or, past its size threshold, a real temporary file. Asking
+    # the wrapper for fileno() would force small uploads to disk.
+    return getattr(stream, '_file', stream)
+
+def read_text(stream, max_bytes=None, chunk_size=None):
+    """
+    The text of an uploaded document, validated as in validate_stream().
+
+    The bytes are never copied into one Python object: after validation the
+    text is decoded straight out of the in-memory buffer or an mmap of the
+    spooled file, so peak memory is the decoded text plus one chunk, instead
+    of the whole upload as bytes and again as text. Streams that are
+    neither are first spooled to a temporary file.
+    """
+    raw = _underlying(stream)
+    if not isinstance(raw, io.BytesIO):
+        try:
+            raw.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            # Not a file (e.g. a network stream): spool it while validating
+            spooled = tempfile.TemporaryFile()
+            try:
+                _copy_limited(stream, spooled, max_bytes, chunk_size)
+                spooled.seek(0)
+                return read_text(spooled, max_bytes, chunk_size)
+            finally:
+                spooled.close()
+
+    start = stream.tell()
+    size = validate_stream(stream, max_bytes, chunk_size)
+    if isinstance(raw, io.BytesIO):
+        with raw.getbuffer() as buffer:
+            return str(buffer[start:start + size], 'utf-8')
+    raw.flush()
+    with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            return str(view[start:start + size], 'utf-8')
+
+def _copy_limited(source, target, max_bytes=None, chunk_size=None):
+    max_bytes = max_bytes if max_bytes is not None else setting('MAX_DOCUMENT_BYTES')
+    chunk_size = chunk_size or setting('UPLOAD_CHUNK_SIZE')
+    copied = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        copied += len(chunk)
+        check_size(copied, max_bytes)
+        target.write(chunk)
+
+def read_upload(file):
+    """The text of a werkzeug FileStorage upload; raises UploadError"""
+    return read_text(file.stream)
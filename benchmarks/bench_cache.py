@@ -0,0 +1,64 @@
+# benchmarks/bench_cache.py
+
+"""
+Latency of run_analysis for cold, memory-cached and disk-cached submissions.
+
+    python -m benchmarks.bench_cache --documents 20 --latency 0.5
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app.utils import analyzer
+from app.utils.cache import AnalysisCache
+from app.utils.storage import DatabaseConnection
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def timed(fn, texts):
+    samples = []
+    for text in texts:
+        start = time.perf_counter()
+        fn(text)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<14} median={statistics.median(samples) * 1000:9.2f} ms  "
+          f"max={max(samples) * 1000:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.5, help="fake server latency in seconds")
+    args = parser.parse_args()
+
+    with open(DOC_PATH) as f:
+        base = f.read()
+    # Distinct documents so the cold pass really misses
+    texts = [f"{base}\n\nRevision note {i}." for i in range(args.documents)]
+
+    with tempfile.TemporaryDirectory() as tmp, FakeOpenAIServer(latency=args.latency) as server:
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+        analyzer.cache = AnalysisCache(db=DatabaseConnection(os.path.join(tmp, 'bench.db')))
+
+        report('cold', timed(analyzer.run_analysis, texts))
+        report('memory hit', timed(analyzer.run_analysis, texts))
+        analyzer.cache.clear()
+        report('disk hit', timed(analyzer.run_analysis, texts))
+        print(f"OpenAI requests: {len(server.requests)}  cache: {analyzer.cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
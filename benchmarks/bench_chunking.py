@@ -0,0 +1,84 @@
+# benchmarks/bench_chunking.py
+
+"""
+Wall-clock time to analyze a long manual with chunked map-reduce analysis.
+
+Builds a synthetic manual of --pages pages (~3000 characters each) out of the
+sections in mock_doc.txt, then compares the time for the whole manual with the
+time for a single chunk.
+
+    python -m benchmarks.bench_chunking --pages 200 --workers 256
+"""
+
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app.config import Config
+from app.utils import analyzer
+from app.utils.sections import split_chunks, split_sections
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+CHARS_PER_PAGE = 3000
+
+
+def build_manual(pages):
+    with open(DOC_PATH) as f:
+        sections = [s['text'] for s in split_sections(f.read())]
+    parts = []
+    size = 0
+    number = 0
+    while size < pages * CHARS_PER_PAGE:
+        number += 1
+        body = re.sub(r'^\d+\.', f'{number}.', sections[number % len(sections)], count=1)
+        parts.append(body + f"Site-specific note for section {number}.\n\n")
+        size += len(parts[-1])
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=256, help="size of the analyzer pool")
+    parser.add_argument('--in-flight', type=int, default=256, help="ANALYSIS_MAX_CALLS_IN_FLIGHT")
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--latency-per-kchar', type=float, default=0.05)
+    args = parser.parse_args()
+
+    manual = build_manual(args.pages)
+    chunks = split_chunks(manual, Config.ANALYSIS_CHUNK_TOKENS)
+    print(f"manual: {len(manual)} chars, {len(chunks)} chunks of <= {Config.ANALYSIS_CHUNK_TOKENS} tokens")
+
+    Config.ANALYSIS_MAX_CALLS_IN_FLIGHT = args.in_flight
+    analyzer.executor = ThreadPoolExecutor(max_workers=args.workers)
+    analyzer.cache.enabled = False
+
+    with FakeOpenAIServer(latency=args.latency, latency_per_kchar=args.latency_per_kchar) as server:
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+
+        largest = max(chunks, key=lambda c: len(c['text']))['text']
+        start = time.perf_counter()
+        analyzer.run_analysis(largest)
+        single = time.perf_counter() - start
+
+        server.requests.clear()
+        start = time.perf_counter()
+        analysis, revised, _ = analyzer.run_analysis(manual)
+        whole = time.perf_counter() - start
+
+    status = 'error' if 'error' in analysis else 'ok'
+    print(f"largest single chunk: {single * 1000:8.1f} ms")
+    print(f"whole manual:         {whole * 1000:8.1f} ms  ({len(server.requests)} requests, "
+          f"{whole / single:.1f}x one chunk, analysis {status}, "
+          f"{len(analysis.get('detected_hazards', []))} unique hazards)")
+
+
+if __name__ == '__main__':
+    main()
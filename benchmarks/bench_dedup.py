@@ -0,0 +1,105 @@
+# benchmarks/bench_dedup.py
+
+"""
+Storage and OpenAI calls saved by sharing identical uploads, on a replayed
+upload log.
+
+The log re-uploads a handful of template procedures over and over (picked
+with a Zipf-like skew), with --edited of the uploads carrying a one-line
+site-specific change. Every upload goes through POST /analyze as a new
+document, as it does in production. "Without sharing" is what the same log
+costs when every text is stored on its own and every upload is sent to
+OpenAI.
+
+    python -m benchmarks.bench_dedup --uploads 500 --templates 8
+"""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app import create_app
+from app.utils import analyzer
+from benchmarks.bench_chunking import build_manual
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def upload_log(uploads, templates, edited, seed=0):
+    rng = random.Random(seed)
+    bodies = [build_manual(1 + index % 3).replace("Site-specific note", f"Template {index} note")
+              for index in range(templates)]
+    weights = [1 / (rank + 1) for rank in range(templates)]
+    log = []
+    for number in range(uploads):
+        text = rng.choices(bodies, weights)[0]
+        if rng.random() < edited:
+            text += f"Local amendment {number}: contact the site supervisor.\n"
+        log.append(text)
+    return log
+
+
+def replay(log, server, db_path, share):
+    app = create_app({'DATABASE_PATH': db_path, 'CACHE_ENABLED': share})
+    db = app.extensions['audit']['db']
+    server.requests.clear()
+    client = app.test_client()
+    start = time.perf_counter()
+    for text in log:
+        response = client.post('/analyze', data={'document': (io.BytesIO(text.encode('utf-8')), 'doc.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data()
+    elapsed = time.perf_counter() - start
+    stats = db.storage_stats()
+    with db.connection() as conn:
+        # Every upload is a new document, so each stored text would be a
+        # standalone snapshot of this size without sharing
+        unshared_bytes = conn.execute('''
+            SELECT COALESCE(SUM(LENGTH(b.data)), 0)
+            FROM (
+                SELECT original_blob_id AS blob_id FROM revisions
+                UNION ALL
+                SELECT revised_blob_id FROM revisions
+            )
+            JOIN blobs b ON b.id = blob_id
+        ''').fetchone()[0]
+    db.close()
+    return {'seconds': elapsed, 'openai_calls': len(server.requests),
+            'unshared_bytes': unshared_bytes, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--uploads', type=int, default=500)
+    parser.add_argument('--templates', type=int, default=8)
+    parser.add_argument('--edited', type=float, default=0.1, help="fraction of uploads with a local change")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake server latency in seconds")
+    args = parser.parse_args()
+
+    log = upload_log(args.uploads, args.templates, args.edited)
+    print(f"{len(log)} uploads, {len(set(log))} distinct documents, "
+          f"{sum(len(text) for text in log) / 1e6:.1f} MB uploaded")
+
+    with tempfile.TemporaryDirectory() as tmp, FakeOpenAIServer(latency=args.latency) as server:
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+        unshared = replay(log, server, os.path.join(tmp, 'unshared.db'), share=False)
+        shared = replay(log, server, os.path.join(tmp, 'shared.db'), share=True)
+
+    print(f"dedup ratio: {shared['dedup_ratio']:.1f} "
+          f"({shared['text_references']} stored texts, {shared['distinct_texts']} distinct)")
+    print(f"text storage: {shared['unshared_bytes'] / 1024:9.1f} KiB without sharing, "
+          f"{shared['stored_bytes'] / 1024:9.1f} KiB shared "
+          f"({1 - shared['stored_bytes'] / shared['unshared_bytes']:.0%} saved)")
+    print(f"OpenAI calls: {unshared['openai_calls']:9d} without sharing, {shared['openai_calls']:9d} shared "
+          f"({1 - shared['openai_calls'] / unshared['openai_calls']:.0%} saved)")
+    print(f"replay time:  {unshared['seconds']:9.1f} s without sharing, {shared['seconds']:9.1f} s shared")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_diff.py
+
+"""
+Time and peak memory of the diff engines across document sizes.
+
+"difflib (old)" is the previous compute_diff: difflib.unified_diff joined
+into one string. The other rows use app.utils.diffing, either joined the same
+way or iterated line by line as a stream.
+
+    python -m benchmarks.bench_diff --lines 1000 5000 20000
+"""
+
+import argparse
+import difflib
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.utils.diffing import unified_diff
+from benchmarks.bench_chunking import build_manual
+
+
+def documents(lines, changed, seed=0):
+    rng = random.Random(seed)
+    old = []
+    pages = 1
+    while len(old) < lines:
+        old = build_manual(pages).splitlines()
+        pages *= 2
+    old = old[:lines]
+    new = list(old)
+    for _ in range(int(lines * changed)):
+        position = rng.randrange(len(new))
+        action = rng.random()
+        if action < 0.4:
+            new[position] = f"Amended line {rng.random():.6f}"
+        elif action < 0.7:
+            new.insert(position, f"Inserted line {rng.random():.6f}")
+        else:
+            del new[position]
+    return old, new
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--changed', type=float, nargs='+', default=[0.01, 0.2],
+                        help="fraction of lines edited")
+    args = parser.parse_args()
+
+    cases = {
+        'difflib (old)': lambda old, new: "\n".join(list(difflib.unified_diff(old, new, lineterm=''))),
+        'patience': lambda old, new: "\n".join(unified_diff(old, new, engine='patience')),
+        'myers': lambda old, new: "\n".join(unified_diff(old, new, engine='myers')),
+        'patience stream': lambda old, new: sum(1 for _ in unified_diff(old, new, engine='patience')),
+    }
+    for lines in args.lines:
+        for changed in args.changed:
+            old, new = documents(lines, changed)
+            print(f"{lines} lines, {changed:.0%} edited")
+            for label, fn in cases.items():
+                elapsed, peak = measure(lambda: fn(old, new))
+                print(f"  {label:<16} {elapsed * 1000:9.1f} ms  peak_mem={peak / 1024:9.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_export.py
+
+"""
+Export throughput and peak memory of app.db.db_query against a large database.
+
+Builds a database of --revisions revisions (reused if --db already exists,
+so a multi-GB copy of production can be pointed at directly), then
+exports every revision with its texts materialized. "fetchall (old)" is
+what print_all_entries did before rendering anything: SELECT * on each
+table with fetchall(), which holds every row in memory at once.
+
+    python -m benchmarks.bench_export --revisions 20000
+    python -m benchmarks.bench_export --db /backups/audit-copy.db --immutable
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.db.db_query import export, open_readonly, revisions_query
+from app.utils.storage import DatabaseConnection
+from benchmarks.bench_search import build_corpus
+
+
+def old_fetchall(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = 0
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+        try:
+            rows += len(conn.execute(f'SELECT * FROM "{table}"').fetchall())
+        except sqlite3.OperationalError:
+            pass
+    conn.close()
+    return rows
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--revisions', type=int, default=20000)
+    parser.add_argument('--per-doc', type=int, default=20)
+    parser.add_argument('--db', help="database to export (built if missing)")
+    parser.add_argument('--immutable', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = args.db or os.path.join(directory, 'export.db')
+        if not os.path.exists(db_path):
+            start = time.perf_counter()
+            db = DatabaseConnection(db_path)
+            build_corpus(db, args.revisions, args.per_doc)
+            db.close()
+            print(f"built {args.revisions} revisions in {time.perf_counter() - start:.1f} s")
+        print(f"database: {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+        rows, elapsed, peak = measure(lambda: old_fetchall(db_path))
+        print(f"  {'fetchall (old)':<16} {rows / elapsed:10,.0f} rows/s  {elapsed:7.2f} s  "
+              f"peak_mem={peak / 1e6:8.1f} MB")
+
+        for fmt in ('ndjson', 'csv'):
+            output = os.path.join(directory, f'export.{fmt}')
+            conn = open_readonly(db_path, args.immutable)
+            fields, query, params = revisions_query()
+            count, elapsed, peak = measure(lambda: export(conn, fmt, output, fields, query, params, 500))
+            conn.close()
+            size = os.path.getsize(output)
+            print(f"  {'export ' + fmt:<16} {count / elapsed:10,.0f} rows/s  {elapsed:7.2f} s  "
+                  f"peak_mem={peak / 1e6:8.1f} MB  {size / 1e6 / elapsed:6.1f} MB/s written")
+            os.remove(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_history.py
+
+"""
+Memory and latency of GET /history for a document with many revisions.
+
+"list + jsonify" is the previous implementation: load every revision into a
+list, then serialize it in one go. The other rows go through the current
+streaming endpoint with and without projection and pagination.
+
+    python -m benchmarks.bench_history --revisions 500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from flask import jsonify
+
+from app import app
+from app.routes import audit_routes
+from app.utils.storage import DatabaseConnection
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def populate(db, revisions):
+    with open(DOC_PATH) as f:
+        text = f.read()
+    items = []
+    for number in range(1, revisions + 1):
+        items.append(('doc', {
+            'revision_number': number,
+            'timestamp': f'2025-01-01T00:00:{number % 60:02d}+00:00',
+            'original_text': f"{text}\nRevision {number}.",
+            'analysis': {"detected_hazards": [f"Hazard {i}" for i in range(20)], "original_text": text},
+            'revised_document': f"{text}\nRecommendation: revision {number}.",
+            'diff': f"--- Previous Version\n+++ New Version\n@@ -1 +1 @@\n-Revision {number - 1}.\n+Revision {number}."
+        }, []))
+    db.store_revisions(items)
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--revisions', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseConnection(os.path.join(tmp, 'history.db'))
+        populate(db, args.revisions)
+        audit_routes.db_connection = db
+        client = app.test_client()
+
+        def legacy():
+            with app.app_context():
+                return len(jsonify({'doc_id': 'doc', 'revisions': db.get_revision_history('doc')}).get_data())
+
+        def streamed(url):
+            def run():
+                response = client.get(url)
+                size = sum(len(chunk) for chunk in response.response)
+                response.close()
+                return size
+            return run
+
+        cases = [
+            ('list + jsonify', legacy),
+            ('stream, all fields', streamed('/history/doc')),
+            ('stream, projected', streamed('/history/doc?fields=revision_number,timestamp')),
+            ('stream, page of 50', streamed('/history/doc?limit=50')),
+            ('single revision', streamed(f'/history/doc/{args.revisions}?fields=revised_document')),
+        ]
+        for label, fn in cases:
+            fn()  # warm up the connection and statement cache
+            elapsed, peak, size = measure(fn)
+            print(f"{label:<20} latency={elapsed * 1000:8.1f} ms  peak_mem={peak / 1024:9.1f} KiB  "
+                  f"body={size / 1024:9.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
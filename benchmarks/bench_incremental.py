@@ -0,0 +1,95 @@
+# benchmarks/bench_incremental.py
+
+"""
+Token spend and latency of a re-audit: whole document vs. changed sections only.
+
+The fake server's latency grows with the prompt size, so latency tracks the
+amount of text actually sent. The result cache is disabled so only the
+section-level reuse is measured.
+
+    python -m benchmarks.bench_incremental --latency-per-kchar 0.05
+"""
+
+import argparse
+import os
+import re
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app.utils import analyzer
+from app.utils.sections import split_sections
+from benchmarks.fake_openai import FakeOpenAIServer
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def prompt_tokens(requests):
+    return sum(len(body['messages'][-1]['content']) // 4 for body in requests)
+
+
+def manual(document, copies):
+    """A long document made of copies of document's sections, renumbered"""
+    sections = [section['text'] for section in split_sections(document)] * copies
+    return "".join(re.sub(r'^\d+\.', f"{number}.", text, count=1, flags=re.MULTILINE)
+                   for number, text in enumerate(sections, 1))
+
+
+def run(server, label, fn):
+    server.requests.clear()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} requests={len(server.requests):3d}  "
+          f"prompt_tokens={prompt_tokens(server.requests):6d}  latency={elapsed * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=0.05, help="fixed latency per request")
+    parser.add_argument('--latency-per-kchar', type=float, default=0.05, help="extra latency per 1000 prompt chars")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'mock_doc.txt')) as f:
+        v1 = f.read()
+    with open(os.path.join(ROOT, 'mock_doc_v2.txt')) as f:
+        v2 = f.read()
+    one_section_edit = v1.replace("outdated electrical wiring in the main production area",
+                                  "exposed electrical wiring in the main production area")
+    long_v1 = manual(v1, 10)
+    long_edit = long_v1.replace("outdated electrical wiring", "exposed electrical wiring", 1)
+
+    with FakeOpenAIServer(latency=args.latency, latency_per_kchar=args.latency_per_kchar) as server:
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+        analyzer.cache.enabled = False
+
+        def whole_document(text):
+            analysis = analyzer.executor.submit(analyzer.analyze_document, text)
+            revision = analyzer.executor.submit(analyzer.generate_revised_document, text)
+            return analysis.result(), revision.result()
+
+        def previous_of(sections):
+            return {s['fingerprint']: {'analysis': s['analysis'], 'revised_text': s['revised_text']}
+                    for s in sections}
+
+        run(server, "initial analysis: whole document", lambda: whole_document(v1))
+        _, _, sections = run(server, "initial analysis: chunked", lambda: analyzer.run_analysis(v1))
+        previous = previous_of(sections)
+
+        for label, text in (("one-section edit", one_section_edit), ("mock_doc -> mock_doc_v2", v2)):
+            run(server, f"{label}: whole document", lambda: whole_document(text))
+            run(server, f"{label}: incremental", lambda: analyzer.run_analysis(text, previous))
+
+        run(server, "70-section manual: whole document", lambda: whole_document(long_v1))
+        _, _, sections = run(server, "70-section manual: chunked", lambda: analyzer.run_analysis(long_v1))
+        previous = previous_of(sections)
+        run(server, "manual one-section edit: whole document", lambda: whole_document(long_edit))
+        run(server, "manual one-section edit: incremental",
+            lambda: analyzer.run_analysis(long_edit, previous))
+
+
+if __name__ == '__main__':
+    main()
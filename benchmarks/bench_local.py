@@ -0,0 +1,100 @@
+# benchmarks/bench_local.py
+
+"""
+Throughput of the offline analyzer backend over thousands of documents.
+
+Documents are the sections of mock_doc.txt with a few varied sentences
+added. "per-phrase" is the obvious way to write the same rules: every
+lexicon phrase is its own pattern, searched in every sentence. "single
+pass" is LocalBackend, which scans each document once with all phrases in
+one compiled alternation. The tiered row reports how many documents the
+rules would still send to OpenAI.
+
+    python -m benchmarks.bench_local --documents 5000
+"""
+
+import argparse
+import os
+import random
+import re
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.utils.backends import CUES, HAZARD_LEXICON, LocalBackend, TieredBackend
+from app.utils.sections import SENTENCE, split_sections
+from benchmarks.bench_chunking import DOC_PATH
+
+EXTRA_SENTENCES = [
+    "Exposed wiring was found behind panel {n}.",
+    "Last year a worker was injured by a forklift in aisle {n}.",
+    "Chemical containers in room {n} are unlabeled.",
+    "Hot work permits for bay {n} have expired training records.",
+    "The canteen on floor {n} serves lunch at noon.",
+    "There is a general risk near gate {n}.",
+    "Ensure guardrails on platform {n} prevent falls.",
+]
+
+
+def build_documents(count, seed=0):
+    rng = random.Random(seed)
+    with open(DOC_PATH) as f:
+        sections = [s['text'] for s in split_sections(f.read())]
+    documents = []
+    for number in range(count):
+        extras = " ".join(rng.choice(EXTRA_SENTENCES).format(n=rng.randrange(1000)) for _ in range(3))
+        documents.append(sections[number % len(sections)] + extras + "\n")
+    return documents
+
+
+def per_phrase(text, patterns):
+    """The same matching as LocalBackend.scan, one pattern and one sentence at a time"""
+    found = []
+    for match in SENTENCE.finditer(text):
+        sentence = match.group().strip()
+        found.append([name for name, pattern in patterns if pattern.search(sentence)])
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--documents', type=int, default=5000)
+    args = parser.parse_args()
+
+    documents = build_documents(args.documents)
+    size = sum(len(document) for document in documents)
+    print(f"{len(documents)} documents, {size / 1e6:.1f} MB")
+
+    patterns = [(name, re.compile(rf'\b(?:{phrase})\b', re.IGNORECASE))
+                for name, (phrases, _, _, _) in HAZARD_LEXICON.items() for phrase in phrases]
+    patterns += [(name, re.compile(rf'\b(?:{phrase})\b', re.IGNORECASE))
+                 for name, phrases in CUES.items() for phrase in phrases]
+    local = LocalBackend()
+    cases = {
+        'per-phrase': lambda document: per_phrase(document, patterns),
+        'single pass': local.scan,
+        'single pass + analysis': local.analyze,
+        'single pass + revision': local.revise,
+    }
+    for label, fn in cases.items():
+        start = time.perf_counter()
+        for document in documents:
+            fn(document)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<24} {len(documents) / elapsed:9.0f} docs/s  "
+              f"{elapsed / len(documents) * 1e6:8.1f} us/doc  {size / elapsed / 1e6:6.1f} MB/s")
+
+    class Counting:
+        def analyze(self, text, on_item=None):
+            return {}
+
+    tiered = TieredBackend(local=local, remote=Counting())
+    for document in documents:
+        tiered.analyze(document)
+    stats = tiered.stats()
+    print(f"  tiered: {stats['local']} answered locally, {stats['escalated']} escalated "
+          f"({stats['escalated'] / len(documents):.0%} of OpenAI calls remain)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# benchmarks/bench_metrics.py
+
+"""
+Overhead of the request instrumentation on /analyze and /history.
+
+Requests go through the Flask test client against a temporary database.
+--backend local analyzes with the offline rules, so a request takes a few
+milliseconds and the instrumentation is as large a share of it as it gets;
+--backend openai uses the fake OpenAI server with --latency per call.
+Modes are interleaved round by round and the median round is reported;
+the measured overhead of 'enabled' over 'disabled' is the figure to quote.
+Run-to-run noise on a shared machine is a couple of percent, so the cost is
+also estimated directly, as a cross-check: the request hooks with metrics
+on minus off, plus the timed blocks per request times the cost of one block
+inside a request, and the share of time the profiler spends taking samples.
+
+    python -m benchmarks.bench_metrics --requests 200 --rounds 7
+"""
+
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app import create_app
+from app.utils import analyzer, metrics
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def observations(histograms=(metrics.STAGE_SECONDS, metrics.DB_SECONDS)):
+    """Observations recorded so far in histograms, by default those of the timed blocks"""
+    return sum(sum(counts[:-1]) for histogram in histograms for counts in histogram._values.values())
+
+
+def hook_seconds(app, enabled, iterations=20000):
+    """Time the before, after and teardown request hooks take per request"""
+    app.config['METRICS_ENABLED'] = enabled
+    response = app.response_class(b'{}', mimetype='application/json')
+    with app.test_request_context('/history/bench'):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            app.preprocess_request()
+            app.process_response(response)
+            app.do_teardown_request()
+        return (time.perf_counter() - start) / iterations
+
+
+def block_seconds(app, iterations=200000):
+    """Time one timed block takes inside a request that records metrics"""
+    app.config['METRICS_ENABLED'] = True
+    with app.test_request_context('/history/bench'):
+        token = metrics.current_enabled.set(True)
+        try:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                with metrics.timed(metrics.STAGE_SECONDS, 'bench'):
+                    pass
+            return (time.perf_counter() - start) / iterations
+        finally:
+            metrics.current_enabled.reset(token)
+
+
+def run_round(client, document, requests, headers):
+    start = time.perf_counter()
+    doc_id = None
+    for index in range(requests):
+        if doc_id is None or index % 2 == 0:
+            response = client.post('/analyze', data={'document': (io.BytesIO(document), 'doc.txt')},
+                                   content_type='multipart/form-data', headers=headers)
+            doc_id = response.get_json()['doc_id']
+        else:
+            client.get(f'/history/{doc_id}', headers=headers).get_data()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--backend', choices=('local', 'openai'), default='local')
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with open(DOC_PATH, 'rb') as f:
+        document = f.read()
+
+    with tempfile.TemporaryDirectory() as directory, FakeOpenAIServer(latency=args.latency) as server:
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'), 'CACHE_ENABLED': False,
+                          'ANALYZER_BACKEND': args.backend})
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake', max_retries=0)
+
+        modes = {
+            'disabled': (False, {}, False),
+            'enabled': (True, {}, False),
+            'enabled + trace': (True, {app.config['METRICS_TRACE_HEADER']: '1'}, False),
+            'enabled + profiler': (True, {}, True),
+        }
+        timings = {mode: [] for mode in modes}
+        observed = 0
+        metrics.profiler.reset()
+        with app.test_client() as client:
+            run_round(client, document, 10, {})  # warm up
+            for _ in range(args.rounds):
+                for mode, (enabled, headers, profile) in modes.items():
+                    app.config['METRICS_ENABLED'] = enabled
+                    if profile:
+                        metrics.profiler.start()
+                    before = observations()
+                    try:
+                        timings[mode].append(run_round(client, document, args.requests, headers))
+                    finally:
+                        metrics.profiler.stop()
+                    if mode == 'enabled':
+                        observed += observations() - before
+
+        hooks = hook_seconds(app, True) - hook_seconds(app, False)
+        block = block_seconds(app)
+
+    baseline = statistics.median(timings['disabled'])
+    request = baseline / args.requests
+    print(f"{args.requests} requests per round, {args.backend} backend, median of {args.rounds} rounds")
+    for mode, values in timings.items():
+        elapsed = statistics.median(values)
+        print(f"  {mode:<20} {elapsed / args.requests * 1e6:9.1f} us/request  "
+              f"overhead {(elapsed - baseline) / baseline:+6.2%}")
+
+    measured = statistics.median(timings['enabled']) - baseline
+    print(f"  metrics, measured: {measured / args.requests * 1e6:+.1f} us, "
+          f"{measured / baseline:+.2%} of a request")
+    per_request = observed / (args.rounds * args.requests)
+    estimate = hooks + per_request * block
+    print(f"  metrics, estimated: hooks {hooks * 1e6:.1f} us + {per_request:.1f} timed blocks "
+          f"x {block * 1e9:.0f} ns = {estimate * 1e6:.1f} us, {estimate / request:.2%} of a request")
+
+    status = metrics.profiler.status()
+    profiled = sum(timings['enabled + profiler'])
+    if status['samples']:
+        print(f"  profiler: {status['samples']} samples every {status['interval'] * 1000:.0f} ms, "
+              f"{status['busy_seconds'] / status['samples'] * 1e6:.0f} us each, "
+              f"{status['busy_seconds'] / profiled:.2%} of the profiled time")
+    else:
+        print("  profiler: no samples taken, run more --requests or --rounds")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_pipeline.py
+
+"""
+Latency of the per-request analysis pipeline against a local fake OpenAI server.
+
+Compares the old sequential flow (analyze_document, then generate_revised_document)
+with run_analysis, which issues both calls concurrently. The result cache is
+disabled so every iteration reaches the server, and the app uses a temporary
+database.
+
+    python -m benchmarks.bench_pipeline --iterations 50 --latency 0.2
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app import create_app
+from app.utils import analyzer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def sequential(text):
+    return analyzer.analyze_document(text), analyzer.generate_revised_document(text)
+
+
+def measure(fn, text, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(text)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<12} p50={percentile(samples, 50) * 1000:8.1f} ms  "
+          f"p99={percentile(samples, 99) * 1000:8.1f} ms  "
+          f"mean={statistics.mean(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help="fake server latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with open(DOC_PATH) as f:
+        text = f.read()
+
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeOpenAIServer(latency=args.latency, jitter=args.jitter) as server:
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'), 'CACHE_ENABLED': False})
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+        analyzer.cache.enabled = False
+        with app.app_context():
+            # Warm up the connection pool so the first sample isn't an outlier
+            sequential(text)
+
+            server.requests.clear()
+            report('sequential', measure(sequential, text, args.iterations))
+            report('concurrent', measure(analyzer.run_analysis, text, args.iterations))
+        assert len(server.requests) == 4 * args.iterations, "some iterations didn't reach the server"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bench_reaudit.py
+
+"""
+Re-audit latency as a document's history grows.
+
+Analysis is replaced with a no-op so only the storage work is measured:
+finding the latest revision, diffing against it and storing the new one.
+"history lookup" is the previous approach of loading the whole history to
+use its last entry.
+
+    python -m benchmarks.bench_reaudit --lengths 1 10 100 1000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.routes import audit_routes
+from app.utils.storage import DatabaseConnection
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(DOC_PATH) as f:
+        text = f.read()
+    audit_routes.run_analysis = lambda content, previous=None, on_event=None: ({"detected_hazards": []}, content, [])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for length in args.lengths:
+            db = DatabaseConnection(os.path.join(tmp, f'history-{length}.db'))
+            db.store_revisions([
+                ('doc', {
+                    'revision_number': number,
+                    'timestamp': '2025-01-01T00:00:00+00:00',
+                    'original_text': f"{text}\nRevision {number}.",
+                    'analysis': {"detected_hazards": []},
+                    'revised_document': text,
+                    'diff': None
+                }, [])
+                for number in range(1, length + 1)
+            ])
+            audit_routes.db_connection = db
+
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                db.texts.clear()
+                db.get_revision_history('doc')[-1]
+            history = (time.perf_counter() - start) * 1000 / args.iterations
+
+            start = time.perf_counter()
+            for i in range(args.iterations):
+                db.texts.clear()
+                _, status_code = audit_routes.process_re_audit('doc', f"{text}\nEdit {i}.")
+                assert status_code == 200
+            re_audit = (time.perf_counter() - start) * 1000 / args.iterations
+
+            print(f"{length:>6} revisions  history lookup={history:8.2f} ms  re-audit={re_audit:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_responses.py
+
+"""
+Tokens, response size and latency of the full and compact analysis schemas.
+
+/analyze runs through the Flask test client against the fake OpenAI
+server, which quotes the document's sentences in full-schema answers and
+gives their numbers in compact ones, so both find the same findings.
+Generating each word of an answer takes --token-interval seconds, as
+with a real model, so shorter answers come back sooner. The revision call of each chunk
+answers with the whole chunk either way, so it bounds the request; "analysis
+stage" is the time of the analysis calls alone. Response bytes are
+for the /analyze body in the full and lean views, as sent and compressed;
+serialization compares Flask's stdlib provider with orjson on a long
+/history.
+
+    python -m benchmarks.bench_responses --pages 5 --token-interval 0.01
+"""
+
+import argparse
+import gzip
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from openai import OpenAI
+
+from app import create_app
+from app.utils import analyzer, compression, metrics
+from app.utils.jsonprovider import OrjsonProvider
+from app.utils.sections import lean_revision
+from benchmarks.bench_chunking import build_manual
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def analyze(client, document):
+    start = time.perf_counter()
+    response = client.post('/analyze', data={'document': (io.BytesIO(document), 'doc.txt')},
+                           content_type='multipart/form-data')
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_data()
+    return elapsed, response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--token-interval', type=float, default=0.01, help="seconds per generated word")
+    parser.add_argument('--revisions', type=int, default=200, help="revisions serialized per /history")
+    args = parser.parse_args()
+
+    document = build_manual(args.pages).encode('utf-8')
+
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeOpenAIServer(latency=args.latency, token_interval=args.token_interval, quote_document=True) as server:
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'responses.db'), 'JSON_PROVIDER': 'stdlib',
+                          'CACHE_ENABLED': False, 'ANALYZER_BACKEND': 'openai'})
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake', max_retries=0)
+        print(f"{len(document) / 1000:.0f} kB document, {args.requests} requests per schema, "
+              f"{args.token_interval * 1000:.0f} ms per generated word")
+        payloads = {}
+        with app.test_client() as client:
+            for schema in ('full', 'compact'):
+                app.config['ANALYSIS_SCHEMA'] = schema
+                server.usage.clear()
+                before = metrics.STAGE_SECONDS.snapshot('analysis')
+                timings = [analyze(client, document)[0] for _ in range(args.requests)]
+                count, total = (now - then for now, then in zip(metrics.STAGE_SECONDS.snapshot('analysis'), before))
+                _, payloads[schema] = analyze(client, document)
+                # The revision calls are the same for both schemas
+                usage = server.usage['analysis']
+                calls = usage['responses']
+                print(f"  {schema:<8} {statistics.median(timings) * 1000:6.0f} ms/request  "
+                      f"analysis stage {total / count * 1000:5.0f} ms/chunk  analysis call: "
+                      f"{usage['prompt_tokens'] / calls:6.0f} prompt + {usage['completion_tokens'] / calls:5.0f} "
+                      f"completion tokens  "
+                      f"{len(payloads[schema]['revision']['analysis']['detected_hazards'])} hazards found")
+
+    providers = [('stdlib', app.json)]
+    try:
+        providers.append(('orjson', OrjsonProvider(app)))
+    except ImportError:
+        print("orjson is not installed; only the stdlib provider is measured")
+
+    print("/analyze response body")
+    with app.test_request_context():
+        for view in ('full', 'lean'):
+            payload = payloads['compact']
+            if view == 'lean':
+                payload = dict(payload, revision=lean_revision(payload['revision']))
+            for label, provider in providers:
+                body = provider.response(payload).get_data()
+                print(f"  {view:<5} {label:<7} {len(body) / 1000:8.1f} kB  "
+                      f"gzip {len(gzip.compress(body, app.config['COMPRESS_LEVEL'])) / 1000:7.1f} kB  "
+                      + (f"br {len(compression.compress(body, 'br')) / 1000:7.1f} kB"
+                         if compression.brotli is not None else ""))
+
+    history = {'doc_id': 'x', 'revisions': [payloads['compact']['revision']] * args.revisions}
+    print(f"serializing a {args.revisions}-revision /history")
+    with app.test_request_context():
+        for label, provider in providers:
+            start = time.perf_counter()
+            for _ in range(5):
+                body = provider.response(history).get_data()
+            elapsed = (time.perf_counter() - start) / 5
+            print(f"  {label:<7} {elapsed * 1000:8.1f} ms  {len(body) / elapsed / 1e6:7.0f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
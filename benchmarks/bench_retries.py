@@ -0,0 +1,92 @@
+# benchmarks/bench_retries.py
+
+"""
+Outcome of a burst of analyses against an API that rate-limits some of
+its requests, with and without retries.
+
+The fake server answers --error-rate of requests with a 429 carrying a
+Retry-After of --retry-after seconds. "no retries" is the old behaviour:
+every failed call becomes a failed analysis. "scheduler" retries with
+jittered exponential backoff inside the per-call deadline.
+
+    python -m benchmarks.bench_retries --documents 40 --error-rate 0.2
+"""
+
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app.config import Config
+from app.utils import analyzer
+from app.utils.ratelimit import CallScheduler, RateLimiter, RetriesExhausted
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def run(texts, concurrency, max_retries, rpm, tpm):
+    analyzer.call_scheduler = CallScheduler(
+        RateLimiter(rpm, tpm), analyzer._is_transient, analyzer._retry_after,
+        max_retries=max_retries, base_delay=Config.OPENAI_RETRY_BASE_DELAY,
+        max_delay=Config.OPENAI_RETRY_MAX_DELAY, deadline=Config.OPENAI_CALL_DEADLINE
+    )
+
+    def analyze(text):
+        start = time.perf_counter()
+        try:
+            analysis, revised, _ = analyzer.run_analysis(text)
+            ok = 'error' not in analysis and not revised.startswith(analyzer.REVISION_ERROR_PREFIX)
+        except RetriesExhausted:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(analyze, texts))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for _, seconds in results)
+    return {
+        'analyzed': sum(ok for ok, _ in results),
+        'seconds': elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95)],
+        **analyzer.call_scheduler.metrics()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--documents', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--retry-after', type=float, default=0.2)
+    parser.add_argument('--rpm', type=int, default=None, help="client-side requests per minute")
+    parser.add_argument('--tpm', type=int, default=None, help="client-side tokens per minute")
+    args = parser.parse_args()
+
+    with open(DOC_PATH) as f:
+        base = f.read()
+    texts = [f"{base}\n\nRevision note {i}." for i in range(args.documents)]
+    analyzer.cache.enabled = False
+
+    with FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate,
+                          retry_after=args.retry_after) as server:
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake', max_retries=0)
+        for label, retries in (('no retries', 0), ('scheduler', Config.OPENAI_MAX_RETRIES)):
+            server.requests.clear()
+            result = run(texts, args.concurrency, retries, args.rpm, args.tpm)
+            print(f"{label:<11} analyzed={result['analyzed']:3d}/{args.documents}  "
+                  f"time={result['seconds']:6.1f} s  p50={result['p50']:5.2f} s  p95={result['p95']:5.2f} s  "
+                  f"requests={len(server.requests)}  retries={result['retries']}  "
+                  f"queue_wait={result['queue_wait_seconds']:.1f} s  tokens_used={result['tokens_used']}")
+
+
+if __name__ == '__main__':
+    main()
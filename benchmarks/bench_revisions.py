@@ -0,0 +1,114 @@
+# benchmarks/bench_revisions.py
+
+"""
+Database size and read latency of delta-compressed revision storage.
+
+Stores --revisions revisions of a ~--kb KB manual, each with a few edited
+lines, once as full text per row (the previous schema) and once as blob
+snapshots plus deltas, then compares the database size and the time to read
+the latest revision, an old revision and the whole history.
+
+    python -m benchmarks.bench_revisions --kb 500 --revisions 100
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.utils.storage import DatabaseConnection
+from benchmarks.bench_chunking import build_manual
+
+
+class FullTextDatabaseConnection(DatabaseConnection):
+    """Writes revisions the way the previous schema did: every text in full"""
+
+    def _insert_revision(self, conn, doc_id, revision_data, sections):
+        conn.execute('INSERT OR IGNORE INTO documents (doc_id) VALUES (?)', (doc_id,))
+        conn.execute('''
+            INSERT INTO revisions
+            (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            doc_id,
+            revision_data['revision_number'],
+            revision_data['timestamp'],
+            revision_data['original_text'],
+            json.dumps(revision_data['analysis']),
+            revision_data['revised_document'],
+            revision_data['diff']
+        ))
+
+
+def versions(kb, count, seed=0):
+    rng = random.Random(seed)
+    lines = build_manual(kb * 1000 // 3000 + 1).splitlines(keepends=True)
+    texts = []
+    for number in range(count):
+        for _ in range(5):
+            lines[rng.randrange(len(lines))] = f"Amended in revision {number + 1}: {rng.random():.6f}\n"
+        texts.append("".join(lines))
+    return texts
+
+
+def database_size(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+    return os.path.getsize(path)
+
+
+def timed(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--kb', type=int, default=500)
+    parser.add_argument('--revisions', type=int, default=100)
+    args = parser.parse_args()
+
+    texts = versions(args.kb, args.revisions)
+    print(f"{args.revisions} revisions of a {len(texts[0]) / 1000:.0f} KB manual")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cls in (('full text', FullTextDatabaseConnection), ('deltas', DatabaseConnection)):
+            path = os.path.join(tmp, f'{cls.__name__}.db')
+            db = cls(path)
+            start = time.perf_counter()
+            for number, text in enumerate(texts, start=1):
+                db.store_revision('doc', {
+                    'revision_number': number,
+                    'timestamp': '2025-01-01T00:00:00+00:00',
+                    'original_text': text,
+                    'analysis': {"detected_hazards": ["Fire risk"], "original_text": text},
+                    'revised_document': text + "\nRecommendation: replace the wiring.",
+                    'diff': f"@@ revision {number} @@"
+                })
+            write = (time.perf_counter() - start) * 1000 / len(texts)
+            db.close()
+            size = database_size(path)
+
+            db = cls(path)
+            latest, middle = len(texts), len(texts) // 2
+            cold_latest = timed(lambda: db.get_revision('doc', latest, fields=('original_text',)), repeat=1)
+            warm_latest = timed(lambda: db.get_revision('doc', latest, fields=('original_text',)))
+            old = timed(lambda: (db.texts.clear(), db.get_revision('doc', middle, fields=('original_text',))))
+            history = timed(lambda: (db.texts.clear(), db.get_revision_history('doc')), repeat=1)
+            print(f"{label:<10} size={size / 1e6:8.2f} MB  write={write:7.1f} ms/rev  "
+                  f"latest cold={cold_latest:6.1f} ms warm={warm_latest:6.2f} ms  "
+                  f"old revision={old:6.1f} ms  full history={history:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# benchmarks/bench_search.py
+
+"""
+Query latency of the revision_search full-text index on a synthetic corpus.
+
+Builds --revisions revisions spread over documents of --revisions-per-doc
+revisions each, then times a set of queries both as raw MATCH queries
+against the index and through GET /search (ranking, paging and snippets).
+"LIKE scan" is the alternative without an index: a substring match over
+the analysis JSON alone, since the texts are compressed in blobs.
+
+    python -m benchmarks.bench_search --revisions 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app import app
+from app.routes import audit_routes
+from app.utils.search import build_match
+from app.utils.storage import DatabaseConnection
+
+HAZARDS = [
+    "Forklift collision with pedestrians", "Unguarded conveyor nip point", "Missing fall protection on mezzanine",
+    "Blocked emergency exit", "Frayed electrical cord", "Chemical drums without secondary containment",
+    "Lockout/tagout not applied before maintenance", "Excessive noise without hearing protection",
+    "Confined space entry without permit", "Wet floor near loading dock", "Improper ladder use",
+    "Compressed gas cylinders not secured", "Inadequate machine guarding", "Overloaded racking",
+]
+ISSUES = [
+    "OSHA 1910.22 walking-working surfaces", "OSHA 1910.147 control of hazardous energy",
+    "OSHA 1910.212 machine guarding", "OSHA 1910.178 powered industrial trucks",
+    "OSHA 1910.146 permit-required confined spaces", "OSHA 1910.95 occupational noise exposure",
+    "OSHA 1910.1200 hazard communication", "OSHA 1910.37 exit routes",
+]
+WORDS = ("site area shift operator supervisor inspection procedure training equipment maintenance "
+         "storage aisle dock warehouse line station guard panel valve pump tank pallet crew").split()
+
+# Common queries match a large share of the corpus (every revision draws from
+# the same short hazard list); selective ones name a single station or unit tag
+COMMON_QUERIES = ["forklift", "lockout tagout", "confined space", "1910.147", "conveyor guard",
+                  "inspect*", "\"emergency exit\"", "racking overloaded", "noise", "valve maintenance"]
+SELECTIVE_QUERIES = [f"S{number:04d}" for number in (17, 230, 1024, 2048, 4999)] + \
+                    [f"U{number:05d}" for number in (7, 1234, 9876, 15000, 19999)]
+
+
+def build_corpus(db, revisions, per_doc, seed=0):
+    rng = random.Random(seed)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    batch = []
+    for index in range(revisions):
+        doc_id = f"doc-{index // per_doc}"
+        number = index % per_doc + 1
+        text = "\n".join(
+            f"{line}. " + " ".join(rng.choice(WORDS) for _ in range(12)) + f" on unit U{rng.randrange(20000):05d}."
+            for line in range(1, 21)
+        )
+        analysis = {
+            "detected_hazards": [f"{hazard} at station S{rng.randrange(5000):04d}" for hazard in rng.sample(HAZARDS, 3)],
+            "compliance_issues": rng.sample(ISSUES, 2),
+        }
+        analysis["regulatory_comments"] = {
+            " ".join(issue.split()[:2]): "Review " + " ".join(issue.split()[2:])
+            for issue in analysis["compliance_issues"]
+        }
+        batch.append((doc_id, {
+            'revision_number': number,
+            'timestamp': timestamp,
+            'original_text': text,
+            'analysis': analysis,
+            'revised_document': text + "\nRecommendation: " + analysis["detected_hazards"][0] + ".",
+            'diff': None
+        }, None))
+        if len(batch) == 1000:
+            db.store_revisions(batch)
+            batch = []
+    if batch:
+        db.store_revisions(batch)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+def time_queries(run, queries, iterations):
+    samples = []
+    for _ in range(iterations):
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--revisions', type=int, default=100000)
+    parser.add_argument('--revisions-per-doc', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseConnection(os.path.join(tmp, 'search.db'))
+        start = time.perf_counter()
+        build_corpus(db, args.revisions, args.revisions_per_doc)
+        elapsed = time.perf_counter() - start
+        print(f"built {args.revisions} revisions in {elapsed:.1f} s "
+              f"({args.revisions / elapsed:.0f} revisions/s including indexing)")
+
+        audit_routes.db_connection = db
+        client = app.test_client()
+
+        def raw(query):
+            return db.search_revisions(build_match(query), 20)
+
+        def endpoint(query):
+            return client.get('/search', query_string={'q': query}).get_data()
+
+        def scan(query):
+            # Unindexed baseline: every match has to be found before any
+            # ranking, and only the analysis JSON is searchable this way
+            pattern = '%' + query.strip('*"') + '%'
+            with db.connection() as conn:
+                return conn.execute(
+                    'SELECT doc_id, revision_number FROM revisions WHERE analysis LIKE ?', (pattern,)
+                ).fetchall()
+
+        cases = (('LIKE scan', scan), ('MATCH (top 20)', raw), ('GET /search', endpoint))
+        for kind, queries in (('common', COMMON_QUERIES), ('selective', SELECTIVE_QUERIES)):
+            print(f"{kind} queries")
+            for label, run in cases:
+                p50, p95 = time_queries(run, queries, args.iterations)
+                print(f"  {label:<16} p50={p50 * 1000:8.2f} ms  p95={p95 * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/bench_startup.py
+
+"""
+Time to start a worker: fresh interpreters importing the app, by entry point.
+
+Each case runs in a new process with -X importtime, without OPENAI_API_KEY
+and against a temporary database. "import time" is the cumulative time of
+the top-level imports; "wall" is the whole process, interpreter start-up
+included. The last case sends one request through the OpenAI backend
+against the fake server, which is when the openai package gets imported.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+CASES = {
+    'python -c pass': "pass",
+    'import app.utils.storage (CLI)': "import app.utils.storage",
+    'import app.routes.audit_routes': "import app.routes.audit_routes",
+    'from app import app': "from app import app",
+    '+ first OpenAI request': (
+        "import io, os\n"
+        "from app import app\n"
+        "from app.utils import analyzer\n"
+        "from openai import OpenAI\n"
+        "app.extensions['audit']['cache'].enabled = False\n"
+        "analyzer.client = OpenAI(base_url=os.environ['FAKE_OPENAI_URL'], api_key='fake', max_retries=0)\n"
+        "response = app.test_client().post('/analyze', content_type='multipart/form-data',\n"
+        "    data={'document': (io.BytesIO(b'Wear gloves. Lock out the press.'), 'doc.txt')})\n"
+        "assert response.status_code == 200, response.get_data()\n"
+    ),
+}
+
+
+def import_seconds(stderr):
+    return sum(
+        int(fields[1]) for fields in (line.split('|') for line in stderr.splitlines())
+        if len(fields) == 3 and fields[1].strip().isdigit()
+        and fields[2].startswith(' ') and not fields[2].startswith('  ')
+    ) / 1e6
+
+
+def run(code, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr[-2000:])
+    modules = sum(1 for line in result.stderr.splitlines() if line.startswith('import time:')) - 1
+    return elapsed, import_seconds(result.stderr), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, FakeOpenAIServer(latency=0) as server:
+        env = {k: v for k, v in os.environ.items() if k != 'OPENAI_API_KEY'}
+        env.update(AUDIT_DB_PATH=os.path.join(directory, 'startup.db'), FAKE_OPENAI_URL=server.base_url,
+                   ANALYZER_BACKEND='openai')
+        print(f"median of {args.runs} runs")
+        for label, code in CASES.items():
+            runs = [run(code, env) for _ in range(args.runs)]
+            wall = statistics.median(r[0] for r in runs)
+            imports = statistics.median(r[1] for r in runs)
+            print(f"  {label:<32} wall {wall * 1000:7.1f} ms  import time {imports * 1000:7.1f} ms  "
+                  f"{runs[0][2]:5d} modules")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_stats.py
+
+"""
+Aggregate queries over the normalized findings tables versus decoding
+revisions.analysis row by row.
+
+"JSON scan" reads every analysis, decodes it and counts in Python, which
+is what any aggregate needed before the findings tables existed. "SQL" is
+the storage method behind the matching /stats endpoint.
+
+    python -m benchmarks.bench_stats --revisions 20000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.utils.sections import finding_key
+from app.utils.storage import DatabaseConnection
+from benchmarks.bench_search import build_corpus
+
+
+def scan_top(db, key, limit=20):
+    counts = Counter()
+    documents = defaultdict(set)
+    texts = {}
+    with db.connection() as conn:
+        for doc_id, analysis in conn.execute('SELECT doc_id, analysis FROM revisions'):
+            findings = json.loads(analysis).get(key) or []
+            for item in findings if isinstance(findings, (list, dict)) else [findings]:
+                normalized = finding_key(item)
+                counts[normalized] += 1
+                documents[normalized].add(doc_id)
+                texts.setdefault(normalized, item)
+    return [(texts[k], count, len(documents[k])) for k, count in counts.most_common(limit)]
+
+
+def scan_timeline(db, doc_id):
+    with db.connection() as conn:
+        rows = conn.execute(
+            'SELECT revision_number, analysis FROM revisions WHERE doc_id = ? ORDER BY revision_number', (doc_id,)
+        ).fetchall()
+    return [(number, len(json.loads(analysis).get('detected_hazards') or [])) for number, analysis in rows]
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--revisions', type=int, default=20000)
+    parser.add_argument('--revisions-per-doc', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseConnection(os.path.join(tmp, 'stats.db'))
+        build_corpus(db, args.revisions, args.revisions_per_doc)
+        print(f"{args.revisions} revisions")
+
+        cases = {
+            'top hazards': (lambda: scan_top(db, 'detected_hazards'),
+                            lambda: db.top_findings('hazards', 20)),
+            'top standards': (lambda: scan_top(db, 'regulatory_comments'),
+                              lambda: db.top_findings('regulatory_comments', 20)),
+            'document timeline': (lambda: scan_timeline(db, 'doc-7'),
+                                  lambda: db.findings_timeline('doc-7')),
+        }
+        for label, (scan, sql) in cases.items():
+            scan_time = timed(scan, args.iterations)
+            sql_time = timed(sql, args.iterations)
+            print(f"  {label:<18} JSON scan={scan_time * 1000:9.2f} ms  SQL={sql_time * 1000:8.2f} ms  "
+                  f"({scan_time / sql_time:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# benchmarks/bench_storage.py
+
+"""
+Read/write throughput of DatabaseConnection with N writer and M reader threads.
+
+Compares the pooled WAL connections with the previous behaviour, which opened
+a new rollback-journal connection for every call and re-ran schema.sql before
+every write.
+
+    python -m benchmarks.bench_storage --writers 4 --readers 8 --seconds 5
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.utils.storage import DatabaseConnection, MIGRATIONS_DIR
+
+
+class LegacyDatabaseConnection(DatabaseConnection):
+    """The per-call connection pattern this benchmark compares against"""
+
+    def _open(self, **kwargs):
+        return sqlite3.connect(self.db_path, **kwargs)
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def store_revision(self, doc_id, revision_data, sections=None):
+        with self.connection() as conn:
+            with open(os.path.join(MIGRATIONS_DIR, 'schema.sql')) as schema_file:
+                conn.executescript(schema_file.read())
+        super().store_revision(doc_id, revision_data, sections)
+
+
+def revision(number):
+    return {
+        'revision_number': number,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'original_text': "Fire risk due to outdated wiring. " * 50,
+        'analysis': {"detected_hazards": ["Fire risk due to outdated wiring."]},
+        'revised_document': "Recommendation: replace the wiring. " * 50,
+        'diff': None
+    }
+
+
+def run(db, writers, readers, seconds):
+    stop = time.perf_counter() + seconds
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def writer(worker):
+        number = 0
+        while time.perf_counter() < stop:
+            number += 1
+            try:
+                db.store_revision(f'doc-{worker}', revision(number))
+                key = 'writes'
+            except sqlite3.OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    def reader(worker):
+        while time.perf_counter() < stop:
+            try:
+                db.get_latest_revision_number(f'doc-{worker % max(writers, 1)}')
+                key = 'reads'
+            except sqlite3.OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cls in (('per-call', LegacyDatabaseConnection), ('pooled WAL', DatabaseConnection)):
+            db = cls(os.path.join(tmp, f'{cls.__name__}.db'))
+            result = run(db, args.writers, args.readers, args.seconds)
+            print(f"{label:<11} writes/s={result['writes']:9.1f}  reads/s={result['reads']:9.1f}  "
+                  f"errors/s={result['errors']:6.1f}")
+
+
+if __name__ == '__main__':
+    main()
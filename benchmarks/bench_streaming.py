@@ -0,0 +1,86 @@
+# benchmarks/bench_streaming.py
+
+"""
+Time to first byte of POST /analyze versus POST /analyze/stream.
+
+Both run against the fake OpenAI server streaming one word every
+--token-interval seconds after --latency seconds. The streaming endpoint is
+also timed to its first finding, its first piece of revised text and its
+final result.
+
+    python -m benchmarks.bench_streaming --latency 0.5 --token-interval 0.01
+"""
+
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from openai import OpenAI
+
+from app import create_app
+from app.utils import analyzer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+def post(client, url, document):
+    return client.post(url, data={'document': (io.BytesIO(document), 'doc.txt')},
+                       content_type='multipart/form-data')
+
+
+def time_sync(client, document):
+    start = time.perf_counter()
+    response = post(client, '/analyze', document)
+    response.get_data()
+    elapsed = time.perf_counter() - start
+    return {'first byte': elapsed, 'result': elapsed}
+
+
+def time_stream(client, document):
+    start = time.perf_counter()
+    response = post(client, '/analyze/stream', document)
+    marks = {}
+    for chunk in response.response:
+        now = time.perf_counter() - start
+        marks.setdefault('first byte', now)
+        text = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        for event, label in (('item', 'first finding'), ('revision', 'first revision text'), ('result', 'result')):
+            if f"event: {event}\n" in text:
+                marks.setdefault(label, now)
+    response.close()
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument('--token-interval', type=float, default=0.01, help="seconds between streamed words")
+    args = parser.parse_args()
+
+    with open(DOC_PATH, 'rb') as f:
+        document = f.read()
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeOpenAIServer(latency=args.latency, token_interval=args.token_interval) as server:
+        app = create_app({'DATABASE_PATH': os.path.join(tmp, 'streaming.db'), 'CACHE_ENABLED': False})
+        analyzer.client = OpenAI(base_url=server.base_url, api_key='fake')
+        client = app.test_client()
+
+        for label, run in (('/analyze', time_sync), ('/analyze/stream', time_stream)):
+            results = [run(client, document) for _ in range(args.iterations)]
+            summary = "  ".join(
+                f"{mark}={statistics.median(r[mark] for r in results) * 1000:7.1f} ms"
+                for mark in results[0]
+            )
+            print(f"{label:<16} {summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_uploads.py
+
+"""
+Peak memory and time to read an uploaded document, by upload size.
+
+Uploads are spooled the way werkzeug does it: in memory up to 500 KiB,
+in a temporary file beyond. "read + decode (old)" is the previous route
+code: file.read().decode('utf-8') followed by a scan for NUL characters.
+"read_text" is app.utils.uploads, which validates the upload in chunks and
+decodes it straight out of the spool buffer or an mmap of the spool file.
+The last row applies the default MAX_DOCUMENT_BYTES, so uploads over it
+are rejected after reading just past the limit. Peak memory is the Python
+heap as tracked by tracemalloc; the mmap'd file pages are page cache and
+not counted.
+
+    python -m benchmarks.bench_uploads --sizes 0.1 1 10 50
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+from app.config import Config
+from app.utils.uploads import UploadError, read_text
+from benchmarks.bench_chunking import build_manual
+
+SPOOL_MAX_SIZE = 500 * 1024
+
+
+def spooled_upload(data):
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    spooled.write(data)
+    spooled.seek(0)
+    return spooled
+
+
+def old_read(stream):
+    content = stream.read().decode('utf-8')
+    if not content or "\x00" in content:
+        raise ValueError("Could not read file content")
+    return content
+
+
+def measure(fn, data):
+    stream = spooled_upload(data)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        outcome = f"{len(fn(stream)) / 1e6:.1f} M chars"
+    except UploadError as e:
+        outcome = f"rejected ({e.status_code})"
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stream.close()
+    return elapsed, peak, outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.1, 1, 10, 50], help="upload sizes in MB")
+    args = parser.parse_args()
+
+    page = build_manual(20).encode('utf-8')
+    cases = {
+        'read + decode (old)': old_read,
+        'read_text': lambda stream: read_text(stream, max_bytes=0),
+        f'read_text, {Config.MAX_DOCUMENT_BYTES // 2 ** 20} MiB limit': read_text,
+    }
+    for size in args.sizes:
+        target = int(size * 1e6)
+        data = (page * (target // len(page) + 1))[:target]
+        # Don't cut a multi-byte character in half
+        data = data.decode('utf-8', errors='ignore').encode('utf-8')
+        print(f"{len(data) / 1e6:.1f} MB upload")
+        for label, fn in cases.items():
+            elapsed, peak, outcome = measure(fn, data)
+            print(f"  {label:<28} {elapsed * 1000:8.1f} ms  peak_mem={peak / 1e6:8.2f} MB "
+                  f"({peak / len(data):.2f}x the upload)  {outcome}")
+
+
+if __name__ == '__main__':
+    main()
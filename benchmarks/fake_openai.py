@@ -0,0 +1,302 @@
+# benchmarks/fake_openai.py
+
+"""
+A local stand-in for the OpenAI chat completions API.
+
+Only implements POST /v1/chat/completions, which is all the analyzer uses.
+Responses are canned but shaped like the real thing, and every request waits
+for a configurable latency (a fixed part plus a part proportional to the
+prompt size) so the benchmarks measure request scheduling rather than the
+network. Generating each word of the response takes --token-interval
+seconds; requests with "stream": true get the words as they are generated,
+other requests get the whole response at the end.
+
+Analysis prompts get CANNED_ANALYSIS, or with --quote-document the
+sentences of the document that mention FINDING_WORDS. Prompts in the
+compact schema (numbered sentences, answered with sentence numbers) always
+get the numbers of those sentences, so both schemas find the same things.
+Token usage is reported as a quarter of the characters and summed in
+FakeOpenAIServer.usage, for 'analysis' and 'revision' calls separately.
+
+Failures can be injected too: --error-rate answers that fraction of
+requests with --error-status (429 by default, with a Retry-After of
+--retry-after seconds), and fail_next() scripts the statuses of the next
+few requests for tests.
+
+Run standalone:
+    python -m benchmarks.fake_openai --port 8001 --latency 0.5
+"""
+
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANALYSIS = {
+    "detected_hazards": [
+        "There is a significant risk of fire due to outdated electrical wiring in the main production area."
+    ],
+    "compliance_issues": [
+        "Flammable materials are not properly segregated in the storage section."
+    ],
+    "regulatory_comments": {"NFPA 101": "Robust fire safety measures are required in building design."},
+    "accident_incidents": [
+        "A warehouse fire attributed to outdated electrical systems."
+    ]
+}
+
+
+# What --quote-document and compact prompts report each sentence as, by its words
+FINDING_WORDS = {
+    "detected_hazards": re.compile(r'\b(hazard|risk|danger|fire|burn|electric|chemical|fall|injur)', re.I),
+    "compliance_issues": re.compile(r'\b(must|shall|required|comply|compliance|not properly)', re.I),
+    "accident_incidents": re.compile(r'\b(incident|accident|occurred|near miss)', re.I),
+}
+COMPACT_KEYS = {"detected_hazards": "h", "compliance_issues": "c", "accident_incidents": "i"}
+SENTENCE = re.compile(r'(?:[^.!?\n]|[.!?](?=[^\s.!?]))+(?:[.!?]+|$)', re.MULTILINE)
+NUMBERED_SENTENCE = re.compile(r'^\[(\d+)\] (.*)$', re.MULTILINE)
+
+
+def _findings(sentences):
+    """Indexes of the sentences FINDING_WORDS picks out, by analysis key"""
+    return {
+        key: [index for index, sentence in enumerate(sentences) if words.search(sentence)]
+        for key, words in FINDING_WORDS.items()
+    }
+
+
+def _analysis_content(prompt, quote_document):
+    document = _document_from_prompt(prompt)
+    numbered = NUMBERED_SENTENCE.findall(document)
+    if '"h": [' in prompt:
+        findings = _findings([sentence for _, sentence in numbered])
+        result = {COMPACT_KEYS[key]: [int(numbered[i][0]) for i in found] for key, found in findings.items()}
+        result["r"] = CANNED_ANALYSIS["regulatory_comments"]
+        return json.dumps(result)
+    if not quote_document:
+        return json.dumps(CANNED_ANALYSIS)
+    sentences = [match.group().strip() for match in SENTENCE.finditer(document) if match.group().strip()]
+    result = {key: [sentences[i] for i in found] for key, found in _findings(sentences).items()}
+    result["regulatory_comments"] = CANNED_ANALYSIS["regulatory_comments"]
+    return json.dumps(result)
+
+
+def _document_from_prompt(prompt):
+    """Pull the document text back out of one of the analyzer's prompts."""
+    _, _, document = prompt.partition("Document:\n")
+    return document.split("\n\nReturn ONLY valid JSON")[0]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        self.server.fake.record_request(body)
+
+        fake = self.server.fake
+        prompt = body['messages'][-1]['content']
+        latency = fake.latency + fake.latency_per_kchar * len(prompt) / 1000
+        time.sleep(max(0.0, latency + random.uniform(-fake.jitter, fake.jitter)))
+
+        status = fake.next_error()
+        if status is not None:
+            self._send_error(status)
+            return
+
+        kind = 'analysis' if body.get('response_format', {}).get('type') == 'json_object' else 'revision'
+        if kind == 'analysis':
+            content = _analysis_content(prompt, fake.quote_document)
+        else:
+            content = _document_from_prompt(prompt) + "\nRecommendation: Review this procedure."
+        pieces = re.findall(r'\s*\S+\s*', content) or [content]
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4
+        }
+        fake.record_usage(kind, usage)
+        if body.get('stream'):
+            self._send_stream(body, pieces)
+            return
+        time.sleep(fake.token_interval * (len(pieces) - 1))
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _send_stream(self, body, pieces):
+        # No Content-Length: the body ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(self.server.fake.token_interval)
+            self._send_chunk(body, {"content": piece}, None)
+        self._send_chunk(body, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_chunk(self, body, delta, finish_reason):
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_error(self, status):
+        error_type = 'rate_limit_exceeded' if status == 429 else 'server_error'
+        headers = {}
+        if status in (429, 503) and self.server.fake.retry_after is not None:
+            headers['Retry-After'] = str(self.server.fake.retry_after)
+        self._send_json(status, {"error": {
+            "message": f"Injected {status} from the fake server",
+            "type": error_type,
+            "param": None,
+            "code": error_type
+        }}, headers)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpenAIServer:
+    """
+    Threaded fake OpenAI server. Use as a context manager:
+
+        with FakeOpenAIServer(latency=0.2) as server:
+            client = OpenAI(base_url=server.base_url, api_key='fake')
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, latency_per_kchar=0.0,
+                 token_interval=0.0, error_rate=0.0, error_status=429, retry_after=None, quote_document=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_kchar = latency_per_kchar
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.quote_document = quote_document
+        self.requests = []
+        self.usage = collections.defaultdict(collections.Counter)  # kind -> tokens reported, summed
+        self.errors = collections.Counter()  # injected failures by status
+        self._scripted = collections.deque()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record_request(self, body):
+        with self._lock:
+            self.requests.append(body)
+
+    def record_usage(self, kind, usage):
+        with self._lock:
+            self.usage[kind].update(usage)
+            self.usage[kind]['responses'] += 1
+
+    def fail_next(self, *statuses):
+        """Answer the next requests with these HTTP error statuses, in order"""
+        with self._lock:
+            self._scripted.extend(statuses)
+
+    def next_error(self):
+        """The error status to answer the current request with, or None to answer normally"""
+        with self._lock:
+            if self._scripted:
+                status = self._scripted.popleft()
+            elif self.error_rate and random.random() < self.error_rate:
+                status = self.error_status
+            else:
+                return None
+            self.errors[status] += 1
+            return status
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- seconds of random latency")
+    parser.add_argument('--latency-per-kchar', type=float, default=0.0, help="extra seconds per 1000 prompt chars")
+    parser.add_argument('--token-interval', type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument('--tokens-per-second', type=float, help="generation rate; sets --token-interval")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=429, help="HTTP status of injected failures")
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After seconds on 429/503")
+    parser.add_argument('--quote-document', action='store_true',
+                        help="answer analyses with sentences of the document instead of canned ones")
+    args = parser.parse_args()
+    if args.tokens_per_second:
+        args.token_interval = 1 / args.tokens_per_second
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.jitter, args.latency_per_kchar,
+                              args.token_interval, args.error_rate, args.error_status, args.retry_after,
+                              args.quote_document)
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
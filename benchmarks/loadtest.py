@@ -0,0 +1,444 @@
+# benchmarks/loadtest.py
+
+"""
+Load test: how many audits per second the service sustains, and at what latency.
+
+The app runs in its own process, served by werkzeug's threaded server on a
+fresh database, with the fake OpenAI server (benchmarks/fake_openai.py)
+standing in for the API. --concurrency client threads then send a weighted
+--mix of /analyze, /re_audit and /history requests for --duration seconds.
+Documents are built from mock_doc.txt and, for re-audits, mock_doc_v2.txt,
+in the --sizes given in kB, and carry a per-request tag so they are all
+distinct. Each run writes one JSON document: throughput, latency percentiles
+and status codes per operation, database growth, the server's peak RSS and
+what the fake OpenAI server saw. --baseline compares with an earlier run.
+
+    python -m benchmarks.loadtest --concurrency 16 --duration 60 \\
+        --mix analyze=2,re_audit=1,history=4 --sizes 2 8 --latency 0.5 \\
+        --tokens-per-second 100 --output results.json
+    python -m benchmarks.loadtest ... --baseline results.json
+
+--url runs the load against a server that is already running instead; the
+server's RSS and database size are then only reported if --pid and --db
+are given.
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import re
+import resource
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+DOCUMENTS = {
+    'v1': os.path.join(ROOT, 'mock_doc.txt'),
+    'v2': os.path.join(ROOT, 'mock_doc_v2.txt'),
+}
+OPERATIONS = ('analyze', 're_audit', 'history')
+HEADING = re.compile(r'^\d+\.', re.MULTILINE)
+
+
+def parse_mix(value):
+    """'analyze=2,history=1' -> {'analyze': 2.0, 'history': 1.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}' (use {', '.join(OPERATIONS)})")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad weight for {name}: {weight!r}") from None
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
+
+
+def build_document(version, kb, tag):
+    """
+    About kb kilobytes of the mock document's sections, renumbered and
+    repeated, with tag in the title and every section so that no two
+    requests send the same text.
+    """
+    with open(DOCUMENTS[version]) as f:
+        text = f.read()
+    starts = [match.start() for match in HEADING.finditer(text)]
+    title, sections = text[:starts[0]], [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+    parts = [f"{title.rstrip()} ({tag})\n\n"]
+    size = len(parts[0])
+    number = 0
+    while size < kb * 1000:
+        section = sections[number % len(sections)]
+        number += 1
+        parts.append(HEADING.sub(f'{number}.', section, count=1).rstrip() + f"\nNote {number} for {tag}.\n\n")
+        size += len(parts[-1])
+    return "".join(parts)
+
+
+def multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+    lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+                 f'Content-Type: text/plain\r\n\r\n')
+    body = "".join(lines).encode('utf-8') + content.encode('utf-8') + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One keep-alive HTTP connection, reopened after errors"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, response body); status 0 for a connection failure"""
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                # A kept-alive connection the server has already closed: retry once on a new one
+                if attempt:
+                    return 0, b''
+        return 0, b''
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class LoadGenerator:
+    def __init__(self, url, mix, sizes, seed, timeout):
+        self.url = url
+        self.mix = mix
+        self.sizes = sizes
+        self.seed = seed
+        self.timeout = timeout
+        self.doc_ids = []
+        self.results = {op: [] for op in OPERATIONS}  # op -> [(status, seconds)]
+        self.lock = threading.Lock()
+
+    def analyze(self, client, rng, tag):
+        body, content_type = multipart({}, 'doc.txt', build_document('v1', rng.choice(self.sizes), tag))
+        status, data = client.request('POST', '/analyze', body, {'Content-Type': content_type})
+        if status == 200:
+            doc_id = json.loads(data)['doc_id']
+            with self.lock:
+                self.doc_ids.append(doc_id)
+        return status
+
+    def re_audit(self, client, rng, tag):
+        with self.lock:
+            doc_id = rng.choice(self.doc_ids) if self.doc_ids else None
+        if doc_id is None:
+            return self.analyze(client, rng, tag)
+        document = build_document(rng.choice(('v1', 'v2')), rng.choice(self.sizes), tag)
+        body, content_type = multipart({'doc_id': doc_id}, 'doc.txt', document)
+        return client.request('POST', '/re_audit', body, {'Content-Type': content_type})[0]
+
+    def history(self, client, rng, tag):
+        with self.lock:
+            doc_id = rng.choice(self.doc_ids) if self.doc_ids else None
+        if doc_id is None:
+            return self.analyze(client, rng, tag)
+        return client.request('GET', f'/history/{doc_id}?limit=20')[0]
+
+    def seed_documents(self, count):
+        client = Client(self.url, self.timeout)
+        rng = random.Random(self.seed)
+        try:
+            for index in range(count):
+                self.analyze(client, rng, f"seed {index}")
+        finally:
+            client.close()
+
+    def run(self, concurrency, duration):
+        operations = list(self.mix)
+        weights = [self.mix[op] for op in operations]
+        deadline = time.perf_counter() + duration
+
+        def worker(index):
+            rng = random.Random(f"{self.seed}-{index}")
+            client = Client(self.url, self.timeout)
+            count = 0
+            try:
+                while time.perf_counter() < deadline:
+                    op = rng.choices(operations, weights)[0]
+                    count += 1
+                    start = time.perf_counter()
+                    try:
+                        status = getattr(self, op)(client, rng, f"worker {index} request {count}")
+                    except (ValueError, KeyError):
+                        status = -1  # a 200 whose body couldn't be used
+                    elapsed = time.perf_counter() - start
+                    with self.lock:
+                        self.results[op].append((status, elapsed))
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=worker, args=(i,), name=f'load-{i}', daemon=True)
+                   for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(p * len(values) / 100) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds for _, seconds in samples)
+    statuses = {}
+    for status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [seconds for status, seconds in samples if status == 200]
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'statuses': statuses,
+        'throughput_rps': len(ok) / elapsed if elapsed else 0.0,
+        'latency_s': {
+            'mean': statistics.fmean(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+
+
+def database_bytes(path):
+    """
+    Size of an SQLite database, or None. The WAL is checkpointed first, so
+    pages written to it aren't counted twice; this is safe while the
+    server is running, though it may wait briefly for its writes.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def peak_rss_bytes(pid):
+    """Peak resident set size of a process (Linux), or None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30):
+    client = Client(url, 5)
+    deadline = time.time() + timeout
+    try:
+        while time.time() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"the server exited with status {process.returncode}")
+            if client.request('GET', '/jobs')[0] == 200:
+                return
+            time.sleep(0.1)
+    finally:
+        client.close()
+    raise RuntimeError(f"the server at {url} didn't come up within {timeout} s")
+
+
+def serve(args):
+    """Run the app for a load test; started by main() in a child process"""
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no line per request
+    app = create_app({'DEBUG': False, 'CACHE_ENABLED': args.cache})
+    server = make_server('127.0.0.1', args.serve, app, threaded=True)
+    server.serve_forever()
+
+
+def compare(baseline, result):
+    """Lines comparing result with an earlier run, per operation"""
+    lines = []
+    for op, now in result['operations'].items():
+        then = baseline.get('operations', {}).get(op)
+        if not then:
+            continue
+        changes = [f"throughput {now['throughput_rps']:.2f} rps ({_change(then['throughput_rps'], now['throughput_rps'])})"]
+        for p in ('p50', 'p95', 'p99'):
+            a, b = then['latency_s'].get(p), now['latency_s'].get(p)
+            if a is not None and b is not None:
+                changes.append(f"{p} {b * 1000:.0f} ms ({_change(a, b)})")
+        lines.append(f"  {op:<9} " + "  ".join(changes))
+    return lines
+
+
+def _change(before, after):
+    return f"{(after - before) / before:+.1%}" if before else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of load")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('analyze=2,re_audit=1,history=4'),
+                        help="weights of analyze, re_audit and history requests")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[2, 8], help="document sizes in kB")
+    parser.add_argument('--seed-docs', type=int, default=10, help="documents analyzed before the load starts")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for the request sequence")
+    parser.add_argument('--timeout', type=float, default=300.0, help="client timeout per request")
+    parser.add_argument('--backend', choices=('openai', 'local', 'tiered'), default='openai')
+    parser.add_argument('--schema', choices=('full', 'compact'), default='full', help="ANALYSIS_SCHEMA")
+    parser.add_argument('--cache', action='store_true', help="leave the analysis cache on")
+    fake = parser.add_argument_group('fake OpenAI server')
+    fake.add_argument('--latency', type=float, default=0.5, help="seconds per call")
+    fake.add_argument('--jitter', type=float, default=0.1, help="+/- seconds of random latency")
+    fake.add_argument('--tokens-per-second', type=float, default=0.0, help="generation rate, 0 for instant")
+    fake.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls that fail")
+    fake.add_argument('--error-status', type=int, default=429)
+    fake.add_argument('--retry-after', type=float, default=None)
+    parser.add_argument('--url', help="load an already running server instead of starting one")
+    parser.add_argument('--db', help="its database, for the growth figures (with --url)")
+    parser.add_argument('--pid', type=int, help="its process id, for the peak RSS (with --url)")
+    parser.add_argument('--output', default='-', help="JSON results file, - for stdout")
+    parser.add_argument('--baseline', help="results of an earlier run to compare with")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    with tempfile.TemporaryDirectory() as directory, FakeOpenAIServer(
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+            error_status=args.error_status, retry_after=args.retry_after,
+            token_interval=1 / args.tokens_per_second if args.tokens_per_second else 0.0) as fake_openai:
+        process = None
+        url, db_path, pid = args.url, args.db, args.pid
+        if url is None:
+            db_path = os.path.join(directory, 'loadtest.db')
+            port = free_port()
+            env = dict(os.environ, OPENAI_API_KEY='fake', OPENAI_BASE_URL=fake_openai.base_url,
+                       AUDIT_DB_PATH=db_path, ANALYZER_BACKEND=args.backend, ANALYSIS_SCHEMA=args.schema)
+            command = [sys.executable, '-m', 'benchmarks.loadtest', '--serve', str(port)]
+            if args.cache:
+                command.append('--cache')
+            process = subprocess.Popen(command, cwd=ROOT, env=env)
+            pid = process.pid
+            url = f"http://127.0.0.1:{port}"
+        try:
+            wait_until_up(url, process)
+            generator = LoadGenerator(url, args.mix, args.sizes, args.seed, args.timeout)
+            generator.seed_documents(args.seed_docs)
+            db_before = database_bytes(db_path)
+            calls_before = len(fake_openai.requests)
+            usage_before = {kind: collections.Counter(usage) for kind, usage in fake_openai.usage.items()}
+            elapsed = generator.run(args.concurrency, args.duration)
+            rss = peak_rss_bytes(pid) if pid else None
+            db_after = database_bytes(db_path)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(10)
+
+        all_samples = [sample for samples in generator.results.values() for sample in samples]
+        stored = sum(1 for op in ('analyze', 're_audit') for status, _ in generator.results[op] if status == 200)
+        result = {
+            'config': {
+                'concurrency': args.concurrency, 'duration_s': args.duration, 'mix': args.mix,
+                'sizes_kb': args.sizes, 'seed_docs': args.seed_docs, 'seed': args.seed,
+                'backend': args.backend, 'schema': args.schema, 'cache': args.cache,
+                'latency_s': args.latency, 'jitter_s': args.jitter, 'tokens_per_second': args.tokens_per_second,
+                'error_rate': args.error_rate, 'error_status': args.error_status, 'url': args.url,
+            },
+            'elapsed_s': elapsed,
+            'total': summarize(all_samples, elapsed),
+            'operations': {op: summarize(samples, elapsed) for op, samples in generator.results.items() if samples},
+            'database': {
+                'bytes_before': db_before,
+                'bytes_after': db_after,
+                'growth_bytes': db_after - db_before if db_before is not None and db_after is not None else None,
+                'revisions_stored': stored,
+                'bytes_per_revision': (db_after - db_before) / stored if stored and db_before is not None
+                and db_after is not None else None,
+            },
+            'server_peak_rss_bytes': rss,
+            'loadgen_peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'fake_openai': {
+                'calls': len(fake_openai.requests) - calls_before,
+                'injected_errors': {str(status): count for status, count in fake_openai.errors.items()},
+                'usage': {kind: dict(usage - usage_before.get(kind, collections.Counter()))
+                          for kind, usage in fake_openai.usage.items()},
+            },
+        }
+
+    text = json.dumps(result, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+    total = result['total']
+    print(f"{total['requests']} requests in {elapsed:.1f} s, {total['throughput_rps']:.2f} ok/s, "
+          f"{total['errors']} errors", file=sys.stderr)
+    for op, summary in result['operations'].items():
+        latency = summary['latency_s']
+        print(f"  {op:<9} {summary['throughput_rps']:7.2f} rps  p50 {latency['p50'] * 1000:7.0f} ms  "
+              f"p95 {latency['p95'] * 1000:7.0f} ms  p99 {latency['p99'] * 1000:7.0f} ms  "
+              f"statuses {summary['statuses']}", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"compared with {args.baseline}:", file=sys.stderr)
+        for line in compare(baseline, result):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,23 @@
 import io
+import os
 import pytest
 from datetime import datetime, timezone
 from app import app
 from app.utils.storage import DatabaseConnection
 import sqlite3
 
+@pytest.fixture(scope='session')
+def fake_openai():
+    """A local stand-in for the OpenAI API, so no test depends on the network"""
+    from benchmarks.fake_openai import FakeOpenAIServer
+    with FakeOpenAIServer() as server:
+        yield server
+
 @pytest.fixture
-def client():
+def client(fake_openai, monkeypatch):
+    from openai import OpenAI
+    from app.utils import analyzer
+    monkeypatch.setattr(analyzer, 'client', OpenAI(base_url=fake_openai.base_url, api_key='fake', max_retries=0))
     with app.test_client() as client:
         yield client
 
@@ -15,10 +26,11 @@ def db():
     """Database fixture for tests"""
     db = DatabaseConnection()
     yield db
-    # Clean up test database after each test
-    import os
-    if os.path.exists(db.db_path):
-        os.remove(db.db_path)
+    # Clean up test database after each test, including the WAL side files
+    db.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db.db_path + suffix):
+            os.remove(db.db_path + suffix)
 
 class TestAnalyzeEndpoint:
     def test_analyze_endpoint_success(self, client):
@@ -221,4 +233,2201 @@ class TestIntegration:
         assert response.status_code == 200
         history = response.get_json()['revisions']
         assert len(history) == 2
-        assert history[-1]['revision_number'] == 2
\ No newline at end of file
+        assert history[-1]['revision_number'] == 2
+
+class TestAnalysisPipeline:
+    def test_run_analysis_is_concurrent(self, monkeypatch):
+        """Both OpenAI calls should overlap instead of running back to back"""
+        import time
+        from app.utils import analyzer
+
+        def slow_analysis(text):
+            time.sleep(0.3)
+            return {"detected_hazards": [text]}
+
+        def slow_revision(text):
+            time.sleep(0.3)
+            return text + "\nRecommendation: test"
+
+        monkeypatch.setattr(analyzer, 'analyze_document', slow_analysis)
+        monkeypatch.setattr(analyzer, 'generate_revised_document', slow_revision)
+
+        start = time.perf_counter()
+        analysis, revised, _ = analyzer.run_analysis("Fire risk.")
+        elapsed = time.perf_counter() - start
+
+        assert analysis["detected_hazards"] == ["Fire risk."]
+        assert revised == "Fire risk.\nRecommendation: test"
+        assert elapsed < 0.5
+
+    def test_run_analysis_keeps_error_semantics(self, monkeypatch):
+        """Failures still surface as the error dict and error string"""
+        from app.utils import analyzer
+
+        monkeypatch.setattr(analyzer, 'analyze_document',
+                            lambda text: {"error": "Analysis failed: boom", "raw_response": None})
+        monkeypatch.setattr(analyzer, 'generate_revised_document',
+                            lambda text: "Error generating revision: boom")
+
+        analysis, revised, sections = analyzer.run_analysis("text")
+        assert analysis["error"] == "Analysis failed: boom"
+        assert revised == "Error generating revision: boom"
+        assert sections == []
+
+
+class FakeCompletions:
+    """
+    Stands in for client.chat.completions and counts calls. JSON-mode calls
+    get content, other calls get revision (or content if it isn't given).
+    Streamed responses arrive a few characters at a time.
+    """
+    def __init__(self, content, revision=None):
+        self.content = content
+        self.revision = revision
+        self.calls = 0
+
+    def create(self, stream=False, **kwargs):
+        from types import SimpleNamespace
+        self.calls += 1
+        content = self.content
+        if self.revision is not None and 'response_format' not in kwargs:
+            content = self.revision
+        if stream:
+            return [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + 3]))])
+                for i in range(0, len(content), 3)
+            ]
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class TestAnalysisCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        from app.utils.cache import AnalysisCache
+        return AnalysisCache(db=DatabaseConnection(str(tmp_path / 'cache.db')))
+
+    def test_key_ignores_whitespace_noise(self, cache):
+        """Line endings and trailing spaces don't change the key"""
+        assert cache.make_key('analysis', "a \r\nb\n", 'gpt') == cache.make_key('analysis', "a\nb", 'gpt')
+        assert cache.make_key('analysis', "a\nb", 'gpt') != cache.make_key('analysis', "a\nb", 'other-model')
+
+    def test_hit_miss_counters(self, cache):
+        """Memory and disk hits are counted separately from misses"""
+        assert cache.get('k') is None
+        cache.set('k', {"detected_hazards": ["fire"]})
+        assert cache.get('k') == {"detected_hazards": ["fire"]}
+        cache.clear()
+        assert cache.get('k') == {"detected_hazards": ["fire"]}
+        stats = cache.stats()
+        assert stats['misses'] == 1
+        assert stats['memory_hits'] == 1
+        assert stats['disk_hits'] == 1
+
+    def test_ttl_expiry(self, cache):
+        """Entries older than the TTL are treated as misses"""
+        cache.set('k', "value")
+        cache.ttl_seconds = -1
+        assert cache.get('k') is None
+
+    def test_size_eviction(self, cache):
+        """The persistent tier evicts least recently used entries beyond max_bytes"""
+        cache.max_bytes = 250
+        for i in range(5):
+            cache.set(f'k{i}', "x" * 100)
+        cache.clear()
+        assert cache.get('k0') is None
+        assert cache.get('k4') == "x" * 100
+        assert cache.stats()['evictions'] == 3
+
+    def test_disk_hits_rarely_write(self, cache):
+        """A hit only rewrites last_access once the stored one is older than access_resolution"""
+        import time
+        cache.set('k', "value")
+        with cache.db.connection() as conn:
+            conn.execute('UPDATE llm_cache SET last_access = 0')
+
+        def last_access():
+            with cache.db.connection() as conn:
+                return conn.execute('SELECT last_access FROM llm_cache').fetchone()[0]
+
+        cache.clear()
+        assert cache.get('k') == "value"
+        touched = last_access()
+        assert time.time() - touched < 60
+        cache.clear()
+        cache.get('k')
+        assert last_access() == touched
+
+    def test_analyze_document_replays_cached_result(self, cache, monkeypatch):
+        """A second identical submission doesn't call OpenAI again"""
+        from types import SimpleNamespace
+        from app.utils import analyzer
+
+        completions = FakeCompletions('{"detected_hazards": ["Fire risk."]}')
+        monkeypatch.setattr(analyzer, 'cache', cache)
+        monkeypatch.setattr(analyzer, 'client', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+        first = analyzer.analyze_document("Fire risk is evident.")
+        second = analyzer.analyze_document("Fire risk is evident.\n")
+        assert first == second == {"detected_hazards": ["Fire risk."]}
+        assert completions.calls == 1
+
+    def test_errors_are_not_cached(self, cache, monkeypatch):
+        """Failed analyses are retried on the next submission"""
+        from types import SimpleNamespace
+        from app.utils import analyzer
+
+        completions = FakeCompletions('not json')
+        monkeypatch.setattr(analyzer, 'cache', cache)
+        monkeypatch.setattr(analyzer, 'client', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+        assert 'error' in analyzer.analyze_document("Fire risk.")
+        assert 'error' in analyzer.analyze_document("Fire risk.")
+        assert completions.calls == 2
+
+
+MOCK_DOC_PATH = os.path.join(os.path.dirname(__file__), '..', 'mock_doc.txt')
+
+
+class TestIncrementalReAudit:
+    @pytest.fixture
+    def mock_doc(self):
+        with open(MOCK_DOC_PATH) as f:
+            return f.read()
+
+    @pytest.fixture
+    def calls(self, monkeypatch):
+        """Replace both OpenAI calls with fakes that record the text they were given"""
+        from app.utils import analyzer
+        calls = []
+
+        def fake_analysis(text):
+            calls.append(text)
+            return {"detected_hazards": [text.split('\n')[0]], "regulatory_comments": {}}
+
+        monkeypatch.setattr(analyzer, 'analyze_document', fake_analysis)
+        monkeypatch.setattr(analyzer, 'generate_revised_document', lambda text: text)
+        return calls
+
+    def test_split_sections_round_trips(self, mock_doc):
+        """Numbered sections are found and the title stays with section 1"""
+        from app.utils.sections import split_sections
+        sections = split_sections(mock_doc)
+        assert len(sections) == 7
+        assert sections[0]['text'].startswith("Safety Procedure Document - Draft")
+        assert sections[1]['heading'] == "2. Hazard Identification:"
+        assert "".join(section['text'] for section in sections) == mock_doc
+
+    def test_small_document_is_one_request(self, mock_doc, calls):
+        """Short sections are packed together rather than analyzed one by one"""
+        from app.utils import analyzer
+        analysis, _, sections = analyzer.run_analysis(mock_doc)
+        assert calls == [mock_doc]
+        assert len(sections) == 1
+        assert analysis['original_text'] == mock_doc
+
+    def test_only_changed_sections_are_analyzed(self, mock_doc, calls, monkeypatch):
+        """Unchanged chunks reuse the previous revision's results"""
+        from app.config import Config
+        from app.utils import analyzer
+        monkeypatch.setattr(Config, 'ANALYSIS_CHUNK_TOKENS', 120)
+        _, _, sections = analyzer.run_analysis(mock_doc)
+        assert len(calls) == 7
+
+        previous = {s['fingerprint']: {'analysis': s['analysis'], 'revised_text': s['revised_text']} for s in sections}
+        edited = mock_doc.replace("outdated electrical wiring", "exposed electrical wiring")
+        calls.clear()
+        analysis, _, _ = analyzer.run_analysis(edited, previous)
+
+        assert len(calls) == 1
+        assert calls[0].startswith("2. Hazard Identification:")
+        assert len(analysis['detected_hazards']) == 7
+        assert analysis['original_text'] == edited
+
+    def test_sections_are_stored_with_revision(self, db, mock_doc, calls):
+        """store_revision persists per-section results for the next re-audit"""
+        from app.utils import analyzer
+        analysis, revised, sections = analyzer.run_analysis(mock_doc)
+        db.store_revision("test-doc-id", {
+            'revision_number': 1,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'original_text': mock_doc,
+            'analysis': analysis,
+            'revised_document': revised,
+            'diff': None
+        }, sections)
+
+        stored = db.get_revision_sections("test-doc-id", 1)
+        assert set(stored) == {s['fingerprint'] for s in sections}
+        assert db.get_revision_sections("test-doc-id", 2) == {}
+
+
+class TestChunkedAnalysis:
+    def test_split_chunks_respects_budget(self):
+        """Oversized sections are split on paragraph boundaries and round-trip exactly"""
+        from app.utils.sections import split_chunks, CHARS_PER_TOKEN
+        paragraph = "Exposed wiring near the press. " * 20 + "\n\n"
+        text = "1. Hazards:\n" + paragraph * 30 + "2. Training:\nShort section.\n"
+        chunks = split_chunks(text, max_tokens=400)
+
+        assert "".join(chunk['text'] for chunk in chunks) == text
+        assert all(len(chunk['text']) <= 400 * CHARS_PER_TOKEN for chunk in chunks)
+        assert len(chunks) > 2
+        assert chunks[0]['heading'] == "1. Hazards:"
+        assert chunks[-1]['text'].endswith("Short section.\n")
+
+    def test_split_chunks_boundaries_survive_insertions(self):
+        """Inserting a section in a long document leaves most chunk fingerprints intact"""
+        from app.utils.sections import split_chunks
+        sections = [f"{i}. Area {i}:\nFire extinguisher {i} is blocked by pallets.\n\n" for i in range(1, 400)]
+        before = split_chunks("".join(sections), max_tokens=300)
+        sections.insert(200, "200. New area:\nA forklift lane crosses the walkway.\n\n")
+        after = split_chunks("".join(sections), max_tokens=300)
+
+        unchanged = {c['fingerprint'] for c in before} & {c['fingerprint'] for c in after}
+        assert len(unchanged) >= len(before) - 3
+
+    def test_split_chunks_cuts_unbroken_text(self):
+        """Text with no usable boundary is still cut to fit"""
+        from app.utils.sections import split_chunks
+        chunks = split_chunks("x" * 1000, max_tokens=50)
+        assert [len(chunk['text']) for chunk in chunks] == [200] * 5
+
+    def test_merge_deduplicates_findings(self):
+        """Findings repeated across chunks appear once, in document order"""
+        from app.utils.sections import merge_analyses
+        merged = merge_analyses([
+            {"detected_hazards": ["Fire risk.", "Slippery floor"], "regulatory_comments": {"OSHA": "Mitigate hazards"}},
+            {"detected_hazards": ["fire  risk", "Exposed wiring"], "regulatory_comments": {"OSHA": "Train staff"}},
+        ], "doc")
+        assert merged["detected_hazards"] == ["Fire risk.", "Slippery floor", "Exposed wiring"]
+        assert merged["regulatory_comments"] == {"OSHA": "Mitigate hazards; Train staff"}
+        assert merged["original_text"] == "doc"
+
+    def test_calls_in_flight_are_bounded(self, monkeypatch):
+        """A long document never has more than ANALYSIS_MAX_CALLS_IN_FLIGHT calls running"""
+        import threading
+        import time
+        from app.config import Config
+        from app.utils import analyzer
+
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def tracked(result):
+            def call(text):
+                with lock:
+                    state['running'] += 1
+                    state['peak'] = max(state['peak'], state['running'])
+                time.sleep(0.01)
+                with lock:
+                    state['running'] -= 1
+                return result
+            return call
+
+        monkeypatch.setattr(Config, 'ANALYSIS_CHUNK_TOKENS', 50)
+        monkeypatch.setattr(Config, 'ANALYSIS_MAX_CALLS_IN_FLIGHT', 4)
+        monkeypatch.setattr(analyzer, 'analyze_document', tracked({"detected_hazards": ["Fire"]}))
+        monkeypatch.setattr(analyzer, 'generate_revised_document', tracked("revised"))
+
+        analysis, _, sections = analyzer.run_analysis("A sentence about fire. " * 200)
+        assert len(sections) > 10
+        assert state['peak'] <= 4
+        assert analysis["detected_hazards"] == ["Fire"]
+
+
+class TestAsyncJobs:
+    @pytest.fixture
+    def queue(self, tmp_path, monkeypatch):
+        """Routes backed by a temporary database, a fake analyzer and an 8-worker queue"""
+        import time
+        from app.routes import audit_routes
+        from app.utils.jobs import JobQueue
+
+        def fake_run_analysis(text, previous_sections=None, on_event=None):
+            time.sleep(0.05)
+            return {"detected_hazards": [text]}, text, []
+
+        test_db = DatabaseConnection(str(tmp_path / 'jobs.db'))
+        queue = JobQueue(test_db, {
+            'analyze': audit_routes.process_analysis,
+            're_audit': audit_routes.process_re_audit
+        }, workers=8, max_depth=500, poll_interval=0.1)
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        monkeypatch.setattr(audit_routes, 'job_queue', queue)
+        monkeypatch.setattr(audit_routes, 'run_analysis', fake_run_analysis)
+        yield queue
+        queue.stop()
+
+    def wait_for(self, client, job_id, timeout=10):
+        import time
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = client.get(f'/jobs/{job_id}').get_json()
+            if job['status'] in ('completed', 'failed'):
+                return job
+            time.sleep(0.02)
+        raise AssertionError(f"job {job_id} did not finish")
+
+    def test_async_analyze_returns_job(self, client, queue):
+        """?async=true returns 202 and the job reports the normal response"""
+        queue.start()
+        data = {'document': (io.BytesIO(b"Fire risk."), 'test.txt')}
+        response = client.post('/analyze?async=true', data=data, content_type='multipart/form-data')
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert response.headers['Location'].endswith(f'/jobs/{job_id}')
+
+        job = self.wait_for(client, job_id)
+        assert job['status'] == 'completed'
+        assert job['status_code'] == 200
+        assert job['result']['revision']['analysis'] == {"detected_hazards": ["Fire risk."]}
+
+    def test_async_re_audit_unknown_document(self, client, queue):
+        """Unknown documents are rejected before a job is queued"""
+        data = {'doc_id': 'invalid-id', 'async': 'true', 'document': (io.BytesIO(b"x"), 'test.txt')}
+        response = client.post('/re_audit', data=data, content_type='multipart/form-data')
+        assert response.status_code == 404
+
+    def test_queue_depth_limit(self, client, queue):
+        """Submissions beyond the depth limit are refused"""
+        from app.utils.jobs import QueueFullError
+        queue.max_depth = 2
+        queue.submit('analyze', {'content': "one"})
+        queue.submit('analyze', {'content': "two"})
+        with pytest.raises(QueueFullError):
+            queue.submit('analyze', {'content': "three"})
+        metrics = queue.metrics()
+        assert metrics['rejected'] == 1
+        assert metrics['queued'] == 2
+
+        data = {'document': (io.BytesIO(b"Fire risk."), 'test.txt')}
+        queue.max_depth = 0
+        response = client.post('/analyze?async=1', data=data, content_type='multipart/form-data')
+        assert response.status_code == 429
+        assert 'Retry-After' in response.headers
+
+    def test_jobs_survive_restart(self, queue):
+        """Jobs left running by a dead process are requeued and finished"""
+        import time
+        job_id = queue.submit('analyze', {'content': "Fire risk."})
+        assert queue.db.claim_next_job(time.time()) is not None  # the "crashed" worker took it
+        assert queue.get(job_id)['status'] == 'running'
+
+        queue.start()
+        deadline = time.time() + 5
+        while queue.get(job_id)['status'] != 'completed' and time.time() < deadline:
+            time.sleep(0.02)
+        assert queue.get(job_id)['status'] == 'completed'
+
+    def test_expired_leases_are_requeued(self, queue):
+        """Jobs whose lease ran out are taken over; jobs with a live lease are left alone"""
+        import time
+        expired = queue.submit('analyze', {'content': "Expired."})
+        queue.db.claim_next_job(time.time(), 'dead-process', time.time() - 1)
+        leased = queue.submit('analyze', {'content': "Leased."})
+        queue.db.claim_next_job(time.time(), 'live-process', time.time() + 60)
+
+        queue.start()
+        deadline = time.time() + 5
+        while queue.get(expired)['status'] != 'completed' and time.time() < deadline:
+            time.sleep(0.02)
+        assert queue.get(expired)['status'] == 'completed'
+        assert queue.get(leased)['status'] == 'running'
+
+    def test_queues_sharing_a_database_run_each_job_once(self, tmp_path):
+        """A queue starting in another process doesn't requeue a job that is still running"""
+        import threading
+        import time
+        from app.utils.jobs import JobQueue
+        path = str(tmp_path / 'shared.db')
+        runs = []
+        release = threading.Event()
+
+        def handler(content):
+            runs.append(content)
+            release.wait(5)
+            return {}, 200
+
+        first = JobQueue(DatabaseConnection(path), {'analyze': handler}, workers=1, poll_interval=0.05,
+                         lease_seconds=0.3)
+        second = JobQueue(DatabaseConnection(path), {'analyze': handler}, workers=1, poll_interval=0.05,
+                          lease_seconds=0.3)
+        job_id = first.submit('analyze', {'content': "Fire risk."})
+        first.start()
+        try:
+            deadline = time.time() + 5
+            while first.get(job_id)['status'] != 'running' and time.time() < deadline:
+                time.sleep(0.01)
+            second.start()
+            time.sleep(1.0)  # a few lease periods, renewed by the first queue
+            assert second.get(job_id)['status'] == 'running'
+            release.set()
+            while first.get(job_id)['status'] != 'completed' and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            release.set()
+            first.stop()
+            second.stop()
+        assert first.get(job_id)['status'] == 'completed'
+        assert runs == ["Fire risk."]
+
+    def test_error_responses_fail_the_job(self, tmp_path):
+        """A handler's non-2xx response is recorded as a failed job"""
+        import time
+        from app.utils.jobs import JobQueue
+        queue = JobQueue(DatabaseConnection(str(tmp_path / 'jobs.db')),
+                         {'re_audit': lambda **payload: ({'error': 'Conflict'}, 409)}, workers=1, poll_interval=0.05)
+        job_id = queue.submit('re_audit', {})
+        queue.start()
+        try:
+            deadline = time.time() + 5
+            while queue.get(job_id)['status'] in ('queued', 'running') and time.time() < deadline:
+                time.sleep(0.02)
+        finally:
+            queue.stop()
+        job = queue.get(job_id)
+        assert (job['status'], job['status_code'], job['result']) == ('failed', 409, {'error': 'Conflict'})
+        assert queue.metrics()['failed'] == 1
+
+    def test_finished_jobs_expire(self, tmp_path):
+        """Jobs finished longer than retention_seconds ago are deleted; newer and unfinished ones stay"""
+        import time
+        from app.utils.jobs import JobQueue
+        db = DatabaseConnection(str(tmp_path / 'jobs.db'))
+        now = time.time()
+        for job_id, finished_at in (('old', now - 120), ('recent', now - 10), ('waiting', None)):
+            db.create_job(job_id, 'analyze', '{}', now - 200, 10)
+            if finished_at is not None:
+                db.finish_job(job_id, 'completed', '{}', 200, finished_at)
+        queue = JobQueue(db, {'analyze': lambda **payload: ({}, 200)}, workers=0, retention_seconds=60)
+        queue.start()
+        queue.stop()
+        assert [queue.get(job_id) is not None for job_id in ('old', 'recent', 'waiting')] == [False, True, True]
+
+    def test_app_resumes_jobs_on_start(self, tmp_path, monkeypatch):
+        """Jobs persisted before a restart run without waiting for an async request"""
+        import time
+        from app import create_app
+        from app.routes import audit_routes
+        monkeypatch.setattr(audit_routes, 'run_analysis',
+                            lambda text, previous_sections=None, on_event=None: ({"detected_hazards": [text]}, text, []))
+        path = str(tmp_path / 'restart.db')
+        DatabaseConnection(path).create_job('left-over', 'analyze', '{"content": "Fire risk."}', time.time(), 10)
+        queue = create_app({'DATABASE_PATH': path, 'JOB_POLL_INTERVAL': 0.05}).extensions['audit']['job_queue']
+        try:
+            deadline = time.time() + 5
+            while queue.get('left-over')['status'] != 'completed' and time.time() < deadline:
+                time.sleep(0.02)
+        finally:
+            queue.stop()
+        assert queue.get('left-over')['status'] == 'completed'
+
+    def test_concurrent_submission_throughput(self, queue):
+        """Many concurrent submissions are processed in parallel by the worker pool"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        def submit(i):
+            with app.test_client() as c:
+                data = {'document': (io.BytesIO(f"Document {i}".encode()), 'test.txt')}
+                response = c.post('/analyze?async=true', data=data, content_type='multipart/form-data')
+                assert response.status_code == 202
+                return response.get_json()['job_id']
+
+        queue.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            job_ids = list(pool.map(submit, range(80)))
+        while queue.metrics()['completed'] < len(job_ids) and time.perf_counter() - start < 10:
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - start
+
+        metrics = queue.metrics()
+        assert metrics['completed'] == 80
+        assert metrics['failed'] == 0
+        # 80 jobs x 50 ms run serially would take 4 s; 8 workers should be far quicker
+        assert elapsed < 2.0
+        assert all(queue.get(job_id)['status'] == 'completed' for job_id in job_ids)
+
+
+class TestBatchAnalysis:
+    @pytest.fixture
+    def batch_db(self, tmp_path, monkeypatch):
+        """Batch route backed by a temporary database and a fake analyzer"""
+        from app.routes import audit_routes
+
+        def fake_run_analysis(text, previous_sections=None, on_event=None):
+            return {"detected_hazards": [text]}, text, []
+
+        test_db = DatabaseConnection(str(tmp_path / 'batch.db'))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        monkeypatch.setattr(audit_routes, 'run_analysis', fake_run_analysis)
+        return test_db
+
+    def parse(self, response):
+        import json
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_multipart_batch(self, client, batch_db):
+        """Each file gets its own result line and bad files don't stop the batch"""
+        data = {'documents': [
+            (io.BytesIO(b"Fire risk."), 'a.txt'),
+            (io.BytesIO(b"\x00\x01"), 'b.dat'),
+            (io.BytesIO(b"Exposed wiring."), 'c.txt'),
+        ]}
+        lines = self.parse(client.post('/analyze/batch', data=data, content_type='multipart/form-data'))
+
+        results = {line['filename']: line for line in lines[:-1]}
+        assert results['b.dat']['error'] == 'Could not read file content'
+        assert results['a.txt']['revision']['analysis'] == {"detected_hazards": ["Fire risk."]}
+        assert lines[-1]['batch'] == {'documents': 3, 'analyzed': 2, 'failed': 1, 'stored': 2}
+
+        history = batch_db.get_revision_history(results['c.txt']['doc_id'])
+        assert history[0]['original_text'] == "Exposed wiring."
+
+    def test_zip_batch(self, client, batch_db):
+        """Zip uploads are expanded into their entries"""
+        import zipfile
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('procedures/one.txt', "Fire risk.")
+            zf.writestr('procedures/two.txt', "No PPE.")
+            zf.writestr('__MACOSX/procedures/._one.txt', "junk")
+        archive.seek(0)
+        data = {'documents': (archive, 'facility.zip')}
+        lines = self.parse(client.post('/analyze/batch', data=data, content_type='multipart/form-data'))
+
+        assert sorted(line['filename'] for line in lines[:-1]) == ['procedures/one.txt', 'procedures/two.txt']
+        assert lines[-1]['batch']['stored'] == 2
+
+    def test_batch_documents_are_held_to_the_upload_limit(self, client, batch_db, monkeypatch):
+        """Zip entries and NDJSON records over MAX_DOCUMENT_BYTES are rejected like single uploads"""
+        import json
+        import zipfile
+        monkeypatch.setitem(app.config, 'MAX_DOCUMENT_BYTES', 1000)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('bomb.txt', "x" * 100000)
+            zf.writestr('small.txt', "Fire risk.")
+        assert len(archive.getvalue()) < 1000
+        archive.seek(0)
+        lines = self.parse(client.post('/analyze/batch', data={'documents': (archive, 'bomb.zip')},
+                                       content_type='multipart/form-data'))
+        results = {line['filename']: line for line in lines[:-1]}
+        assert results['bomb.txt']['error'] == 'Document too large (limit 1000 bytes)'
+        assert 'doc_id' in results['small.txt']
+        assert lines[-1]['batch'] == {'documents': 2, 'analyzed': 1, 'failed': 1, 'stored': 1}
+
+        body = "\n".join(json.dumps({'filename': name, 'content': content})
+                         for name, content in (('big.txt', "y" * 2000), ('bad.txt', "\ud800"), ('ok.txt', "No PPE.")))
+        lines = self.parse(client.post('/analyze/batch', data=body, content_type='application/x-ndjson'))
+        results = {line['filename']: line for line in lines[:-1]}
+        assert results['big.txt']['error'] == 'Document too large (limit 1000 bytes)'
+        assert results['bad.txt']['error'] == 'Could not read file content'
+        assert lines[-1]['batch']['stored'] == 1
+
+    def test_ndjson_batch(self, client, batch_db):
+        """An NDJSON body of filename/content records is accepted"""
+        import json
+        body = "\n".join([
+            json.dumps({'filename': 'one.txt', 'content': "Fire risk."}),
+            "not json",
+            json.dumps({'filename': 'two.txt', 'content': "No PPE."}),
+        ])
+        lines = self.parse(client.post('/analyze/batch', data=body, content_type='application/x-ndjson'))
+        assert lines[-1]['batch'] == {'documents': 3, 'analyzed': 2, 'failed': 1, 'stored': 2}
+
+    def test_documents_are_read_as_workers_free_up(self, client, batch_db, monkeypatch):
+        """A batch isn't decoded up front: at most BATCH_MAX_WORKERS documents are read ahead"""
+        import json
+        from app.routes import audit_routes
+        monkeypatch.setitem(app.config, 'BATCH_MAX_WORKERS', 2)
+        reads = []
+        read_ahead = []
+
+        def counting_read_text(stream, max_bytes=None):
+            text = read_text(stream, max_bytes)
+            reads.append(text)
+            return text
+
+        def fake_run_analysis(text, previous_sections=None, on_event=None):
+            read_ahead.append(len(reads) - reads.index(text))
+            return {"detected_hazards": [text]}, text, []
+
+        read_text = audit_routes.read_text
+        monkeypatch.setattr(audit_routes, 'read_text', counting_read_text)
+        monkeypatch.setattr(audit_routes, 'run_analysis', fake_run_analysis)
+        body = "\n".join(json.dumps({'filename': f'{i}.txt', 'content': f"Hazard {i}."}) for i in range(10))
+        lines = self.parse(client.post('/analyze/batch', data=body, content_type='application/x-ndjson'))
+        assert lines[-1]['batch']['stored'] == 10
+        assert len(read_ahead) == 10 and max(read_ahead) <= 2
+
+    def test_doc_ids_are_sent_once_stored(self, client, batch_db, monkeypatch):
+        """A document whose rows couldn't be committed is reported as failed, without a doc_id"""
+        def failing_store(items):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(batch_db, 'store_revisions', failing_store)
+        data = {'documents': [(io.BytesIO(b"Fire risk."), 'a.txt'), (io.BytesIO(b"No PPE."), 'b.txt')]}
+        lines = self.parse(client.post('/analyze/batch', data=data, content_type='multipart/form-data'))
+        assert [line['error'] for line in lines[:-1]] == ['Could not store document: database is locked'] * 2
+        assert not any('doc_id' in line for line in lines)
+        assert lines[-1]['batch'] == {'documents': 2, 'analyzed': 2, 'failed': 2, 'stored': 0}
+
+    def test_oversized_batches_are_refused_unread(self, client, batch_db, monkeypatch):
+        """A small zip of compressible entries gets 413 from its central directory alone"""
+        import zipfile
+
+        def refuse(*args, **kwargs):
+            raise AssertionError("an entry was decompressed")
+
+        def bomb(entries, size):
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for number in range(entries):
+                    zf.writestr(f'{number}.txt', "x" * size)
+            assert len(archive.getvalue()) < 128 * 1024
+            archive.seek(0)
+            return {'documents': (archive, 'bomb.zip')}
+
+        many, large = bomb(60, 2 * 1024 * 1024), bomb(3, 2 * 1024 * 1024)
+        monkeypatch.setattr(zipfile.ZipFile, 'open', refuse)
+        monkeypatch.setitem(app.config, 'MAX_DOCUMENT_BYTES', 2 * 1024 * 1024)
+        monkeypatch.setitem(app.config, 'BATCH_MAX_DOCUMENTS', 5)
+        response = client.post('/analyze/batch', data=many, content_type='multipart/form-data')
+        assert response.status_code == 413
+        assert response.get_json()['error'] == 'Too many documents in batch (limit 5)'
+
+        monkeypatch.setitem(app.config, 'BATCH_MAX_BYTES', 4 * 1024 * 1024)
+        response = client.post('/analyze/batch', data=large, content_type='multipart/form-data')
+        assert response.status_code == 413
+        assert response.get_json()['error'] == 'Batch too large (limit 4194304 bytes)'
+
+    def test_too_many_documents(self, client, batch_db, monkeypatch):
+        import json
+        monkeypatch.setitem(app.config, 'BATCH_MAX_DOCUMENTS', 2)
+        body = "\n".join(json.dumps({'filename': f'{i}.txt', 'content': "Fire risk."}) for i in range(3))
+        response = client.post('/analyze/batch', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 413
+
+    def test_empty_batch(self, client, batch_db):
+        response = client.post('/analyze/batch', data={}, content_type='multipart/form-data')
+        assert response.status_code == 400
+
+
+class TestRateLimiter:
+    def make(self, **limits):
+        from app.utils.ratelimit import RateLimiter
+        clock = {'now': 0.0}
+
+        def sleep(seconds):
+            clock['now'] += seconds
+        return RateLimiter(clock=lambda: clock['now'], sleep=sleep, **limits), clock
+
+    def test_requests_per_minute(self):
+        """The 61st request in a minute waits for the bucket to refill"""
+        limiter, clock = self.make(requests_per_minute=60)
+        waits = [limiter.acquire() for _ in range(61)]
+        assert waits[:60] == [0.0] * 60
+        assert waits[60] == pytest.approx(1.0)
+
+    def test_tokens_per_minute(self):
+        """Token budgets throttle large requests"""
+        limiter, clock = self.make(tokens_per_minute=6000)
+        assert limiter.acquire(5000) == 0.0
+        assert limiter.acquire(2000) == pytest.approx(10.0)
+
+    def test_disabled(self):
+        limiter, _ = self.make()
+        assert limiter.acquire(10 ** 9) == 0.0
+
+
+class TestCallScheduler:
+    class Transient(Exception):
+        def __init__(self, retry_after=None):
+            super().__init__("try again")
+            self.retry_after = retry_after
+
+    def make(self, **options):
+        from app.utils.ratelimit import CallScheduler, RateLimiter
+        import random
+        clock = {'now': 0.0}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock['now'] += seconds
+        limiter = RateLimiter(clock=lambda: clock['now'], sleep=sleep)
+        scheduler = CallScheduler(
+            limiter, lambda e: isinstance(e, self.Transient), lambda e: getattr(e, 'retry_after', None),
+            clock=lambda: clock['now'], sleep=sleep, rng=random.Random(0), **options
+        )
+        return scheduler, sleeps
+
+    def flaky(self, failures):
+        """A call that fails transiently the first len(failures) times"""
+        failures = list(failures)
+
+        def call(timeout):
+            if failures:
+                raise failures.pop(0)
+            return "ok"
+        return call
+
+    def test_retries_with_jittered_backoff(self):
+        scheduler, sleeps = self.make(max_retries=4, base_delay=1.0, max_delay=3.0)
+        assert scheduler.call(self.flaky([self.Transient()] * 3), tokens=10) == "ok"
+        assert len(sleeps) == 3
+        for attempt, delay in enumerate(sleeps):
+            assert 0 <= delay <= min(3.0, 2 ** attempt)
+        metrics = scheduler.metrics()
+        assert (metrics['attempts'], metrics['retries'], metrics['succeeded']) == (4, 3, 1)
+        assert metrics['tokens_reserved'] == 40
+
+    def test_retry_after_is_honoured(self):
+        scheduler, sleeps = self.make(base_delay=0.01)
+        scheduler.call(self.flaky([self.Transient(retry_after=7.0)]))
+        assert sleeps == [7.0]
+
+    def test_gives_up_after_max_retries(self):
+        from app.utils.ratelimit import RetriesExhausted
+        scheduler, _ = self.make(max_retries=2, base_delay=0.01)
+        with pytest.raises(RetriesExhausted, match="3 attempts"):
+            scheduler.call(self.flaky([self.Transient()] * 5))
+        assert scheduler.metrics()['gave_up'] == 1
+
+    def test_deadline_bounds_backoff(self):
+        from app.utils.ratelimit import RetriesExhausted
+        scheduler, sleeps = self.make(deadline=10.0)
+        with pytest.raises(RetriesExhausted, match="Deadline"):
+            scheduler.call(self.flaky([self.Transient(retry_after=30.0)]))
+        assert sleeps == []
+
+    def test_other_errors_are_not_retried(self):
+        scheduler, sleeps = self.make()
+        with pytest.raises(ValueError):
+            scheduler.call(self.flaky([ValueError("bad request")]))
+        assert sleeps == [] and scheduler.metrics()['failed'] == 1
+
+    def test_openai_error_classification(self, fake_openai):
+        """Real client errors from the fake server are classified by status"""
+        import openai
+        from app.utils import analyzer
+        client = openai.OpenAI(base_url=fake_openai.base_url, api_key='fake', max_retries=0)
+
+        def error(status, retry_after=None):
+            fake_openai.retry_after = retry_after
+            fake_openai.fail_next(status)
+            try:
+                client.chat.completions.create(model='fake', messages=[{"role": "user", "content": "hi"}])
+            except openai.APIError as e:
+                return e
+            finally:
+                fake_openai.retry_after = None
+        assert analyzer._is_transient(error(429))
+        assert analyzer._is_transient(error(503))
+        assert not analyzer._is_transient(error(400))
+        quota = error(429)
+        quota.code = 'insufficient_quota'
+        assert not analyzer._is_transient(quota)
+        assert analyzer._retry_after(error(429, retry_after=2)) == 2.0
+        assert analyzer._retry_after(error(500)) is None
+
+
+class TestOpenAIRetries:
+    @pytest.fixture
+    def scheduler(self, monkeypatch):
+        from app.utils import analyzer
+        from app.utils.ratelimit import CallScheduler, RateLimiter
+        scheduler = CallScheduler(RateLimiter(), analyzer._is_transient, analyzer._retry_after,
+                                  max_retries=2, base_delay=0.01, max_delay=0.05, deadline=5.0)
+        from app.routes import audit_routes
+        monkeypatch.setattr(analyzer, 'call_scheduler', scheduler)
+        monkeypatch.setattr(audit_routes, 'call_scheduler', scheduler)
+        monkeypatch.setattr(analyzer.cache, 'enabled', False)
+        monkeypatch.setattr(app.extensions['audit']['cache'], 'enabled', False)
+        return scheduler
+
+    def test_injected_429s_are_retried(self, client, fake_openai, scheduler):
+        from app.utils import analyzer
+        fake_openai.retry_after = 0.02
+        try:
+            fake_openai.fail_next(429, 500)
+            result = analyzer.analyze_document("Fire risk near the loading dock.")
+        finally:
+            fake_openai.retry_after = None
+        assert 'error' not in result
+        metrics = scheduler.metrics()
+        assert (metrics['attempts'], metrics['retries'], metrics['succeeded']) == (3, 2, 1)
+        assert metrics['backoff_seconds'] >= 0.02
+        assert metrics['tokens_used'] > 0
+
+    def test_persistent_failures_are_not_stored(self, client, fake_openai, scheduler, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'retries.db'))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        fake_openai.fail_next(*[429] * 6)
+        response = client.post('/analyze', data={'document': (io.BytesIO(b"Fire risk."), 'doc.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 503
+        assert 'retry later' in response.get_json()['error']
+        with test_db.connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM revisions').fetchone()[0] == 0
+        assert client.get('/stats/openai').get_json()['gave_up'] >= 1
+
+    def test_slow_responses_hit_the_timeout(self, scheduler, monkeypatch):
+        from openai import OpenAI
+        from app.config import Config
+        from app.utils import analyzer
+        from app.utils.ratelimit import RetriesExhausted
+        from benchmarks.fake_openai import FakeOpenAIServer
+        monkeypatch.setattr(Config, 'OPENAI_TIMEOUT', 0.05)
+        with FakeOpenAIServer(latency=0.5) as slow:
+            monkeypatch.setattr(analyzer, 'client', OpenAI(base_url=slow.base_url, api_key='fake', max_retries=0))
+            with pytest.raises(RetriesExhausted):
+                analyzer.generate_revised_document("Fire risk.")
+        assert scheduler.metrics()['attempts'] == 3
+
+class TestAnalyzerBackends:
+    DOCUMENT = (
+        "1. Storage:\n"
+        "Flammable materials are stored near open flames. Exits are blocked.\n"
+        "Workers handle solvents without gloves, violating OSHA 1910.132.\n"
+        "Last year a worker was injured by an electric shock.\n"
+        "Ensure forklifts are inspected to prevent accidents.\n"
+    )
+
+    def test_local_analysis_schema(self):
+        from app.utils.backends import LocalBackend
+        analysis = LocalBackend().analyze(self.DOCUMENT)
+        assert set(analysis) == {"detected_hazards", "compliance_issues", "regulatory_comments", "accident_incidents"}
+        assert analysis["detected_hazards"] == [
+            "Flammable materials are stored near open flames.",
+            "Exits are blocked.",
+            "Workers handle solvents without gloves, violating OSHA 1910.132."
+        ]
+        assert analysis["compliance_issues"] == ["Workers handle solvents without gloves, violating OSHA 1910.132."]
+        assert analysis["accident_incidents"] == ["Last year a worker was injured by an electric shock."]
+        assert {"OSHA 1910.132", "NFPA 101", "OSHA 1910.22"} == set(analysis["regulatory_comments"])
+
+    def test_falls_need_a_hazard_context(self):
+        """"falls" on its own is an ordinary verb, not a fall hazard"""
+        from app.utils.backends import LocalBackend
+        local = LocalBackend()
+        for sentence in ("Responsibility for the permit falls on the contractor.",
+                         "The audit falls in the second quarter."):
+            assert local.analyze(sentence)["detected_hazards"] == []
+        for sentence in ("There is a risk of falls from the mezzanine.", "Workers face a fall hazard on the roof.",
+                         "Clutter increases the risk of trips and falls.", "Falls from ladders are common here."):
+            assert local.analyze(sentence)["detected_hazards"] == [sentence]
+
+    def test_local_analysis_streams_items(self):
+        from app.utils.backends import LocalBackend
+        items = []
+        analysis = LocalBackend().analyze(self.DOCUMENT, lambda key, item: items.append((key, item)))
+        assert [item for key, item in items if key == "detected_hazards"] == analysis["detected_hazards"]
+
+    def test_local_revision_adds_recommendations(self):
+        from app.utils.backends import LocalBackend
+        revised = LocalBackend().revise(self.DOCUMENT)
+        assert revised.startswith("1. Storage:\nFlammable materials are stored near open flames. Recommendation: ")
+        assert revised.count("Recommendation: ") == 3
+        assert "Ensure forklifts are inspected to prevent accidents.\n" in revised
+
+    def test_ambiguous_documents(self):
+        from app.utils.backends import LocalBackend
+        local = LocalBackend()
+        assert not local.scan(self.DOCUMENT)[1]
+        assert local.scan("There is a general risk in the area.")[1]
+        assert local.scan("No flammable materials are stored here.")[1]
+        assert not local.scan("The canteen serves lunch at noon.")[1]
+
+    def test_tiered_escalates_only_ambiguous_chunks(self):
+        from app.utils.backends import AnalyzerBackend, TieredBackend
+
+        class Remote(AnalyzerBackend):
+            calls = []
+
+            def analyze(self, text, on_item=None):
+                self.calls.append(text)
+                return {"detected_hazards": ["remote"], "compliance_issues": [],
+                        "regulatory_comments": {}, "accident_incidents": []}
+
+            def revise(self, text, on_token=None):
+                self.calls.append(text)
+                return "remote"
+
+        tiered = TieredBackend(remote=Remote())
+        assert tiered.analyze(self.DOCUMENT)["detected_hazards"][0].startswith("Flammable")
+        assert tiered.analyze("There is a general risk in the area.")["detected_hazards"] == ["remote"]
+        assert tiered.revise("There is a general risk in the area.") == "remote"
+        assert tiered.stats() == {'local': 1, 'escalated': 1}
+
+    def test_create_backend(self):
+        from app.utils.backends import create_backend
+        assert [create_backend(name).name for name in ('openai', 'local', 'tiered')] == ['openai', 'local', 'tiered']
+        with pytest.raises(ValueError):
+            create_backend('nope')
+
+    def test_incomplete_backend_fails_at_construction(self):
+        from app.utils.backends import AnalyzerBackend
+
+        class AnalyzeOnly(AnalyzerBackend):
+            def analyze(self, text, on_item=None):
+                return {}
+
+        with pytest.raises(TypeError):
+            AnalyzeOnly()
+
+    def test_local_backend_end_to_end(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        from app.utils import analyzer
+        from app.utils.backends import LocalBackend
+        monkeypatch.setitem(app.extensions['audit'], 'backend', LocalBackend())
+        # Any OpenAI call would fail
+        monkeypatch.setattr(analyzer, 'client', None)
+        monkeypatch.setattr(audit_routes, 'db_connection', DatabaseConnection(str(tmp_path / 'local.db')))
+        response = client.post('/analyze', data={'document': (io.BytesIO(self.DOCUMENT.encode()), 'doc.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        revision = response.get_json()['revision']
+        assert "Exits are blocked." in revision['analysis']['detected_hazards']
+        assert "Recommendation: " in revision['revised_document']
+        assert client.get('/stats/analyzer').get_json() == {'backend': 'local'}
+
+class TestMetrics:
+    @pytest.fixture
+    def local_client(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        from app.utils import analyzer
+        from app.utils.backends import LocalBackend
+        monkeypatch.setitem(app.extensions['audit'], 'backend', LocalBackend())
+        monkeypatch.setattr(audit_routes, 'db_connection', DatabaseConnection(str(tmp_path / 'metrics.db')))
+        return client
+
+    def upload(self, client, text=b"Exposed wiring in the basement.\n", headers=None):
+        return client.post('/analyze', data={'document': (io.BytesIO(text), 'doc.txt')},
+                           content_type='multipart/form-data', headers=headers or {})
+
+    def test_histogram_exposition(self):
+        from app.utils.metrics import Registry
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Test latency', ('stage',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(5, 'a')
+        registry.register_collector(lambda: [('test_things', 'counter', 'Things', 3)])
+        lines = registry.render().splitlines()
+        assert '# TYPE test_seconds histogram' in lines
+        assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{stage="a",le="1"} 2' in lines
+        assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+        assert 'test_seconds_count{stage="a"} 3' in lines
+        assert 'test_seconds_sum{stage="a"} 5.55' in lines
+        assert 'test_things_total 3' in lines
+        assert histogram.snapshot('a') == (3, 5.55)
+
+    def test_requests_and_stages_are_recorded(self, local_client):
+        from app.utils import metrics
+        requests_before, _ = metrics.REQUEST_SECONDS.snapshot('POST', '/analyze', '200')
+        analyses_before, _ = metrics.STAGE_SECONDS.snapshot('analysis')
+        stores_before, _ = metrics.DB_SECONDS.snapshot('store_revisions')
+        doc_id = self.upload(local_client).get_json()['doc_id']
+        # The body is streamed: reading it is what runs iter_revisions
+        local_client.get(f'/history/{doc_id}').get_data()
+        assert metrics.REQUEST_SECONDS.snapshot('POST', '/analyze', '200')[0] == requests_before + 1
+        assert metrics.STAGE_SECONDS.snapshot('analysis')[0] == analyses_before + 1
+        assert metrics.DB_SECONDS.snapshot('store_revisions')[0] == stores_before + 1
+
+        response = local_client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        text = response.get_data(as_text=True)
+        # Route patterns, not paths, so each document doesn't get its own series
+        assert 'endpoint="/history/<doc_id>"' in text
+        assert doc_id not in text
+        assert 'audit_stage_duration_seconds_bucket{stage="revision",le="+Inf"}' in text
+        assert 'audit_db_query_duration_seconds_count{operation="iter_revisions"}' in text
+        assert '# TYPE audit_openai_calls_total counter' in text
+        assert 'audit_analysis_cache_hit_rate' in text
+        assert 'audit_jobs_queued 0' in text
+
+    def test_trace_header(self, local_client):
+        untraced = self.upload(local_client)
+        assert 'Server-Timing' not in untraced.headers
+        response = self.upload(local_client, headers={'X-Trace': '1'})
+        timing = response.headers['Server-Timing']
+        names = [entry.split(';')[0] for entry in timing.split(', ')]
+        assert {'decode', 'analysis', 'revision', 'db.store_revisions', 'total'} <= set(names)
+        assert names[-1] == 'total'
+
+    def test_disabled(self, local_client, monkeypatch):
+        from app.utils import metrics
+        monkeypatch.setitem(app.config, 'METRICS_ENABLED', False)
+        before = metrics.STAGE_SECONDS.snapshot('analysis')
+        response = self.upload(local_client, headers={'X-Trace': '1'})
+        assert response.status_code == 200
+        assert 'Server-Timing' not in response.headers
+        assert metrics.STAGE_SECONDS.snapshot('analysis') == before
+
+    def test_request_setting_is_reset(self, local_client, monkeypatch):
+        """The per-request METRICS_ENABLED flag doesn't outlive the request"""
+        from app.utils import metrics
+        monkeypatch.setitem(app.config, 'METRICS_ENABLED', False)
+        assert self.upload(local_client).status_code == 200
+        assert metrics.current_enabled.get() is None
+
+    def test_profiler_toggle(self, local_client, monkeypatch):
+        import time
+        from app.utils import metrics
+        monkeypatch.setitem(app.config, 'PROFILER_TOKEN', 's3cret')
+        headers = {'X-Profiler-Token': 's3cret'}
+        try:
+            status = local_client.post('/metrics/profiler', json={'enabled': True, 'interval': 0.002, 'reset': True},
+                                       headers=headers).get_json()
+            assert status['running'] and status['interval'] == 0.002
+            deadline = time.monotonic() + 5
+            while metrics.profiler.status()['samples'] < 3 and time.monotonic() < deadline:
+                self.upload(local_client)
+        finally:
+            status = local_client.post('/metrics/profiler', data={'enabled': 'false'}, headers=headers).get_json()
+        assert not status['running'] and status['samples'] >= 3
+        profile = local_client.get('/metrics/profile', headers=headers).get_data(as_text=True)
+        stack, count = profile.splitlines()[0].rsplit(' ', 1)
+        assert int(count) >= 1 and ' (' in stack
+        assert local_client.post('/metrics/profiler', data={'interval': 'soon'}, headers=headers).status_code == 400
+
+    def test_profiler_needs_its_token(self, client, monkeypatch):
+        from app.utils import metrics
+        for path in ('/metrics/profiler', '/metrics/profile'):
+            assert client.get(path).status_code == 404
+        assert client.post('/metrics/profiler', data={'enabled': 'true'}).status_code == 404
+        monkeypatch.setitem(app.config, 'PROFILER_TOKEN', 's3cret')
+        for headers in ({}, {'X-Profiler-Token': 'guess'}):
+            assert client.post('/metrics/profiler', data={'enabled': 'true'}, headers=headers).status_code == 403
+            assert client.get('/metrics/profile', headers=headers).status_code == 403
+        assert not metrics.profiler.status()['running']
+
+class TestUploads:
+    def test_read_text_validates_in_chunks(self):
+        from app.utils.uploads import UploadError, read_text
+        e_acute = "é".encode()
+        assert read_text(io.BytesIO(b"ok " + e_acute * 3), chunk_size=2) == "ok ééé"
+        for data in (b"", b"a\x00b", b"ab" + e_acute[:1], b"\xff\xfe"):
+            with pytest.raises(UploadError) as info:
+                read_text(io.BytesIO(data), chunk_size=2)
+            assert info.value.status_code == 400
+        with pytest.raises(UploadError) as info:
+            read_text(io.BytesIO(b"x" * 100), max_bytes=10, chunk_size=4)
+        assert info.value.status_code == 413
+
+    def test_read_text_sources(self, tmp_path):
+        import tempfile
+        from app.utils.uploads import read_text
+        text = "Exposed wiring in room é.\n" * 1000
+        # Spooled in memory, rolled over to a file, and a plain stream without fileno()
+        small = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+        large = tempfile.SpooledTemporaryFile(max_size=1024)
+        for spooled in (small, large):
+            spooled.write(text.encode())
+            spooled.seek(0)
+        assert read_text(small) == text and not small._rolled
+        assert read_text(large) == text and large._rolled
+
+        class Stream:
+            def __init__(self, data):
+                self.data = io.BytesIO(data)
+
+            def read(self, size=-1):
+                return self.data.read(size)
+
+        assert read_text(Stream(text.encode())) == text
+
+    def test_upload_limits(self, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'MAX_DOCUMENT_BYTES', 1000)
+        response = client.post('/analyze', data={'document': (io.BytesIO(b"x" * 2000), 'big.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 413
+        assert 'limit 1000 bytes' in response.get_json()['error']
+
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 500)
+        response = client.post('/analyze', data={'document': (io.BytesIO(b"x" * 2000), 'big.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 413
+        assert 'Request too large' in response.get_json()['error']
+
+    def test_re_audit_rejects_binary(self, client):
+        response = client.post('/re_audit', data={'doc_id': 'any', 'document': (io.BytesIO(b"\x00\x01"), 'b.dat')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 400
+        assert b'Could not read file content' in response.data
+
+    def test_large_upload_is_read_from_the_spool_file(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        from app.utils import analyzer
+        from app.utils.backends import LocalBackend
+        monkeypatch.setitem(app.extensions['audit'], 'backend', LocalBackend())
+        monkeypatch.setattr(audit_routes, 'db_connection', DatabaseConnection(str(tmp_path / 'uploads.db')))
+        # Werkzeug spools file uploads over 500 KiB to disk
+        text = "Exposed wiring in room é.\n" * 30000
+        response = client.post('/analyze', data={'document': (io.BytesIO(text.encode()), 'big.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.get_json()['revision']['original_text'] == text
+
+class TestDbQuery:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        path = str(tmp_path / 'query.db')
+        db = DatabaseConnection(path)
+        for doc_id, hazard in (('doc-a', "Exposed wiring in the basement."), ('doc-b', "Wet floor near the dock.")):
+            for number in (1, 2, 3):
+                text = f"Site {doc_id}, version {number}.\n" * 20
+                db.store_revision(doc_id, {
+                    'revision_number': number,
+                    'timestamp': f'2025-0{number}-15T00:00:00+00:00',
+                    'original_text': text,
+                    'analysis': {"detected_hazards": [hazard], "original_text": text},
+                    'revised_document': text + "Recommendation: fix it.",
+                    'diff': None
+                })
+        db.close()
+        return path
+
+    def test_filters(self, db_path):
+        from app.db.db_query import iter_revisions, open_readonly, revisions_query
+        conn = open_readonly(db_path)
+
+        def run(**filters):
+            fields, query, params = revisions_query(**filters)
+            return [(row['doc_id'], row['revision_number']) for row in iter_revisions(conn, fields, query, params, 2)]
+
+        assert len(run()) == 6
+        assert run(doc_ids=['doc-b']) == [('doc-b', 1), ('doc-b', 2), ('doc-b', 3)]
+        assert run(hazard='WIRING') == [('doc-a', 1), ('doc-a', 2), ('doc-a', 3)]
+        assert run(hazard='%') == []
+        assert run(since='2025-02-01', until='2025-03-01') == [('doc-a', 2), ('doc-b', 2)]
+        assert run(limit=1) == [('doc-a', 1)]
+        fields, query, params = revisions_query(fields=['revised_document'], doc_ids=['doc-a'], limit=1)
+        row = next(iter_revisions(conn, fields, query, params))
+        assert row == {'doc_id': 'doc-a', 'revision_number': 1,
+                       'revised_document': "Site doc-a, version 1.\n" * 20 + "Recommendation: fix it."}
+        conn.close()
+
+    def test_read_only(self, db_path):
+        from app.db.db_query import open_readonly
+        conn = open_readonly(db_path)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM revisions")
+        conn.close()
+
+    def test_export(self, db_path, tmp_path, capsys):
+        import csv
+        import json
+        from app.db.db_query import main
+        ndjson = tmp_path / 'out.ndjson'
+        main(['--db', db_path, 'export', '-o', str(ndjson), '--doc-id', 'doc-a'])
+        rows = [json.loads(line) for line in ndjson.read_text().splitlines()]
+        assert [row['revision_number'] for row in rows] == [1, 2, 3]
+        assert rows[2]['original_text'] == "Site doc-a, version 3.\n" * 20
+        assert rows[2]['analysis']['detected_hazards'] == ["Exposed wiring in the basement."]
+
+        csv_path = tmp_path / 'out.csv'
+        main(['--db', db_path, '--immutable', 'export', '--format', 'csv', '-o', str(csv_path),
+              '--fields', 'analysis', '--hazard', 'wet floor'])
+        with open(csv_path, newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ['doc_id', 'revision_number', 'analysis']
+        assert len(rows) == 4
+        assert json.loads(rows[1][2])['detected_hazards'] == ["Wet floor near the dock."]
+        assert '3 revisions exported' in capsys.readouterr().err
+
+        with pytest.raises(SystemExit):
+            main(['--db', db_path, 'export', '--fields', 'bogus'])
+
+    def test_unmigrated_database(self, tmp_path, capsys):
+        """A database at the version 1 schema is read from its text columns, without migrating it"""
+        import json
+        from app.db.db_query import main
+        from app.utils.storage import load_migrations
+        path = str(tmp_path / 'v1.db')
+        conn = sqlite3.connect(path)
+        with open(load_migrations()[0][1]) as f:
+            conn.executescript(f.read())
+        for number, hazard in ((1, "Exposed wiring."), (2, "Wet floor.")):
+            conn.execute(
+                "INSERT INTO revisions (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)"
+                " VALUES ('doc-a', ?, ?, ?, ?, 'revised', NULL)",
+                (number, f'2025-0{number}-15', f"text {number}",
+                 json.dumps({"detected_hazards": [hazard], "original_text": f"text {number}"})))
+        conn.commit()
+        conn.close()
+
+        out = tmp_path / 'out.ndjson'
+        main(['--db', path, 'export', '-o', str(out), '--hazard', 'WIRING'])
+        rows = [json.loads(line) for line in out.read_text().splitlines()]
+        assert [(row['revision_number'], row['original_text']) for row in rows] == [(1, "text 1")]
+        assert rows[0]['analysis']['detected_hazards'] == ["Exposed wiring."]
+        assert rows[0]['revised_document'] == 'revised'
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+
+        empty = str(tmp_path / 'empty.db')
+        sqlite3.connect(empty).close()
+        with pytest.raises(SystemExit):
+            main(['--db', empty, 'revisions', '--no-pager'])
+        assert 'needs migrating' in capsys.readouterr().err
+
+    def test_terminal_output(self, db_path, capsys):
+        from app.db.db_query import main
+        main(['--db', db_path, 'tables'])
+        assert 'revisions' in capsys.readouterr().out
+        main(['--db', db_path, 'revisions', '--fields', 'timestamp', '--page-size', '2', '--no-pager'])
+        out = capsys.readouterr().out
+        assert out.count('doc-a') == 3 and out.count('revision_number') == 3
+
+class TestStartup:
+    # Cumulative import time of `from app import app`, best of three runs. The
+    # openai package alone takes longer than this, so it catches it being
+    # imported at startup again; Flask is most of what remains.
+    IMPORT_BUDGET_SECONDS = 0.5
+
+    def run_python(self, code, tmp_path, *flags):
+        import subprocess
+        import sys
+        env = {k: v for k, v in os.environ.items() if k != 'OPENAI_API_KEY'}
+        env['AUDIT_DB_PATH'] = str(tmp_path / 'startup.db')
+        root = os.path.join(os.path.dirname(__file__), '..')
+        return subprocess.run([sys.executable, *flags, '-c', code], cwd=root, env=env,
+                              capture_output=True, text=True, check=True)
+
+    def test_importing_touches_nothing(self, tmp_path):
+        """No OpenAI client, openai module or database until they are needed"""
+        result = self.run_python(
+            "import sys\n"
+            "from app.routes import audit_routes\n"
+            "from app.utils import analyzer\n"
+            "print(analyzer.client is None, 'openai' in sys.modules)",
+            tmp_path)
+        assert result.stdout.split() == ['True', 'False']
+        assert not (tmp_path / 'startup.db').exists()
+
+    def test_app_starts_without_an_api_key(self, tmp_path):
+        result = self.run_python(
+            "import sys\n"
+            "from app import app\n"
+            "response = app.test_client().get('/jobs')\n"
+            "print(response.status_code, 'openai' in sys.modules)",
+            tmp_path)
+        assert result.stdout.split() == ['200', 'False']
+        assert (tmp_path / 'startup.db').exists()
+
+    def test_import_time_budget(self, tmp_path):
+        def total(stderr):
+            # Top-level imports only; their cumulative times include everything else
+            return sum(
+                int(fields[1]) for fields in (line.split('|') for line in stderr.splitlines())
+                if len(fields) == 3 and fields[1].strip().isdigit()
+                and fields[2].startswith(' ') and not fields[2].startswith('  ')
+            ) / 1e6
+
+        seconds = min(total(self.run_python("from app import app", tmp_path, '-X', 'importtime').stderr)
+                      for _ in range(3))
+        assert 0 < seconds < self.IMPORT_BUDGET_SECONDS
+
+    def test_apps_have_their_own_storage(self, tmp_path):
+        from app import create_app
+        first = create_app({'DATABASE_PATH': str(tmp_path / 'first.db')})
+        second = create_app({'DATABASE_PATH': str(tmp_path / 'second.db')})
+        assert first.extensions['audit']['db'].db_path != second.extensions['audit']['db'].db_path
+        with first.test_client() as client:
+            assert client.get('/history/missing').status_code == 404
+        assert (tmp_path / 'first.db').exists()
+
+    def test_apps_use_their_own_config(self, tmp_path):
+        from app import create_app
+        from app.utils import analyzer
+        custom = create_app({'DATABASE_PATH': str(tmp_path / 'custom.db'), 'ANALYZER_BACKEND': 'local',
+                             'MAX_DOCUMENT_BYTES': 10, 'COMPRESS_ENABLED': False})
+        with custom.app_context():
+            assert analyzer.get_backend() is custom.extensions['audit']['backend']
+        with custom.test_client() as client:
+            assert client.get('/stats/analyzer').get_json()['backend'] == 'local'
+            response = client.post('/analyze', data={'document': (io.BytesIO(b"x" * 100), 'doc.txt')},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 413
+            assert 'Content-Encoding' not in client.get('/metrics', headers={'Accept-Encoding': 'gzip'}).headers
+        assert app.test_client().get('/metrics', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+
+    def test_analysis_cache_uses_the_apps_database(self, tmp_path):
+        from app import create_app
+        from app.utils import analyzer
+        path = str(tmp_path / 'cached.db')
+        custom = create_app({'DATABASE_PATH': path})
+        cache = custom.extensions['audit']['cache']
+        assert cache.db is custom.extensions['audit']['db']
+        with custom.app_context():
+            assert analyzer.get_cache() is cache
+            cache.set('key', {"detected_hazards": ["fire"]})
+        with sqlite3.connect(path) as conn:
+            assert conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0] == 1
+        assert analyzer.get_cache() is analyzer.cache and analyzer.cache.db is None
+
+    def test_client_is_created_on_first_use(self, monkeypatch):
+        from app.utils import analyzer
+        monkeypatch.setattr(analyzer, 'client', None)
+        monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+        client = analyzer.get_client()
+        assert client is analyzer.get_client()
+        assert client.max_retries == 0
+
+class TestLeanResponses:
+    DOCUMENT = ("Lockout Procedure\n"
+                "Exposed wiring creates a fire hazard near the press. "
+                "Operators must comply with the lockout checklist.\n"
+                "An incident occurred in 2019 when a guard was removed.\n")
+
+    @pytest.fixture
+    def db(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        from app.utils import analyzer
+        test_db = DatabaseConnection(str(tmp_path / 'lean.db'))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        monkeypatch.setattr(analyzer.cache, 'enabled', False)
+        monkeypatch.setattr(app.extensions['audit']['cache'], 'enabled', False)
+        return test_db
+
+    def analyze(self, client, document=None, query=''):
+        data = {'document': (io.BytesIO((document or self.DOCUMENT).encode()), 'doc.txt')}
+        return client.post(f'/analyze{query}', data=data, content_type='multipart/form-data')
+
+    def test_compact_schema_returns_sentences_of_the_document(self, client, db, fake_openai, monkeypatch):
+        monkeypatch.setitem(app.config, 'ANALYSIS_SCHEMA', 'compact')
+        analysis = self.analyze(client).get_json()['revision']['analysis']
+        assert analysis['detected_hazards'] == ["Exposed wiring creates a fire hazard near the press."]
+        assert analysis['compliance_issues'] == ["Operators must comply with the lockout checklist."]
+        assert analysis['accident_incidents'] == ["An incident occurred in 2019 when a guard was removed."]
+        prompts = [request['messages'][-1]['content'] for request in fake_openai.requests]
+        assert any("[1] Exposed wiring creates a fire hazard near the press." in prompt for prompt in prompts)
+
+    def test_compact_schema_streams_sentences(self, client, db, monkeypatch):
+        from app.config import Config
+        from app.utils import analyzer
+        monkeypatch.setattr(Config, 'ANALYSIS_SCHEMA', 'compact')
+        items = []
+        result = analyzer.openai_analysis(self.DOCUMENT, on_item=lambda key, item: items.append((key, item)))
+        assert items == [(key, item) for key in ('detected_hazards', 'compliance_issues', 'accident_incidents')
+                         for item in result[key]]
+
+    def test_expand_compact_drops_unknown_numbers(self):
+        from app.utils.analyzer import expand_compact, number_sentences
+        numbered, spans = number_sentences("One. Two.\nThree.")
+        assert numbered == "[0] One.\n[1] Two.\n[2] Three."
+        analysis = expand_compact({"h": [2, 7, -1, True, "1"], "c": [0], "r": {"OSHA": "Guard"}, "i": None},
+                                  "One. Two.\nThree.", spans)
+        assert analysis == {"detected_hazards": ["Three."], "compliance_issues": ["One."],
+                            "regulatory_comments": {"OSHA": "Guard"}, "accident_incidents": []}
+
+    def test_lean_view(self, client, db, monkeypatch):
+        monkeypatch.setitem(app.config, 'ANALYSIS_SCHEMA', 'compact')
+        full = self.analyze(client).get_json()
+        lean = self.analyze(client, query='?view=lean').get_json()['revision']
+        assert 'original_text' not in lean['analysis']
+        text = lean['original_text']
+        assert [text[start:end] for start, end in lean['analysis']['detected_hazards']] == \
+            full['revision']['analysis']['detected_hazards']
+
+        doc_id = full['doc_id']
+        history = client.get(f'/history/{doc_id}?view=lean&fields=analysis').get_json()['revisions'][0]
+        assert isinstance(history['analysis']['detected_hazards'][0], list)
+        assert history['original_text'] == self.DOCUMENT
+        detail = client.get(f'/history/{doc_id}/1?view=lean').get_json()['revision']
+        assert detail['analysis'] == lean['analysis']
+
+    def test_lean_revision_keeps_findings_it_cannot_locate(self):
+        from app.utils.sections import lean_revision
+        revision = {'analysis': {'detected_hazards': ["Wet floor.", "Paraphrased"], 'original_text': "A wet floor. Wet floor."}}
+        lean = lean_revision(revision)
+        assert lean == {'original_text': "A wet floor. Wet floor.",
+                        'analysis': {'detected_hazards': [[13, 23], "Paraphrased"]}}
+        assert revision['analysis']['original_text']  # not modified in place
+
+    def test_large_responses_are_compressed(self, client, db):
+        import gzip
+        doc_id = self.analyze(client, self.DOCUMENT * 40).get_json()['doc_id']
+        plain = client.get(f'/history/{doc_id}/1')
+        assert 'Content-Encoding' not in plain.headers
+        packed = client.get(f'/history/{doc_id}/1', headers={'Accept-Encoding': 'gzip'})
+        assert packed.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in packed.headers['Vary']
+        assert len(packed.data) < len(plain.data) / 4
+        assert gzip.decompress(packed.data) == plain.data
+        # Streamed: compressed as it is sent
+        streamed = client.get(f'/history/{doc_id}', headers={'Accept-Encoding': 'gzip'})
+        assert streamed.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(streamed.data) == client.get(f'/history/{doc_id}').data
+        # Too small to be worth it
+        assert 'Content-Encoding' not in client.get('/jobs', headers={'Accept-Encoding': 'gzip'}).headers
+
+    def test_brotli(self, client, db):
+        brotli = pytest.importorskip('brotli')
+        doc_id = self.analyze(client, self.DOCUMENT * 40).get_json()['doc_id']
+        response = client.get(f'/history/{doc_id}/1', headers={'Accept-Encoding': 'gzip, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.data) == client.get(f'/history/{doc_id}/1').data
+
+    def test_json_providers(self, tmp_path):
+        from flask.json.provider import DefaultJSONProvider
+        from app import create_app
+        stdlib = create_app({'DATABASE_PATH': str(tmp_path / 'json.db'), 'JSON_PROVIDER': 'stdlib'})
+        assert type(stdlib.json) is DefaultJSONProvider
+        pytest.importorskip('orjson')
+        fast = create_app({'DATABASE_PATH': str(tmp_path / 'json.db'), 'JSON_PROVIDER': 'orjson'})
+        value = {'b': [1, 2.5, None], 'a': "é\n", 'when': datetime(2024, 1, 2, tzinfo=timezone.utc)}
+        assert fast.json.dumps(value) == stdlib.json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        assert fast.json.loads(fast.json.dumps(value)) == stdlib.json.loads(stdlib.json.dumps(value))
+        with fast.app_context(), stdlib.app_context():
+            assert fast.json.response(value).get_json() == stdlib.json.response(value).get_json()
+
+class TestLoadTest:
+    def test_mix_and_documents(self):
+        import argparse
+        from benchmarks.loadtest import build_document, parse_mix
+        assert parse_mix("analyze=2, history") == {'analyze': 2.0, 'history': 1.0}
+        for bad in ("upload=1", "analyze=x", "analyze=0"):
+            with pytest.raises(argparse.ArgumentTypeError):
+                parse_mix(bad)
+        first, second = build_document('v1', 4, 'a'), build_document('v1', 4, 'b')
+        assert 4000 <= len(first) < 6000 and first != second
+        assert "Safety Procedure Document - v2" in build_document('v2', 1, 'a')
+
+    def test_summary(self):
+        from benchmarks.loadtest import percentile, summarize
+        values = [i / 100 for i in range(1, 101)]
+        assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (0.5, 0.95, 0.99)
+        assert percentile([], 50) is None
+        summary = summarize([(200, 0.1), (200, 0.3), (503, 2.0)], 2.0)
+        assert summary['requests'] == 3 and summary['errors'] == 1
+        assert summary['statuses'] == {'200': 2, '503': 1}
+        assert summary['throughput_rps'] == 1.0
+        assert summary['latency_s']['max'] == 2.0
+
+    def test_short_run(self, tmp_path):
+        import json
+        import subprocess
+        import sys
+        output = tmp_path / 'results.json'
+        root = os.path.join(os.path.dirname(__file__), '..')
+        subprocess.run([sys.executable, '-m', 'benchmarks.loadtest', '--duration', '1', '--concurrency', '2',
+                        '--seed-docs', '2', '--sizes', '1', '--latency', '0', '--jitter', '0',
+                        '--output', str(output)], cwd=root, check=True, capture_output=True, timeout=120)
+        results = json.loads(output.read_text())
+        assert results['total']['requests'] > 0
+        assert results['total']['errors'] == 0
+        assert set(results['operations']) <= {'analyze', 're_audit', 'history'}
+        assert results['database']['growth_bytes'] >= 0
+        assert results['fake_openai']['calls'] > 0
+
+class TestDatabaseConnectionPool:
+    def test_wal_and_schema_version(self, tmp_path):
+        """New databases use WAL and are stamped with the latest migration"""
+        from app.utils.storage import load_migrations
+        db = DatabaseConnection(str(tmp_path / 'pool.db'))
+        with db.connection() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert conn.execute('PRAGMA user_version').fetchone()[0] == load_migrations()[-1][0]
+
+    def test_legacy_database_is_migrated(self, tmp_path):
+        """A database created from the original two-table schema is brought up to date"""
+        path = str(tmp_path / 'legacy.db')
+        with sqlite3.connect(path) as conn:
+            conn.executescript('''
+                CREATE TABLE documents (doc_id TEXT PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+                CREATE TABLE revisions (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT, revision_number INTEGER,
+                    timestamp TIMESTAMP, original_text TEXT, analysis JSON, revised_document TEXT, diff TEXT);
+                INSERT INTO documents (doc_id) VALUES ('old-doc');
+                INSERT INTO revisions (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
+                VALUES ('old-doc', 1, '2025-01-01', 'Old text', '{}', 'Old revision', NULL);
+            ''')
+        db = DatabaseConnection(path)
+        assert db.get_revision_history('old-doc')[0]['original_text'] == 'Old text'
+        assert db.get_revision_sections('old-doc', 1) == {}
+
+    def test_one_connection_per_thread(self, tmp_path):
+        """Connections are reused within a thread and not shared between threads"""
+        import threading
+        db = DatabaseConnection(str(tmp_path / 'pool.db'))
+        with db.connection() as first, db.connection() as second:
+            assert first is second
+
+        seen = []
+
+        def grab():
+            with db.connection() as conn:
+                seen.append(conn)
+
+        thread = threading.Thread(target=grab)
+        thread.start()
+        thread.join()
+        assert seen[0] is not first
+
+    def test_connections_of_finished_threads_are_closed(self, tmp_path):
+        """A thread per request must not leave a connection behind per request"""
+        import threading
+        db = DatabaseConnection(str(tmp_path / 'pool.db'))
+        seen = []
+
+        def grab():
+            with db.connection() as conn:
+                seen.append(conn)
+
+        for _ in range(20):
+            thread = threading.Thread(target=grab)
+            thread.start()
+            thread.join()
+        with db.connection():
+            pass
+        assert len(db._connections) == 1
+        with pytest.raises(sqlite3.ProgrammingError):
+            seen[0].execute('SELECT 1')
+
+    def test_failed_transaction_rolls_back(self, tmp_path):
+        db = DatabaseConnection(str(tmp_path / 'pool.db'))
+        with pytest.raises(RuntimeError):
+            with db.connection() as conn:
+                conn.execute("INSERT INTO documents (doc_id) VALUES ('doc')")
+                raise RuntimeError("boom")
+        assert not db.document_exists('doc')
+
+
+class TestHistoryPagination:
+    @pytest.fixture
+    def history_db(self, tmp_path, monkeypatch):
+        """A temporary database holding one document with five revisions"""
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'history.db'))
+        for number in range(1, 6):
+            test_db.store_revision('doc', {
+                'revision_number': number,
+                'timestamp': f'2025-01-0{number}T00:00:00+00:00',
+                'original_text': f"Text {number}",
+                'analysis': {"detected_hazards": [f"Hazard {number}"]},
+                'revised_document': f"Revised {number}",
+                'diff': None
+            })
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        return test_db
+
+    def test_full_history_is_unchanged(self, client, history_db):
+        """Without parameters every revision and field is returned"""
+        data = client.get('/history/doc').get_json()
+        assert [r['revision_number'] for r in data['revisions']] == [1, 2, 3, 4, 5]
+        assert data['revisions'][0]['analysis'] == {"detected_hazards": ["Hazard 1"]}
+        assert data['next_cursor'] is None
+
+    def test_cursor_pagination(self, client, history_db):
+        """Pages follow next_cursor until it is null"""
+        seen = []
+        url = '/history/doc?limit=2'
+        while url:
+            data = client.get(url).get_json()
+            seen.extend(r['revision_number'] for r in data['revisions'])
+            url = f"/history/doc?limit=2&cursor={data['next_cursor']}" if data['next_cursor'] else None
+        assert seen == [1, 2, 3, 4, 5]
+
+    def test_field_projection(self, client, history_db):
+        """Only the requested fields are returned"""
+        data = client.get('/history/doc?fields=timestamp').get_json()
+        assert data['revisions'][2] == {'revision_number': 3, 'timestamp': '2025-01-03T00:00:00+00:00'}
+
+    def test_invalid_parameters(self, client, history_db):
+        assert client.get('/history/doc?fields=secret').status_code == 400
+        assert client.get('/history/doc?limit=0').status_code == 400
+        assert client.get('/history/doc?cursor=abc').status_code == 400
+
+    def test_revision_detail(self, client, history_db):
+        """A single revision can be fetched on its own"""
+        data = client.get('/history/doc/4?fields=revised_document').get_json()
+        assert data['revision'] == {'revision_number': 4, 'revised_document': "Revised 4"}
+        assert client.get('/history/doc/9').status_code == 404
+        assert client.get('/history/other/1').status_code == 404
+
+
+class TestRevisionStorage:
+    @staticmethod
+    def revision(number, text):
+        return {
+            'revision_number': number,
+            'timestamp': f'2025-01-01T00:00:{number:02d}+00:00',
+            'original_text': text,
+            'analysis': {"detected_hazards": [f"Hazard {number}"], "original_text": text},
+            'revised_document': text + f"\nRecommendation {number}.",
+            'diff': f"-line {number - 1}\n+line {number}"
+        }
+
+    @staticmethod
+    def versions(count):
+        lines = [f"{i}. Requirement {i} applies to every site.\n" for i in range(1, 200)]
+        texts = []
+        for number in range(count):
+            lines[(number * 37) % len(lines)] = f"Edited in revision {number}.\n"
+            texts.append("".join(lines))
+        return texts
+
+    def test_round_trip_with_bounded_delta_chains(self, tmp_path):
+        """Every revision reads back exactly, and no delta chain exceeds the snapshot interval"""
+        from app.config import Config
+        path = str(tmp_path / 'blobs.db')
+        texts = self.versions(40)
+        db = DatabaseConnection(path)
+        for number, text in enumerate(texts, start=1):
+            db.store_revision('doc', self.revision(number, text))
+
+        # Read back through a fresh instance so nothing comes from the text cache
+        history = DatabaseConnection(path).get_revision_history('doc')
+        assert [r['original_text'] for r in history] == texts
+        assert [r['analysis']['original_text'] for r in history] == texts
+        assert history[5]['revised_document'] == texts[5] + "\nRecommendation 6."
+        assert history[5]['diff'] == "-line 5\n+line 6"
+
+        with sqlite3.connect(path) as conn:
+            assert conn.execute('SELECT COUNT(*) FROM revisions WHERE original_text IS NOT NULL').fetchone()[0] == 0
+            codecs = dict(conn.execute('SELECT codec, COUNT(*) FROM blobs GROUP BY codec').fetchall())
+            assert codecs['delta'] > codecs['zlib']
+            assert conn.execute('SELECT MAX(depth) FROM blobs').fetchone()[0] < Config.REVISION_SNAPSHOT_INTERVAL
+            # The analysis JSON doesn't repeat the document
+            assert 'original_text' not in conn.execute('SELECT analysis FROM revisions LIMIT 1').fetchone()[0]
+
+    def test_storage_is_smaller_than_full_text(self, tmp_path):
+        texts = self.versions(20)
+        db = DatabaseConnection(str(tmp_path / 'blobs.db'))
+        for number, text in enumerate(texts, start=1):
+            db.store_revision('doc', self.revision(number, text))
+        with sqlite3.connect(db.db_path) as conn:
+            stored = conn.execute('SELECT SUM(LENGTH(data)) FROM blobs').fetchone()[0]
+        assert stored < sum(len(text) for text in texts) / 5
+
+    def test_new_revisions_on_top_of_legacy_rows(self, tmp_path):
+        """Text rows from before the migration stay readable next to blob-backed ones"""
+        path = str(tmp_path / 'legacy.db')
+        with sqlite3.connect(path) as conn:
+            conn.executescript('''
+                CREATE TABLE documents (doc_id TEXT PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+                CREATE TABLE revisions (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT, revision_number INTEGER,
+                    timestamp TIMESTAMP, original_text TEXT, analysis JSON, revised_document TEXT, diff TEXT);
+                INSERT INTO documents (doc_id) VALUES ('doc');
+                INSERT INTO revisions (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
+                VALUES ('doc', 1, '2025-01-01', 'Old text', '{"original_text": "Old text"}', 'Old revision', NULL);
+            ''')
+        db = DatabaseConnection(path)
+        db.store_revision('doc', self.revision(2, "New text"))
+        history = db.get_revision_history('doc')
+        assert [r['original_text'] for r in history] == ["Old text", "New text"]
+        assert history[0]['analysis'] == {"original_text": "Old text"}
+        assert history[0]['diff'] is None
+
+    def test_failed_batch_clears_text_cache(self, tmp_path):
+        """Blob ids from a rolled-back batch are reused, so their cached texts are dropped"""
+        db = DatabaseConnection(str(tmp_path / 'blobs.db'))
+        with pytest.raises(KeyError):
+            db.store_revisions([('a', self.revision(1, "Rolled back"), None), ('b', {}, None)])
+        db.store_revision('c', self.revision(1, "Committed"))
+        assert db.get_revision('c', 1, fields=('original_text',))['original_text'] == "Committed"
+
+    def test_delta_round_trip(self):
+        from app.utils.blobs import apply_delta, encode_delta
+        cases = [("", "a"), ("a\nb\n", ""), ("a\nb", "a\nb\nc"), ("x\ny\nz\n", "y\nz\nx"), ("same\n", "same\n")]
+        for base, text in cases:
+            assert apply_delta(base, encode_delta(base, text)) == text
+
+
+class TestLatestRevision:
+    @staticmethod
+    def revision(number, text):
+        return {
+            'revision_number': number,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'original_text': text,
+            'analysis': {"detected_hazards": []},
+            'revised_document': text,
+            'diff': None
+        }
+
+    @pytest.fixture
+    def latest_db(self, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'latest.db'))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        monkeypatch.setattr(audit_routes, 'run_analysis', lambda text, previous=None, on_event=None: ({"detected_hazards": []}, text, []))
+        return test_db
+
+    def test_get_latest_revision(self, latest_db):
+        for number in range(1, 4):
+            latest_db.store_revision('doc', self.revision(number, f"Text {number}"))
+        assert latest_db.get_latest_revision('doc', fields=('original_text',)) == {
+            'revision_number': 3, 'original_text': "Text 3"
+        }
+        assert latest_db.get_latest_revision('missing') is None
+
+    def test_duplicate_revision_number_is_rejected(self, latest_db):
+        latest_db.store_revision('doc', self.revision(1, "First"))
+        with pytest.raises(sqlite3.IntegrityError):
+            latest_db.store_revision('doc', self.revision(1, "Duplicate"))
+        assert [r['original_text'] for r in latest_db.get_revision_history('doc')] == ["First"]
+
+    def test_re_audit_retries_after_losing_a_race(self, latest_db, monkeypatch):
+        """A re-audit whose revision number was taken stores the next one, diffed against the winner"""
+        from app.routes import audit_routes
+        latest_db.store_revision('doc', self.revision(1, "Version one"))
+        store_revision = latest_db.store_revision
+        raced = []
+
+        def racing_store(doc_id, revision_data, sections=None):
+            if not raced:
+                raced.append(True)
+                store_revision(doc_id, self.revision(2, "Version two"))
+            store_revision(doc_id, revision_data, sections)
+
+        monkeypatch.setattr(latest_db, 'store_revision', racing_store)
+        payload, status_code = audit_routes.process_re_audit('doc', "Version three")
+        assert status_code == 200
+        assert payload['revision']['revision_number'] == 3
+        assert "-Version two" in payload['revision']['diff']
+        assert [r['revision_number'] for r in latest_db.get_revision_history('doc')] == [1, 2, 3]
+
+    def test_duplicate_legacy_revisions_are_renumbered(self, tmp_path):
+        """Migrating a database with duplicate revision numbers keeps every revision"""
+        path = str(tmp_path / 'legacy.db')
+        with sqlite3.connect(path) as conn:
+            conn.executescript('''
+                CREATE TABLE documents (doc_id TEXT PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+                CREATE TABLE revisions (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT, revision_number INTEGER,
+                    timestamp TIMESTAMP, original_text TEXT, analysis JSON, revised_document TEXT, diff TEXT);
+                INSERT INTO documents (doc_id) VALUES ('doc');
+                INSERT INTO revisions (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
+                VALUES ('doc', 1, 't1', 'One', '{}', 'One', NULL),
+                       ('doc', 2, 't2', 'Two', '{}', 'Two', NULL),
+                       ('doc', 2, 't3', 'Two again', '{}', 'Two again', NULL);
+            ''')
+        history = DatabaseConnection(path).get_revision_history('doc')
+        assert [(r['revision_number'], r['original_text']) for r in history] == [(1, 'One'), (2, 'Two'), (3, 'Two again')]
+
+
+class TestStreaming:
+    ANALYSIS = {
+        "detected_hazards": ["Fire risk, \"outdated\" wiring.", "Slippery floors."],
+        "compliance_issues": ["No fire drills."],
+        "regulatory_comments": {"NFPA 101": ["Exits must be marked."]},
+        "accident_incidents": []
+    }
+
+    @pytest.fixture
+    def completions(self, tmp_path, monkeypatch):
+        import json
+        from types import SimpleNamespace
+        from app.routes import audit_routes
+        from app.utils import analyzer
+        from app.utils.cache import AnalysisCache
+
+        completions = FakeCompletions(json.dumps(self.ANALYSIS), revision="Revised text.\nRecommendation: Fix it.")
+        test_db = DatabaseConnection(str(tmp_path / 'stream.db'))
+        monkeypatch.setattr(analyzer, 'client', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(analyzer, 'cache', AnalysisCache(db=test_db))
+        monkeypatch.setitem(app.extensions['audit'], 'cache', AnalysisCache(db=test_db))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        return completions
+
+    @staticmethod
+    def parse_events(body):
+        import json
+        events = []
+        for block in body.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def test_list_items_are_emitted_as_they_complete(self):
+        """Each list element is reported before the rest of the object has arrived"""
+        import json
+        from app.utils.streaming import ListItemParser
+        text = json.dumps(self.ANALYSIS)
+        items = []
+        parser = ListItemParser(lambda key, item: items.append((key, item)))
+        for position, char in enumerate(text):
+            parser.feed(char)
+            if position == text.index('"compliance_issues"'):
+                assert items == [('detected_hazards', item) for item in self.ANALYSIS['detected_hazards']]
+        assert items[-1] == ('compliance_issues', "No fire drills.")
+        assert len(items) == 3
+
+    def test_analyze_stream(self, client, completions):
+        """Findings and revised text stream as events, then the stored result follows"""
+        response = client.post('/analyze/stream', data={'document': (io.BytesIO(b"Fire risk."), 'doc.txt')},
+                               content_type='multipart/form-data')
+        assert response.mimetype == 'text/event-stream'
+        events = self.parse_events(response.get_data(as_text=True))
+
+        assert events[0] == ('chunks', [{'chunk': 0, 'heading': None, 'reused': False}])
+        items = [data['item'] for event, data in events if event == 'item']
+        assert items == ["Fire risk, \"outdated\" wiring.", "Slippery floors.", "No fire drills."]
+        revision = "".join(data['text'] for event, data in events if event == 'revision')
+        assert revision == "Revised text.\nRecommendation: Fix it."
+
+        event, payload = events[-1]
+        assert event == 'result'
+        assert payload['revision']['analysis']['detected_hazards'] == self.ANALYSIS['detected_hazards']
+        stored = client.get(f"/history/{payload['doc_id']}").get_json()
+        assert stored['revisions'][0]['revised_document'] == revision
+
+    def test_re_audit_stream(self, client, completions, monkeypatch):
+        """Unchanged sections replay their stored results as events"""
+        from app.config import Config
+        from app.routes import audit_routes
+        # Small enough that each section is a chunk of its own
+        monkeypatch.setattr(Config, 'ANALYSIS_CHUNK_TOKENS', 6)
+        monkeypatch.setitem(app.config, 'ANALYSIS_CHUNK_TOKENS', 6)
+        document = "1. Fire:\nFire risk.\n\n2. Floors:\nWet floors.\n"
+        payload, _ = audit_routes.process_analysis(document)
+        calls = completions.calls
+
+        response = client.post('/re_audit/stream', data={
+            'doc_id': payload['doc_id'],
+            'document': (io.BytesIO(document.replace("Wet", "Icy").encode()), 'doc.txt')
+        }, content_type='multipart/form-data')
+        events = self.parse_events(response.get_data(as_text=True))
+
+        assert [chunk['reused'] for chunk in events[0][1]] == [True, False]
+        assert completions.calls == calls + 2
+        assert events[-1][0] == 'result'
+        assert events[-1][1]['revision']['revision_number'] == 2
+
+    def test_stream_validation(self, client, completions):
+        assert client.post('/analyze/stream').status_code == 400
+        response = client.post('/re_audit/stream', data={
+            'doc_id': 'missing', 'document': (io.BytesIO(b"text"), 'doc.txt')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 404
+
+
+class TestDiffEngine:
+    @staticmethod
+    def apply(a, b, codes):
+        """Rebuild b from a and an edit script, checking that the script is contiguous"""
+        out = []
+        position = (0, 0)
+        for tag, i1, i2, j1, j2 in codes:
+            assert (i1, j1) == position
+            if tag == 'equal':
+                assert a[i1:i2] == b[j1:j2]
+                out.extend(a[i1:i2])
+            else:
+                out.extend(b[j1:j2])
+            position = (i2, j2)
+        assert position == (len(a), len(b))
+        return out
+
+    def test_edit_scripts_rebuild_the_new_text(self):
+        import random
+        from app.utils.diffing import ENGINES, opcodes
+        rng = random.Random(0)
+        for _ in range(300):
+            a = [rng.choice("abcdefg") for _ in range(rng.randrange(30))]
+            b = list(a)
+            for _ in range(rng.randrange(6)):
+                position = rng.randrange(len(b) + 1)
+                if rng.random() < 0.5 and position < len(b):
+                    del b[position]
+                else:
+                    b.insert(position, rng.choice("abcxyz"))
+            for engine in ENGINES:
+                assert self.apply(a, b, opcodes(a, b, engine)) == b
+
+    def test_engine_follows_the_app_config(self, monkeypatch):
+        import difflib
+        from app.utils.diffing import opcodes
+        a, b = ["x", "a", "b", "x"], ["a", "x", "b", "a"]
+        monkeypatch.setitem(app.config, 'DIFF_ENGINE', 'difflib')
+        with app.app_context():
+            assert opcodes(a, b) == difflib.SequenceMatcher(None, a, b).get_opcodes()
+            monkeypatch.setitem(app.config, 'DIFF_ENGINE', 'bogus')
+            with pytest.raises(ValueError):
+                opcodes(a, b)
+
+    def test_myers_cost_limit_still_gives_a_valid_script(self, monkeypatch):
+        from app.utils import diffing
+        monkeypatch.setattr(diffing, 'MYERS_MAX_COST', 3)
+        a = list("abcdefghij")
+        b = list("axcxexgxix")
+        assert self.apply(a, b, diffing.opcodes(a, b, 'myers')) == b
+
+    def test_unified_format_matches_difflib(self):
+        import difflib
+        from app.utils.diffing import unified_diff
+        with open(MOCK_DOC_PATH) as f:
+            old = f.read().splitlines()
+        new = [line.replace("wiring", "cabling") for line in old[:-3]] + ["New closing line."]
+        expected = list(difflib.unified_diff(old, new, 'Previous Version', 'New Version', lineterm=''))
+        assert list(unified_diff(old, new, 'Previous Version', 'New Version', engine='difflib')) == expected
+        # Patience may align differently, but produces the same kind of output
+        patience = list(unified_diff(old, new, 'Previous Version', 'New Version', engine='patience'))
+        assert patience[:2] == expected[:2]
+        assert [line for line in patience if line[:1] in '+-'] == [line for line in expected if line[:1] in '+-']
+        assert list(unified_diff(old, old)) == []
+
+    def test_patience_anchors_on_unique_lines(self):
+        """Moved blocks of common lines don't hide the real change"""
+        from app.utils.diffing import opcodes
+        a = ["1. Fire:", "}", "Check wiring.", "}", "2. Floors:", "}", "Mop floors.", "}"]
+        b = ["1. Fire:", "}", "Check wiring.", "}", "Inspect exits.", "}", "2. Floors:", "}", "Mop floors.", "}"]
+        codes = [code for code in opcodes(a, b, 'patience') if code[0] != 'equal']
+        assert codes == [('insert', 4, 4, 4, 6)]
+
+    def test_structured_diff_reports_sections(self):
+        from app.utils.diffing import structured_diff
+        old = ["Title", "1. Fire:", "Check wiring.", "2. Floors:", "Mop floors.", "Dry floors."]
+        new = ["Title", "1. Fire:", "Replace wiring.", "2. Floors:", "Mop floors."]
+        assert structured_diff(old, new) == [
+            {'type': 'replace', 'section': "1. Fire:", 'old_start': 3, 'old_lines': 1, 'new_start': 3, 'new_lines': 1},
+            {'type': 'delete', 'section': "2. Floors:", 'old_start': 6, 'old_lines': 1, 'new_start': 6, 'new_lines': 0}
+        ]
+
+    def test_diff_endpoint(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'diff.db'))
+        for number, text in enumerate(["1. Fire:\nCheck wiring.\n", "1. Fire:\nReplace wiring.\n"], start=1):
+            test_db.store_revision('doc', {
+                'revision_number': number, 'timestamp': '2025-01-01', 'original_text': text,
+                'analysis': {}, 'revised_document': text, 'diff': None
+            })
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+
+        unified = client.get('/history/doc/2/diff').get_data(as_text=True)
+        assert unified.splitlines()[:2] == ['--- Revision 1', '+++ Revision 2']
+        assert '-Check wiring.' in unified and '+Replace wiring.' in unified
+
+        changes = client.get('/history/doc/2/diff?format=structured').get_json()['changes']
+        assert changes == [{'type': 'replace', 'section': "1. Fire:", 'old_start': 2, 'old_lines': 1,
+                            'new_start': 2, 'new_lines': 1}]
+        assert client.get('/history/doc/1/diff?format=structured').get_json()['changes'][0]['type'] == 'insert'
+        assert client.get('/history/doc/3/diff').status_code == 404
+        assert client.get('/history/doc/2/diff?format=html').status_code == 400
+
+
+class TestSearch:
+    @staticmethod
+    def revision(number, text, hazards=(), issues=()):
+        return {
+            'revision_number': number,
+            'timestamp': f'2025-01-0{number}T00:00:00+00:00',
+            'original_text': text,
+            'analysis': {"detected_hazards": list(hazards), "compliance_issues": list(issues)},
+            'revised_document': text + "\nReviewed.",
+            'diff': None
+        }
+
+    @pytest.fixture
+    def search_db(self, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'search.db'))
+        test_db.store_revision('forklift', self.revision(
+            1, "Forklifts operate in aisle 4.", hazards=["Forklift collision with pedestrians"]))
+        test_db.store_revision('forklift', self.revision(
+            2, "Forklifts operate in aisle 4 with marked walkways.", hazards=["Forklift speed"]))
+        test_db.store_revision('ladder', self.revision(
+            1, "Use the ladder in the warehouse.", issues=["No ladder inspection per OSHA 1910.23"]))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        return test_db
+
+    def test_ranked_results_with_snippets(self, client, search_db):
+        """Hits in extracted hazards rank above hits in the text alone"""
+        search_db.store_revision('mention', self.revision(1, "A collision report was filed."))
+        data = client.get('/search?q=collision').get_json()
+        assert [(r['doc_id'], r['revision_number']) for r in data['results']] == [('forklift', 1), ('mention', 1)]
+        assert data['results'][0]['score'] > data['results'][1]['score']
+        snippets = data['results'][0]['snippets']
+        assert snippets['detected_hazards'] == "Forklift <mark>collision</mark> with pedestrians"
+        assert 'original_text' not in snippets
+
+    def test_stemming_prefix_and_punctuation(self, client, search_db):
+        assert {r['doc_id'] for r in client.get('/search?q=forklift').get_json()['results']} == {'forklift'}
+        assert len(client.get('/search?q=inspect*').get_json()['results']) == 1
+        # Query syntax characters in plain queries are searched as text
+        results = client.get('/search?q=1910.23').get_json()['results']
+        assert [r['doc_id'] for r in results] == ['ladder']
+        assert '<mark>1910</mark>.<mark>23</mark>' in results[0]['snippets']['compliance_issues']
+
+    def test_pagination_and_latest(self, client, search_db):
+        first = client.get('/search?q=aisle&limit=1').get_json()
+        assert len(first['results']) == 1
+        second = client.get(f"/search?q=aisle&limit=1&cursor={first['next_cursor']}").get_json()
+        assert second['next_cursor'] is None
+        pages = first['results'] + second['results']
+        assert sorted(r['revision_number'] for r in pages) == [1, 2]
+        latest = client.get('/search?q=aisle&latest=true').get_json()['results']
+        assert [r['revision_number'] for r in latest] == [2]
+
+    def test_raw_fts5_syntax(self, client, search_db):
+        data = client.get('/search?q=ladder OR walkways&syntax=fts5').get_json()
+        assert {r['doc_id'] for r in data['results']} == {'forklift', 'ladder'}
+        assert client.get('/search?q=detected_hazards:speed&syntax=fts5').get_json()['results'][0]['revision_number'] == 2
+        assert client.get('/search?q="unbalanced&syntax=fts5').status_code == 400
+        assert client.get('/search?q=bogus:term&syntax=fts5').status_code == 400
+
+    def test_snippets_come_from_the_search_query(self, client, search_db, monkeypatch):
+        """Results aren't fetched one by one, and only the first SEARCH_SNIPPET_TEXTS get their texts rebuilt"""
+        from app.utils import storage
+        monkeypatch.setattr(DatabaseConnection, 'get_revision', lambda *args, **kwargs: pytest.fail('fetched per result'))
+        loaded = []
+        load_text = storage.load_text
+        monkeypatch.setattr(storage, 'load_text', lambda conn, blob_id, cache=None: loaded.append(blob_id) or load_text(conn, blob_id, cache))
+        monkeypatch.setitem(app.config, 'SEARCH_SNIPPET_TEXTS', 1)
+        search_db.texts.clear()
+        results = client.get('/search?q=forklift*').get_json()['results']
+        assert len(results) == 2 and len(loaded) == 2
+        assert set(results[0]['snippets']) == {'original_text', 'revised_document', 'detected_hazards'}
+        assert set(results[1]['snippets']) == {'detected_hazards'}
+
+    def test_invalid_parameters(self, client, search_db):
+        assert client.get('/search').status_code == 400
+        assert client.get('/search?q=%2B%2B').status_code == 400
+        assert client.get('/search?q=ladder&limit=0').status_code == 400
+
+    def test_existing_revisions_are_backfilled(self, tmp_path):
+        """Upgrading a database indexes the revisions it already holds"""
+        path = str(tmp_path / 'legacy.db')
+        with sqlite3.connect(path) as conn:
+            conn.executescript('''
+                CREATE TABLE documents (doc_id TEXT PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+                CREATE TABLE revisions (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT, revision_number INTEGER,
+                    timestamp TIMESTAMP, original_text TEXT, analysis JSON, revised_document TEXT, diff TEXT);
+                INSERT INTO documents (doc_id) VALUES ('doc');
+                INSERT INTO revisions (doc_id, revision_number, timestamp, original_text, analysis, revised_document, diff)
+                VALUES ('doc', 1, '2025-01-01', 'Confined space entry', '{"detected_hazards": ["Oxygen deficiency"]}',
+                        'Confined space entry', NULL);
+            ''')
+        db = DatabaseConnection(path)
+        db.store_revision('doc', self.revision(2, "Confined space entry with permit"))
+        assert [r['revision_number'] for r in db.search_revisions('"permit"', 10)] == [2]
+        assert [r['revision_number'] for r in db.search_revisions('"oxygen"', 10)] == [1]
+        assert len(db.search_revisions('"confined"', 10)) == 2
+
+
+class TestFindingsStats:
+    @staticmethod
+    def revision(number, hazards, comments):
+        return {
+            'revision_number': number,
+            'timestamp': f'2025-01-0{number}T00:00:00+00:00',
+            'original_text': f"Text {number}",
+            'analysis': {
+                "detected_hazards": hazards,
+                "compliance_issues": ["Missing training records"],
+                "regulatory_comments": comments,
+                "accident_incidents": []
+            },
+            'revised_document': f"Revised {number}",
+            'diff': None
+        }
+
+    @pytest.fixture
+    def stats_db(self, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        test_db = DatabaseConnection(str(tmp_path / 'stats.db'))
+        test_db.store_revision('a', self.revision(1, ["Wet floor.", "Blocked exit"], {"OSHA 1910.22": "Keep floors dry"}))
+        test_db.store_revision('a', self.revision(2, ["wet  floor"], {"OSHA 1910.22": "Keep floors dry"}))
+        test_db.store_revision('b', self.revision(1, ["Wet floor", "Frayed cord"], {"NFPA 70E": "Inspect cords"}))
+        monkeypatch.setattr(audit_routes, 'db_connection', test_db)
+        return test_db
+
+    def test_top_hazards(self, client, stats_db):
+        """Findings are grouped regardless of case, spacing and a trailing full stop"""
+        data = client.get('/stats/hazards').get_json()
+        assert data['hazards'][0] == {'hazard': "Wet floor.", 'revisions': 3, 'documents': 2}
+        assert len(data['hazards']) == 3
+        assert client.get('/stats/hazards?limit=1').get_json()['hazards'] == data['hazards'][:1]
+        by_doc = client.get('/stats/hazards?doc_id=b').get_json()['hazards']
+        assert {h['hazard'] for h in by_doc} == {"Wet floor", "Frayed cord"}
+
+    def test_top_standards(self, client, stats_db):
+        data = client.get('/stats/standards').get_json()
+        assert data['standards'] == [
+            {'standard': "OSHA 1910.22", 'revisions': 2, 'documents': 1},
+            {'standard': "NFPA 70E", 'revisions': 1, 'documents': 1}
+        ]
+
+    def test_document_timeline(self, client, stats_db):
+        data = client.get('/stats/documents/a').get_json()
+        assert [(r['revision_number'], r['hazards'], r['compliance_issues'], r['regulatory_comments'])
+                for r in data['revisions']] == [(1, 2, 1, 1), (2, 1, 1, 1)]
+
+    def test_invalid_requests(self, client, stats_db):
+        assert client.get('/stats/colors').status_code == 404
+        assert client.get('/stats/hazards?doc_id=missing').status_code == 404
+        assert client.get('/stats/hazards?limit=0').status_code == 400
+        assert client.get('/stats/documents/missing').status_code == 404
+
+    def test_rebuild_matches_incremental_writes(self, stats_db):
+        from app.db.backfill import backfill
+        before = stats_db.top_findings('hazards', 10)
+        stats_db.close()
+        counts = backfill(stats_db.db_path, rebuild=True)
+        assert counts['hazards'] == 5
+        assert stats_db.top_findings('hazards', 10) == before
+        assert len(stats_db.search_revisions('"wet"', 10)) == 3
+
+
+class TestBlobDeduplication:
+    @staticmethod
+    def revision(number, text):
+        return {
+            'revision_number': number,
+            'timestamp': f'2025-01-0{number}T00:00:00+00:00',
+            'original_text': text,
+            'analysis': {"detected_hazards": []},
+            'revised_document': text + "\nRecommendation: Review annually.",
+            'diff': None
+        }
+
+    def test_identical_texts_are_stored_once(self, tmp_path):
+        db = DatabaseConnection(str(tmp_path / 'dedup.db'))
+        template = "1. Scope:\nApplies to all sites.\n2. Procedure:\nLock out before servicing.\n"
+        for doc_id in ('a', 'b', 'c'):
+            db.store_revision(doc_id, self.revision(1, template))
+        db.store_revision('d', self.revision(1, "Something else entirely\n"))
+        for doc_id in ('a', 'b', 'c'):
+            assert db.get_revision(doc_id, 1, ('original_text',))['original_text'] == template
+        stats = db.storage_stats()
+        assert stats['text_references'] == 8
+        assert stats['distinct_texts'] == stats['blobs'] == 4
+        assert stats['dedup_ratio'] == 2.0
+
+    def test_unchanged_re_audit_reuses_the_previous_blob(self, tmp_path):
+        db = DatabaseConnection(str(tmp_path / 'dedup.db'))
+        db.store_revision('a', self.revision(1, "Same text\n"))
+        db.store_revision('a', self.revision(2, "Same text\n"))
+        with sqlite3.connect(db.db_path) as conn:
+            assert conn.execute('SELECT COUNT(DISTINCT original_blob_id) FROM revisions').fetchone()[0] == 1
+
+    def test_existing_blobs_are_hashed(self, tmp_path):
+        from app.utils.storage import backfill_content_hashes
+        db = DatabaseConnection(str(tmp_path / 'dedup.db'))
+        db.store_revision('a', self.revision(1, "Legacy text\n"))
+        with db.connection() as conn:
+            conn.execute('UPDATE blobs SET content_hash = NULL')
+            backfill_content_hashes(conn)
+        db.store_revision('b', self.revision(1, "Legacy text\n"))
+        assert db.storage_stats()['blobs'] == 2
+
+    def test_storage_stats_endpoint(self, client, tmp_path, monkeypatch):
+        from app.routes import audit_routes
+        db = DatabaseConnection(str(tmp_path / 'dedup.db'))
+        db.store_revision('a', self.revision(1, "Text\n"))
+        db.store_revision('b', self.revision(1, "Text\n"))
+        monkeypatch.setattr(audit_routes, 'db_connection', db)
+        data = client.get('/stats/storage').get_json()
+        assert data['storage']['dedup_ratio'] == 2.0
+        assert 'hit_rate' in data['analysis_cache']